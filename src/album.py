@@ -0,0 +1,42 @@
+import asyncio
+from typing import Any
+
+from config import ALBUM_DEBOUNCE, ALBUM_MAX_PAGES
+
+
+class AlbumCollector:
+    """
+    Собирает фото одного альбома (media_group_id): Telegram присылает каждое фото альбома
+    отдельным сообщением почти одновременно. Первое сообщение ждет, пока в течение `debounce`
+    секунд не придет ни одного нового, и получает весь альбом; остальные получают None.
+    Альбом собирается в пределах процесса: при нескольких воркерах webhook страницы,
+    попавшие в разные процессы, обрабатываются как отдельные альбомы.
+    """
+
+    # Набрав `max_pages` страниц, альбом больше не ждет (в альбоме Telegram не больше 10 фото)
+    def __init__(self, debounce: float = ALBUM_DEBOUNCE, max_pages: int = ALBUM_MAX_PAGES):
+        self.debounce = debounce
+        self.max_pages = max_pages
+        self._albums: dict[str, list] = {}
+
+    async def collect(self, group_id: str, message: Any) -> list | None:
+        """Добавляет сообщение в альбом. Возвращает все сообщения альбома по порядку или None."""
+        messages = self._albums.get(group_id)
+        if messages is not None:
+            messages.append(message)
+            return None
+
+        messages = self._albums[group_id] = [message]
+        try:
+            while len(messages) < self.max_pages:
+                count = len(messages)
+                await asyncio.sleep(self.debounce)
+                if len(messages) == count:
+                    break
+        finally:
+            del self._albums[group_id]
+        # Страницы, пришедшие после закрытия альбома, станут новым альбомом
+        return sorted(messages, key=lambda m: m.message_id)
+
+
+album_collector = AlbumCollector()
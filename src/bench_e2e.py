@@ -0,0 +1,227 @@
+"""
+Сквозной нагрузочный бенчмарк handle_photo: N одновременных пользователей присылают фото меню,
+модель, Pexels и Telegram заменены локальными заглушками из bench_fakes.
+Выводит p50/p95/p99 по этапам конвейера, пропускную способность, ошибки и память.
+Запуск из каталога src: python bench_e2e.py --users 20 --photos 3
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+MODES = {
+    "default": {"STREAMING_MODE": "false", "TWO_PHASE_MODE": "false", "TILING_MODE": "false"},
+    "streaming": {"STREAMING_MODE": "true", "TWO_PHASE_MODE": "false", "TILING_MODE": "false"},
+    "two-phase": {"STREAMING_MODE": "false", "TWO_PHASE_MODE": "true", "TILING_MODE": "false"},
+    # Высокие фото (--dishes 40) распознаются по частям
+    "tiling": {"STREAMING_MODE": "false", "TWO_PHASE_MODE": "false", "TILING_MODE": "true"},
+}
+
+# Этапы в порядке конвейера (metrics.span в pipeline и handlers) и полное время handle_photo
+STAGE_ORDER = ("download", "cache", "check", "preprocess", "model", "parse", "images", "render", "send", "total")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="одновременных пользователей")
+    parser.add_argument("--photos", type=int, default=3, help="фото от каждого пользователя подряд")
+    parser.add_argument("--dishes", type=int, default=0, help="блюд в меню (0 — как в корпусе)")
+    parser.add_argument("--duplicate-rate", type=float, default=0.2,
+                        help="доля фото, повторяющих уже отправленное (singleflight и кэш меню)")
+    parser.add_argument("--bad-photos", type=float, default=0.0,
+                        help="доля размытых, темных и пустых фото, которые должна отклонить проверка фото")
+    parser.add_argument("--mode", choices=MODES, default="default")
+    parser.add_argument("--model-latency", type=float, default=1.5, help="медиана до первого токена, с")
+    parser.add_argument("--model-speed", type=float, default=2000, help="скорость генерации, символов/с")
+    parser.add_argument("--model-errors", type=float, default=0.0, help="доля ошибок модели")
+    parser.add_argument("--pexels-latency", type=float, default=0.25)
+    parser.add_argument("--pexels-429", type=float, default=0.0, help="доля ответов 429 от Pexels")
+    parser.add_argument("--pexels-errors", type=float, default=0.0, help="доля ответов 500 от Pexels")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="считать пик памяти Python (заметно замедляет CPU-этапы)")
+    parser.add_argument("--verbose", action="store_true", help="показывать лог конвейера")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="сохранить отчет в JSON для сравнения прогонов")
+    return parser.parse_args()
+
+
+def configure_environment(args: argparse.Namespace, tmp: str):
+    """
+    Настройки читаются при импорте config, поэтому задаются до импорта модулей бота.
+    Кэши создаются заново в каждом прогоне, лимиты пользователей и бюджет Pexels не мешают нагрузке.
+    """
+    os.environ.update(MODES[args.mode])
+    os.environ["CACHE_DB_PATH"] = os.path.join(tmp, "bench.sqlite3")
+    os.environ["STATE_BACKEND"] = "memory"
+    os.environ.setdefault("USER_MAX_JOBS_PER_MINUTE", "1000000")
+    os.environ.setdefault("PEXELS_HOURLY_BUDGET", "1000000")
+    os.environ.setdefault("PEXELS_MONTHLY_BUDGET", "1000000")
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class StageTimer:
+    """Собирает все длительности этапов, чтобы считать точные перцентили, а не по корзинам гистограммы."""
+
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+
+    def record(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
+    def report(self) -> dict:
+        return {
+            stage: {
+                "count": len(self.samples[stage]),
+                "p50": percentile(self.samples[stage], 50) * 1000,
+                "p95": percentile(self.samples[stage], 95) * 1000,
+                "p99": percentile(self.samples[stage], 99) * 1000,
+            }
+            for stage in STAGE_ORDER if self.samples.get(stage)
+        }
+
+
+def make_workload(args: argparse.Namespace, menus: list[list[dict]], telegram) -> list[list]:
+    """
+    Фото для каждого пользователя. Часть фото повторяет уже загруженные другими пользователями,
+    часть (`--bad-photos`) непригодна для распознавания.
+    """
+    from bench_fakes import render_bad_photo, render_menu_photo
+
+    uploaded = []
+    workload = []
+    for user in range(args.users):
+        photos = []
+        for n in range(args.photos):
+            if uploaded and random.random() < args.duplicate_rate:
+                photos.append(random.choice(uploaded))
+                continue
+            variant = user * args.photos + n
+            render = render_bad_photo if random.random() < args.bad_photos else render_menu_photo
+            photo = telegram.upload(render(menus[variant % len(menus)], variant))
+            uploaded.append(photo)
+            photos.append(photo)
+        workload.append(photos)
+    return workload
+
+
+async def run(args: argparse.Namespace) -> dict:
+    import metrics
+    from bench_fakes import FakeModelProvider, FakePexels, FakeTelegram, Latency, load_corpus, photo_catalog
+    from handlers import handle_photo
+    from job_queue import job_queue
+    from model_client import ModelClient
+    from runtime import close_runtime, get_runtime
+
+    random.seed(args.seed)
+    menus = load_corpus(args.dishes or None)
+    model = FakeModelProvider(menus, Latency(args.model_latency), args.model_errors, args.model_speed)
+    pexels = FakePexels(Latency(args.pexels_latency), args.pexels_429, args.pexels_errors,
+                        catalog=photo_catalog(menus))
+    telegram = FakeTelegram(Latency(args.telegram_latency))
+
+    runtime = get_runtime()
+    client = ModelClient([model], hedging=False)
+    runtime.provide("model_client", client)
+    runtime.provide("prompt_client", client)
+    runtime.provide("pexels_client", pexels.client())
+
+    timer = StageTimer()
+    metrics.add_span_listener(timer.record)
+
+    workload = make_workload(args, menus, telegram)
+    outcomes = defaultdict(int)
+
+    async def user(user_id: int, photos: list):
+        for photo in photos:
+            message = telegram.message(user_id, photo)
+            started = time.perf_counter()
+            await handle_photo(message)
+            timer.samples["total"].append(time.perf_counter() - started)
+            outcomes["ok" if message.document else "failed"] += 1
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(user(user_id, photos) for user_id, photos in enumerate(workload, 1)))
+    finally:
+        elapsed = time.perf_counter() - started
+        await job_queue.stop()
+        menu_cache = runtime.menu_cache.stats()
+        image_cache = runtime.image_cache.stats()
+        await close_runtime()
+
+    report = {
+        "mode": args.mode,
+        "users": args.users,
+        "photos": args.users * args.photos,
+        "elapsed_s": elapsed,
+        "throughput_per_min": outcomes["ok"] / elapsed * 60,
+        "outcomes": dict(outcomes),
+        "stages_ms": timer.report(),
+        "model": {
+            "requests": model.requests,
+            "failures": model.failures,
+            "input_tokens": metrics.MODEL_TOKENS.values.get((model.name, "input"), 0),
+            "output_tokens": metrics.MODEL_TOKENS.values.get((model.name, "output"), 0),
+        },
+        "pexels_statuses": dict(pexels.statuses),
+        "photo_checks": {result: count for (result,), count in metrics.PHOTO_CHECKS.values.items()},
+        "telegram_calls": dict(telegram.calls),
+        "menu_cache": menu_cache,
+        "image_cache": image_cache,
+        # На Linux ru_maxrss в килобайтах, на macOS — в байтах
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024),
+    }
+    if args.tracemalloc:
+        report["python_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return report
+
+
+def print_report(report: dict):
+    print(f"\nРежим {report['mode']}: {report['users']} пользователей, {report['photos']} фото "
+          f"за {report['elapsed_s']:.1f} с, {report['throughput_per_min']:.1f} меню/мин, исходы: {report['outcomes']}")
+    print(f"{'stage':>10} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, row in report["stages_ms"].items():
+        print(f"{stage:>10} {row['count']:>7} {row['p50']:>9.1f} {row['p95']:>9.1f} {row['p99']:>9.1f}")
+    print(f"Модель: {report['model']}, Pexels: {report['pexels_statuses']}, Telegram: {report['telegram_calls']}")
+    print(f"Проверка фото: {report['photo_checks']}")
+    print(f"Кэш меню: {report['menu_cache']}")
+    print(f"Кэш картинок: {report['image_cache']}")
+    memory = f"Память: max RSS {report['max_rss_mb']:.0f} МБ"
+    if "python_peak_mb" in report:
+        memory += f", пик Python {report['python_peak_mb']:.1f} МБ"
+    print(memory)
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(args, tmp)
+        # Конвейер печатает каждый шаг, под нагрузкой это тысячи строк
+        log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with log:
+            report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+"""
+Локальные заменители внешних сервисов для бенчмарков: модель (вместо Gemini и других провайдеров),
+поиск Pexels и Telegram Bot API. Ответы берутся из корпуса bench_corpus/, задержки и ошибки
+задаются распределениями, поэтому конвейер можно нагружать без ключей API и без расхода квот.
+"""
+import asyncio
+import glob
+import io
+import json
+import math
+import os
+import random
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+
+import httpx
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from dish import (
+    COMPACT_MENU_KEY, COMPACT_PARTIAL_KEY, COMPACT_RESPONSE_SCHEMA, EXTRACT_RESPONSE_SCHEMA,
+    CATEGORY_LABELS, Category, FLAGS_BY_VALUE, Flag,
+)
+from image_fetcher import CATEGORY_QUERIES
+from metrics import record_tokens
+from model_client import ModelRequest, ModelResponse, Provider
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "bench_corpus")
+
+# Примерная скорость генерации модели и размер фрагмента потокового ответа
+OUTPUT_CHARS_PER_SECOND = 400
+STREAM_CHUNK_CHARS = 200
+# Столько входных токенов Gemini считает за одно изображение
+IMAGE_TOKENS = 258
+
+CATEGORIES_BY_LABEL = {label: category for category, label in CATEGORY_LABELS.items()}
+
+
+@dataclass
+class Latency:
+    """Логнормальная задержка: `median` — медиана в секундах, `sigma` задает длину хвоста."""
+    median: float
+    sigma: float = 0.4
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(random.gauss(0, self.sigma))
+
+
+def photo_catalog(menus: list[list[dict]], coverage: float = 0.6) -> list[str]:
+    """
+    Описания фото для пакетной выдачи FakePexels: название блюда и категория по-английски.
+    Фото есть только у доли `coverage` блюд, остальные ищутся по одному. Описания строятся
+    из самих названий, поэтому каталог проверяет число запросов, а не точность подбора.
+    """
+    catalog = []
+    for menu in menus:
+        for dish in menu:
+            if zlib.crc32(dish["originalName"].encode()) % 100 < coverage * 100:
+                category = CATEGORY_QUERIES.get(dish.get("category", ""), "dish")
+                catalog.append(f"{dish['originalName']} {category} on a plate")
+    return catalog
+
+
+def load_corpus(dishes: int | None = None) -> list[list[dict]]:
+    """
+    Меню из bench_corpus/*.json. Если задано `dishes`, каждое меню обрезается или дополняется
+    копиями своих блюд с номером в названии до указанного количества.
+    """
+    menus = []
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            menu = json.load(f)["menu"]
+        if dishes:
+            resized = menu[:dishes]
+            for i in range(len(menu), dishes):
+                dish = menu[i % len(menu)]
+                resized.append(dict(dish, originalName=f"{dish['originalName']} {i // len(menu) + 1}"))
+            menu = resized
+        menus.append(menu)
+    return menus
+
+
+def _load_font(size: int):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def render_menu_photo(menu: list[dict], variant: int = 0, width: int = 1080) -> bytes:
+    """
+    Синтетическое фото меню: названия и цены блюд на светлом фоне с полями.
+    `variant` перемешивает порядок блюд, сдвигает текст и меняет фон, поэтому разные варианты
+    одного меню не считаются кэшем меню одним снимком. Длинные меню дают высокие фото,
+    которые конвейер распознает по частям.
+    """
+    rng = random.Random(variant)
+    font = _load_font(28)
+    line_height = 44
+    height = max(width * 4 // 3, 240 + line_height * len(menu))
+    shade = 250 - variant % 8
+    image = Image.new("RGB", (width, height), (shade, shade - 4, shade - 12))
+    draw = ImageDraw.Draw(image)
+    # Темные плашки (логотип, фото блюд, рамки) делают уменьшенные копии разных вариантов непохожими
+    for _ in range(4):
+        x, y = rng.randrange(width - 200), rng.randrange(height - 200)
+        tone = rng.randrange(40, 200)
+        draw.rectangle((x, y, x + rng.randrange(80, 200), y + rng.randrange(80, 200)), fill=(tone, tone - 20, tone - 30))
+    left, top = 100 + variant % 5 * 7, 100 + variant % 7 * 11
+    menu = list(menu)
+    rng.shuffle(menu)
+    for i, dish in enumerate(menu):
+        y = top + i * line_height
+        draw.text((left, y), dish["originalName"], fill=(30, 30, 30), font=font)
+        draw.text((width - 300, y), dish.get("price") or "", fill=(30, 30, 30), font=font)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def render_bad_photo(menu: list[dict], variant: int = 0, width: int = 1080) -> bytes:
+    """
+    Фото, которое локальная проверка должна отклонить: по очереди размытый снимок меню,
+    темный снимок и однотонная стена без текста.
+    """
+    image = Image.open(io.BytesIO(render_menu_photo(menu, variant, width)))
+    kind = variant % 3
+    if kind == 0:
+        image = image.filter(ImageFilter.GaussianBlur(5))
+    elif kind == 1:
+        image = image.point(lambda v: 20 + v // 10)
+    else:
+        image = Image.new("RGB", image.size, (180 + variant % 40, 170, 160))
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _compact_dish(dish: dict) -> dict:
+    return {
+        "n": dish["originalName"],
+        "t": dish["translatedName"],
+        "c": CATEGORIES_BY_LABEL.get(dish.get("category"), Category.OTHER).value,
+        "pr": dish.get("price") or "",
+        "s": dish.get("shortDescription") or "",
+        "i": dish.get("ingredients") or [],
+        "g": FLAGS_BY_VALUE.get(dish.get("containsGluten"), Flag.UNKNOWN).value,
+        "m": FLAGS_BY_VALUE.get(dish.get("containsMilk"), Flag.UNKNOWN).value,
+    }
+
+
+class FakeModelProvider(Provider):
+    """
+    Провайдер модели, отвечающий меню из корпуса. Меню выбирается по содержимому изображения,
+    поэтому одно и то же фото всегда дает один ответ. Формат ответа зависит от запроса:
+    компактная схема, схема первой фазы двухфазного режима, текстовый запрос на перевод
+    названий (two_phase.TRANSLATE_PROMPT) или обычный JSON. Время ответа — задержка до первого токена
+    плюс генерация со скоростью `chars_per_second`; `error_rate` — доля запросов с ошибкой.
+    """
+
+    name = "fake"
+
+    def __init__(self, menus: list[list[dict]], latency: Latency = Latency(1.5), error_rate: float = 0.0,
+                 chars_per_second: float = OUTPUT_CHARS_PER_SECOND):
+        self.menus = menus
+        self.latency = latency
+        self.error_rate = error_rate
+        self.chars_per_second = chars_per_second
+        self.dishes = {dish["originalName"]: dish for menu in menus for dish in menu}
+        self.requests = 0
+        self.failures = 0
+
+    def _menu_for(self, image: dict) -> list[dict]:
+        return self.menus[zlib.crc32(image["data"]) % len(self.menus)]
+
+    def _answer(self, request: ModelRequest) -> str:
+        images = [part for part in request.parts if isinstance(part, dict)]
+        if not images:
+            # Перевод пачки названий: фрагмент текста стоит между строками "---"
+            text = "".join(part for part in request.parts if isinstance(part, str))
+            section = text.split("---")[1] if text.count("---") >= 2 else ""
+            names = [line.strip() for line in section.splitlines() if line.strip()]
+            found = [self.dishes[name] for name in names if name in self.dishes]
+            return "```json\n" + json.dumps(found, ensure_ascii=False) + "\n```"
+
+        menu = self._menu_for(images[0])
+        if request.json_schema is EXTRACT_RESPONSE_SCHEMA:
+            items = [{"n": dish["originalName"], "c": _compact_dish(dish)["c"], "pr": dish.get("price") or ""}
+                     for dish in menu]
+            return json.dumps({COMPACT_PARTIAL_KEY: False, COMPACT_MENU_KEY: items}, ensure_ascii=False)
+        if request.json_schema is COMPACT_RESPONSE_SCHEMA:
+            items = [_compact_dish(dish) for dish in menu]
+            return json.dumps({COMPACT_PARTIAL_KEY: False, COMPACT_MENU_KEY: items}, ensure_ascii=False)
+        return "```json\n" + json.dumps({"isPartial": False, "menu": menu}, ensure_ascii=False) + "\n```"
+
+    def _tokens(self, request: ModelRequest, text: str) -> tuple[int, int]:
+        prompt = sum(len(part) for part in request.parts if isinstance(part, str))
+        images = sum(1 for part in request.parts if isinstance(part, dict))
+        return prompt // 4 + IMAGE_TOKENS * images, len(text) // 4
+
+    async def _first_token(self):
+        self.requests += 1
+        delay = self.latency.sample()
+        if random.random() < self.error_rate:
+            self.failures += 1
+            await asyncio.sleep(delay / 2)
+            raise RuntimeError("fake model: 503 Service Unavailable")
+        await asyncio.sleep(delay)
+
+    async def generate(self, request: ModelRequest) -> ModelResponse:
+        await self._first_token()
+        text = self._answer(request)
+        await asyncio.sleep(len(text) / self.chars_per_second)
+        input_tokens, output_tokens = self._tokens(request, text)
+        return ModelResponse(text, self.name, input_tokens, output_tokens)
+
+    async def stream(self, request: ModelRequest):
+        await self._first_token()
+        text = self._answer(request)
+        for start in range(0, len(text), STREAM_CHUNK_CHARS):
+            await asyncio.sleep(STREAM_CHUNK_CHARS / self.chars_per_second)
+            yield text[start:start + STREAM_CHUNK_CHARS]
+        record_tokens(self.name, *self._tokens(request, text))
+
+
+@dataclass
+class FakePexels:
+    """
+    Поиск Pexels на httpx.MockTransport: отвечает фото со всеми вариантами размеров
+    и заголовками X-Ratelimit-*. Доли ответов 429, 500 и пустой выдачи настраиваются.
+    Выдача больше одного фото берется из `catalog` (описания фото, совпадающие со словами запроса)
+    и дополняется фото с описанием из самого запроса.
+    """
+    latency: Latency = field(default_factory=lambda: Latency(0.25))
+    rate_limit_rate: float = 0.0
+    error_rate: float = 0.0
+    miss_rate: float = 0.05
+    catalog: list[str] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+
+    def _photos(self, query: str, per_page: int) -> list[dict]:
+        if per_page == 1:
+            return [] if random.random() < self.miss_rate else [self._photo(query)]
+        words = set(query.lower().split()) - {"food", "drink"}
+        found = [alt for alt in self.catalog if words & set(alt.lower().split())]
+        found += [f"{query} {n}" for n in range(1, per_page // 4)]
+        return [self._photo(alt) for alt in found[:per_page]]
+
+    def _photo(self, query: str) -> dict:
+        photo_id = zlib.crc32(query.encode()) % 9_000_000 + 1_000_000
+        base = f"https://images.pexels.com/photos/{photo_id}/pexels-photo-{photo_id}.jpeg"
+        return {
+            "id": photo_id,
+            "width": 6000,
+            "height": 4000,
+            "alt": query,
+            "src": {
+                "original": base,
+                "large": f"{base}?auto=compress&cs=tinysrgb&h=650&w=940",
+                "medium": f"{base}?auto=compress&cs=tinysrgb&h=350",
+                "small": f"{base}?auto=compress&cs=tinysrgb&h=130",
+                "tiny": f"{base}?auto=compress&cs=tinysrgb&dpr=1&fit=crop&h=200&w=280",
+            },
+        }
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.latency.sample())
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            response = httpx.Response(429, headers={"Retry-After": "1"}, text="Too Many Requests")
+        elif roll < self.rate_limit_rate + self.error_rate:
+            response = httpx.Response(500, text="Internal Server Error")
+        else:
+            query = request.url.params.get("query", "")
+            per_page = int(request.url.params.get("per_page", 1))
+            headers = {"X-Ratelimit-Limit": "1000000", "X-Ratelimit-Remaining": "999999"}
+            response = httpx.Response(200, headers=headers,
+                                      json={"photos": self._photos(query, per_page), "per_page": per_page})
+        self.statuses[response.status_code] += 1
+        return response
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle), timeout=15.0)
+
+
+@dataclass
+class FakeTelegram:
+    """
+    Заменитель Telegram Bot API для handle_photo: хранит «загруженные» фото, отдает их через
+    download и имитирует задержку каждого вызова API. Учитывает вызовы и отправленные документы.
+    """
+    latency: Latency = field(default_factory=lambda: Latency(0.05))
+    files: dict[str, bytes] = field(default_factory=dict)
+    calls: Counter = field(default_factory=Counter)
+    documents: list[tuple[int, int]] = field(default_factory=list)
+    message_count: int = 0
+
+    async def call(self, method: str):
+        self.calls[method] += 1
+        await asyncio.sleep(self.latency.sample())
+
+    def upload(self, data: bytes) -> list[SimpleNamespace]:
+        """Регистрирует фото и возвращает варианты размеров, как в message.photo."""
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+        file_id = f"{zlib.crc32(data):08x}{len(data):x}"
+        self.files[file_id] = data
+        sizes = []
+        for side in (90, 320, 800, max(width, height)):
+            scale = min(1.0, side / max(width, height))
+            sizes.append(SimpleNamespace(file_id=file_id, file_unique_id=f"u{file_id}", file_size=len(data),
+                                         width=round(width * scale), height=round(height * scale)))
+        return sizes
+
+    async def download(self, photo) -> io.BytesIO:
+        await self.call("getFile")
+        return io.BytesIO(self.files[photo.file_id])
+
+    def message(self, user_id: int, photo: list[SimpleNamespace], media_group_id: str | None = None) -> "FakeMessage":
+        return FakeMessage(self, SimpleNamespace(id=user_id), photo, media_group_id)
+
+
+class FakeMessage:
+    """Сообщение с фото в объеме, который использует handlers.handle_photo."""
+
+    def __init__(self, telegram: FakeTelegram, from_user, photo=None, media_group_id: str | None = None):
+        telegram.message_count += 1
+        self.message_id = telegram.message_count
+        self.telegram = telegram
+        self.from_user = from_user
+        self.photo = photo
+        self.media_group_id = media_group_id
+        self.bot = SimpleNamespace(download=telegram.download)
+        self.text = None
+        self.document = None
+
+    async def answer(self, text: str, **kwargs) -> "FakeMessage":
+        await self.telegram.call("sendMessage")
+        reply = FakeMessage(self.telegram, self.from_user)
+        reply.text = text
+        return reply
+
+    async def edit_text(self, text: str, **kwargs):
+        await self.telegram.call("editMessageText")
+        self.text = text
+
+    async def delete(self):
+        await self.telegram.call("deleteMessage")
+
+    async def answer_document(self, document, caption: str | None = None, **kwargs):
+        await self.telegram.call("sendDocument")
+        self.telegram.documents.append((self.from_user.id, len(document.data)))
+        self.document = document
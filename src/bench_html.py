@@ -0,0 +1,75 @@
+"""
+Микробенчмарк рендеринга HTML-меню на 10, 500 и 10 000 блюдах.
+Запуск из каталога src: python bench_html.py
+"""
+import io
+import os
+import tempfile
+import time
+
+from html_generator import render_html_menu, write_html_menu
+
+SIZES = (10, 500, 10_000)
+CATEGORIES = ("закуска", "суп", "салат", "основное блюдо", "гарнир", "десерт", "напиток")
+
+
+def make_menu(count: int) -> list[dict]:
+    """Синтетическое меню: разные категории, аллергены и символы, требующие экранирования."""
+    return [
+        {
+            "originalName": f"Plat n°{i} <spécial> & \"maison\"",
+            "translatedName": f"Блюдо №{i} от шефа",
+            "image": f"https://images.pexels.com/photos/{i}/pexels-photo-{i}.jpeg?auto=compress&h=350" if i % 4 else None,
+            "imageSrcset": [
+                [f"https://images.pexels.com/photos/{i}/pexels-photo-{i}.jpeg?auto=compress&cs=tinysrgb&dpr=1&fit=crop&h=200&w=280", 280],
+                [f"https://images.pexels.com/photos/{i}/pexels-photo-{i}.jpeg?auto=compress&cs=tinysrgb&h=350", 525],
+                [f"https://images.pexels.com/photos/{i}/pexels-photo-{i}.jpeg?auto=compress&cs=tinysrgb&h=650&w=940", 940],
+            ] if i % 4 else [],
+            "imageSize": [525, 350] if i % 4 else None,
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "price": f"{10 + i % 40},{i % 100:02d} €",
+            "shortDescription": "Нежное блюдо с ароматными травами и хрустящей корочкой",
+            "ingredients": ["мука", "сливки", "базилик"] if i % 3 else ["неизвестно"],
+            "containsGluten": "yes" if i % 2 else "no",
+            "containsMilk": "yes" if i % 5 else "unknown",
+        }
+        for i in range(count)
+    ]
+
+
+def measure(fn, repeat: int) -> float:
+    """Лучшее время одного вызова из `repeat` запусков, в миллисекундах."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def write_file(menu: list[dict], path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        write_html_menu(menu, f, lean=False)
+
+
+def main():
+    print(f"{'dishes':>8} {'render ms':>10} {'buffer ms':>10} {'file ms':>10} {'dishes/s':>12} {'size KB':>9} "
+          f"{'lean ms':>9} {'lean KB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "menu.html")
+        for count in SIZES:
+            menu = make_menu(count)
+            repeat = max(3, 2000 // count)
+            render_ms = measure(lambda: render_html_menu(menu, lean=False), repeat)
+            buffer_ms = measure(lambda: write_html_menu(menu, io.StringIO(), lean=False), repeat)
+            file_ms = measure(lambda: write_file(menu, path), repeat)
+            size_kb = len(render_html_menu(menu, lean=False).encode("utf-8")) / 1024
+            # Облегченная страница без бюджета: полный вариант со srcset
+            lean_ms = measure(lambda: render_html_menu(menu, lean=True, byte_budget=0), repeat)
+            lean_kb = len(render_html_menu(menu, lean=True, byte_budget=0).encode("utf-8")) / 1024
+            print(f"{count:>8} {render_ms:>10.2f} {buffer_ms:>10.2f} {file_ms:>10.2f} "
+                  f"{count / render_ms * 1000:>12.0f} {size_kb:>9.0f} {lean_ms:>9.2f} {lean_kb:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+from config import CACHE_DB_PATH
+
+# Сколько секунд ждать, пока другой процесс (воркер webhook) держит блокировку записи базы
+BUSY_TIMEOUT = 5.0
+
+if TYPE_CHECKING:
+    from state import StateBackend
+
+
+class PersistentCache:
+    """
+    Простой персистентный кэш ключ-значение поверх SQLite с TTL и LRU-вытеснением.
+    Значения хранятся в виде JSON. Все таблицы живут в одном файле базы.
+    `shared` — общее хранилище второго уровня для нескольких узлов: асинхронные методы
+    ищут в нем локальные промахи и дублируют туда записи.
+    """
+
+    def __init__(self, name: str, ttl: int, max_entries: int, db_path: str = CACHE_DB_PATH,
+                 shared: "StateBackend | None" = None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        # WAL позволяет читать во время записи из другого процесса, а запись ждет блокировку вместо ошибки
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.name} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.name}_accessed ON {self.name}(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Any | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, created_at FROM {self.name} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute(f"UPDATE {self.name} SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.name} (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        # Сначала удаляем протухшие записи, затем самые давно использованные сверх лимита
+        cursor = self._conn.execute(f"DELETE FROM {self.name} WHERE created_at < ?", (now - self.ttl,))
+        self.evictions += max(cursor.rowcount, 0)
+        count = self._conn.execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.name} WHERE key IN "
+                f"(SELECT key FROM {self.name} ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
+
+    def _set_many(self, values: dict[str, Any]):
+        for key, value in values.items():
+            self.set(key, value)
+
+    def _shared_key(self, key: str) -> str:
+        return f"cache:{self.name}:{key}"
+
+    async def shared_get_many(self, keys: list[str]) -> dict[str, Any]:
+        """Ищет ключи в общем хранилище и сохраняет найденное локально. Без общего хранилища ничего не находит."""
+        if self.shared is None or not keys:
+            return {}
+        values = await self.shared.get_many([self._shared_key(key) for key in keys])
+        found = {key: value for key, value in zip(keys, values) if value is not None}
+        if found:
+            self.shared_hits += len(found)
+            await asyncio.to_thread(self._set_many, found)
+        return found
+
+    async def shared_set(self, key: str, value: Any):
+        if self.shared is not None:
+            await self.shared.set(self._shared_key(key), value, self.ttl)
+
+    async def aget(self, key: str) -> Any | None:
+        value = await asyncio.to_thread(self.get, key)
+        if value is None and self.shared is not None:
+            value = (await self.shared_get_many([key])).get(key)
+        return value
+
+    async def aset(self, key: str, value: Any):
+        await asyncio.to_thread(self.set, key, value)
+        await self.shared_set(key, value)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -6,4 +6,145 @@ load_dotenv()
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
\ No newline at end of file
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+PEXELS_API_KEY = os.getenv('PEXELS_API_KEY')
+
+# Персистентный кэш (SQLite)
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', os.path.join(os.path.dirname(__file__), '..', 'cache', 'dishlingo.sqlite3'))
+MENU_CACHE_TTL = int(os.getenv('MENU_CACHE_TTL', 7 * 24 * 3600))
+MENU_CACHE_MAX_ENTRIES = int(os.getenv('MENU_CACHE_MAX_ENTRIES', 5000))
+# Поиск пережатых копий снимка: максимальное расстояние Хэмминга между 64-битными перцептивными хэшами
+# (0 — выключен, совпадают только тот же файл и те же байты) и между 256-битными отпечатками,
+# которыми проверяется похожий кандидат. Пороги не подобраны на реальных фото, а разные меню
+# одной верстки дают почти одинаковые хэши, поэтому по умолчанию поиск выключен
+MENU_CACHE_HASH_DISTANCE = int(os.getenv('MENU_CACHE_HASH_DISTANCE', 0))
+MENU_CACHE_FINGERPRINT_DISTANCE = int(os.getenv('MENU_CACHE_FINGERPRINT_DISTANCE', 12))
+
+# Кэш картинок Pexels: нормализованный запрос блюда -> URL изображения
+IMAGE_CACHE_TTL = int(os.getenv('IMAGE_CACHE_TTL', 30 * 24 * 3600))
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv('IMAGE_CACHE_MAX_ENTRIES', 50000))
+
+# Планировщик запросов к Pexels
+PEXELS_INITIAL_CONCURRENCY = int(os.getenv('PEXELS_INITIAL_CONCURRENCY', 5))
+PEXELS_MIN_CONCURRENCY = int(os.getenv('PEXELS_MIN_CONCURRENCY', 1))
+PEXELS_MAX_CONCURRENCY = int(os.getenv('PEXELS_MAX_CONCURRENCY', 20))
+PEXELS_TARGET_LATENCY = float(os.getenv('PEXELS_TARGET_LATENCY', 1.5))
+PEXELS_HOURLY_BUDGET = int(os.getenv('PEXELS_HOURLY_BUDGET', 200))
+PEXELS_MONTHLY_BUDGET = int(os.getenv('PEXELS_MONTHLY_BUDGET', 20000))
+PEXELS_MAX_RETRIES = int(os.getenv('PEXELS_MAX_RETRIES', 3))
+# Сколько секунд запрос может ждать восстановления квоты, прежде чем блюдо останется без картинки
+PEXELS_MAX_WAIT = float(os.getenv('PEXELS_MAX_WAIT', 10))
+
+# Пакетный поиск картинок: один запрос с большой выдачей на группу похожих блюд меню,
+# картинки раздаются по совпадению всех слов названия с описанием фото, остальные блюда ищутся по одному.
+# Выключен по умолчанию: описания фото Pexels английские, а названия блюд обычно нет
+PEXELS_BATCH_SEARCH = os.getenv('PEXELS_BATCH_SEARCH', 'false').lower() in ('1', 'true', 'yes')
+PEXELS_BATCH_PER_PAGE = int(os.getenv('PEXELS_BATCH_PER_PAGE', 80))
+PEXELS_BATCH_MIN_GROUP = int(os.getenv('PEXELS_BATCH_MIN_GROUP', 2))
+
+# Потоковый режим: блюда разбираются из ответа Gemini по мере генерации,
+# а поиск картинок для них начинается сразу
+STREAMING_MODE = os.getenv('STREAMING_MODE', 'false').lower() in ('1', 'true', 'yes')
+
+# Обработка больших фото по частям (колонки/перекрывающиеся тайлы), по умолчанию выключена
+TILING_MODE = os.getenv('TILING_MODE', 'false').lower() in ('1', 'true', 'yes')
+# Фото с длинной стороной от этого значения (в пикселях) делятся на части
+TILING_MIN_SIDE = int(os.getenv('TILING_MIN_SIDE', 1600))
+TILING_MAX_TILE_SIDE = int(os.getenv('TILING_MAX_TILE_SIDE', 1024))
+# Доля перекрытия соседних тайлов, чтобы строки на стыках не терялись
+TILING_OVERLAP = float(os.getenv('TILING_OVERLAP', 0.12))
+
+# Альбомы (несколько страниц меню одним сообщением): сколько секунд ждать следующую страницу,
+# максимум страниц и распознавание всех страниц одним запросом вместо параллельных запросов по странице
+ALBUM_DEBOUNCE = float(os.getenv('ALBUM_DEBOUNCE', 1.5))
+ALBUM_MAX_PAGES = int(os.getenv('ALBUM_MAX_PAGES', 10))
+ALBUM_SINGLE_REQUEST = os.getenv('ALBUM_SINGLE_REQUEST', 'false').lower() in ('1', 'true', 'yes')
+
+# Локальная проверка фото перед запросом к модели: снимки без читаемого текста отклоняются сразу.
+# Пороги подобраны только на синтетических фото, поэтому по умолчанию проверка выключена.
+# Пороги: длинная сторона самого большого варианта фото в пикселях, разброс яркости,
+# резкость (дисперсия лапласиана) и доля областей с текстом
+PHOTO_CHECK = os.getenv('PHOTO_CHECK', 'false').lower() in ('1', 'true', 'yes')
+PHOTO_CHECK_MIN_SIDE = int(os.getenv('PHOTO_CHECK_MIN_SIDE', 400))
+PHOTO_CHECK_MIN_CONTRAST = float(os.getenv('PHOTO_CHECK_MIN_CONTRAST', 12))
+PHOTO_CHECK_MIN_SHARPNESS = float(os.getenv('PHOTO_CHECK_MIN_SHARPNESS', 25))
+PHOTO_CHECK_MIN_TEXT_DENSITY = float(os.getenv('PHOTO_CHECK_MIN_TEXT_DENSITY', 0.04))
+
+# Профиль предобработки фото перед отправкой в модель: fast | balanced | quality
+IMAGE_QUALITY_PROFILE = os.getenv('IMAGE_QUALITY_PROFILE', 'balanced')
+
+# Облегченный HTML: lazy-загрузка и srcset картинок, минифицированная разметка, встроенная заглушка
+LEAN_HTML = os.getenv('LEAN_HTML', 'false').lower() in ('1', 'true', 'yes')
+# Бюджет размера облегченной страницы в байтах (0 — без ограничения)
+HTML_BYTE_BUDGET = int(os.getenv('HTML_BYTE_BUDGET', 300 * 1024))
+
+# Очередь задач обработки меню
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 8))
+JOB_QUEUE_MAX_SIZE = int(os.getenv('JOB_QUEUE_MAX_SIZE', 100))
+USER_MAX_CONCURRENT_JOBS = int(os.getenv('USER_MAX_CONCURRENT_JOBS', 1))
+USER_MAX_JOBS_PER_MINUTE = int(os.getenv('USER_MAX_JOBS_PER_MINUTE', 6))
+
+# Компактный structured output: короткие ключи и перечисления по JSON-схеме вместо свободного JSON
+COMPACT_SCHEMA = os.getenv('COMPACT_SCHEMA', 'false').lower() in ('1', 'true', 'yes')
+
+# Двухфазный режим: дешевое извлечение названий и цен с фото, перевод и описания — из памяти
+# переводов, а модель генерирует их только для блюд, которых там еще нет
+TWO_PHASE_MODE = os.getenv('TWO_PHASE_MODE', 'false').lower() in ('1', 'true', 'yes')
+TRANSLATION_LANGUAGE = os.getenv('TRANSLATION_LANGUAGE', 'русский')
+TRANSLATION_MEMORY_TTL = int(os.getenv('TRANSLATION_MEMORY_TTL', 90 * 24 * 3600))
+TRANSLATION_MEMORY_MAX_ENTRIES = int(os.getenv('TRANSLATION_MEMORY_MAX_ENTRIES', 200000))
+# Сколько новых блюд переводится одним текстовым запросом
+TRANSLATION_BATCH_SIZE = int(os.getenv('TRANSLATION_BATCH_SIZE', 40))
+
+# Провайдеры моделей и маршрутизация запросов между ними.
+# MODEL_PROVIDERS — провайдеры через запятую в порядке предпочтения: gemini, openai, anthropic
+MODEL_PROVIDERS = [name.strip() for name in os.getenv('MODEL_PROVIDERS', 'gemini').split(',') if name.strip()]
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash-latest')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+ANTHROPIC_MODEL = os.getenv('ANTHROPIC_MODEL', 'claude-3-5-haiku-latest')
+# Модель для генерации промптов картинок (prompt_generator)
+PROMPT_GEMINI_MODEL = os.getenv('PROMPT_GEMINI_MODEL', 'gemini-1.5-pro')
+# Кэш промптов картинок: нормализованное описание блюда -> промпт; сколько описаний уходит одним запросом
+IMAGE_PROMPT_CACHE_TTL = int(os.getenv('IMAGE_PROMPT_CACHE_TTL', 180 * 24 * 3600))
+IMAGE_PROMPT_CACHE_MAX_ENTRIES = int(os.getenv('IMAGE_PROMPT_CACHE_MAX_ENTRIES', 50000))
+IMAGE_PROMPT_BATCH_SIZE = int(os.getenv('IMAGE_PROMPT_BATCH_SIZE', 40))
+# Дублирующий запрос другому провайдеру, если основной отвечает дольше своего p95. Выключено по умолчанию:
+# медленный ответ оплачивается дважды. Дубль тому же провайдеру — только при MODEL_HEDGE_SAME_PROVIDER
+MODEL_HEDGING = os.getenv('MODEL_HEDGING', 'false').lower() in ('1', 'true', 'yes')
+MODEL_HEDGE_SAME_PROVIDER = os.getenv('MODEL_HEDGE_SAME_PROVIDER', 'false').lower() in ('1', 'true', 'yes')
+# Задержка перед дублирующим запросом, пока у провайдера нет статистики для p95 (секунды)
+MODEL_HEDGE_DEFAULT_DELAY = float(os.getenv('MODEL_HEDGE_DEFAULT_DELAY', 15))
+MODEL_LATENCY_WINDOW = int(os.getenv('MODEL_LATENCY_WINDOW', 200))
+# Доля запросов, которая уходит провайдеру без свежей статистики задержек, чтобы сравнивать провайдеров,
+# и возраст последнего замера (секунды), после которого статистика провайдера считается устаревшей
+MODEL_EXPLORATION_RATE = float(os.getenv('MODEL_EXPLORATION_RATE', 0.05))
+MODEL_STATS_MAX_AGE = float(os.getenv('MODEL_STATS_MAX_AGE', 600))
+MODEL_FAILURE_COOLDOWN = float(os.getenv('MODEL_FAILURE_COOLDOWN', 60))
+
+# Режим работы бота: polling — один процесс опрашивает Telegram, webhook — HTTP-сервер,
+# который можно запускать несколькими воркерами и репликами за балансировщиком
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес, на который Telegram отправляет обновления (например, https://bot.example.com)
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+# Количество процессов-воркеров на одном узле (делят порт через SO_REUSEPORT)
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 1))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 100))
+
+# Общее состояние воркеров и реплик: memory — в памяти процесса, redis — общий сервер Redis
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Сколько секунд реплика владеет обработкой одинакового фото и сколько хранится результат для остальных
+SHARED_FLIGHT_LEASE = float(os.getenv('SHARED_FLIGHT_LEASE', 600))
+SHARED_FLIGHT_RESULT_TTL = float(os.getenv('SHARED_FLIGHT_RESULT_TTL', 60))
+
+# Метрики: в режиме webhook они доступны на /metrics основного порта,
+# в режиме polling — на отдельном порту METRICS_PORT (0 — не запускать)
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Доля меню, обработка которых профилируется cProfile (0 — профилирование выключено)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(__file__), '..', 'profiles'))
@@ -0,0 +1,179 @@
+from dataclasses import dataclass, field
+from enum import Enum
+
+# Ключи компактного формата ответа модели
+COMPACT_MENU_KEY = "d"
+COMPACT_PARTIAL_KEY = "p"
+
+
+class Category(str, Enum):
+    STARTER = "starter"
+    SOUP = "soup"
+    SALAD = "salad"
+    MAIN = "main"
+    SIDE = "side"
+    DESSERT = "dessert"
+    DRINK = "drink"
+    OTHER = "other"
+
+
+# Названия категорий, которые видит пользователь (и по которым группируется HTML)
+CATEGORY_LABELS = {
+    Category.STARTER: "закуска",
+    Category.SOUP: "суп",
+    Category.SALAD: "салат",
+    Category.MAIN: "основное блюдо",
+    Category.SIDE: "гарнир",
+    Category.DESSERT: "десерт",
+    Category.DRINK: "напиток",
+    Category.OTHER: "другое",
+}
+
+
+# Допустимые значения категории для текста промпта: провайдеры без structured output схему не видят
+CATEGORY_CHOICES = ", ".join(f"{category.value} ({label})" for category, label in CATEGORY_LABELS.items())
+
+
+class Flag(str, Enum):
+    YES = "y"
+    NO = "n"
+    UNKNOWN = "u"
+
+
+FLAG_VALUES = {Flag.YES: "yes", Flag.NO: "no", Flag.UNKNOWN: "unknown"}
+FLAGS_BY_VALUE = {value: flag for flag, value in FLAG_VALUES.items()}
+
+UNREADABLE_PRICE = "нечитаемое"
+
+
+def _enum_schema(enum: type[Enum]) -> dict:
+    return {"type": "STRING", "format": "enum", "enum": [member.value for member in enum]}
+
+
+# Схема ответа для structured output: короткие ключи и перечисления вместо свободных строк
+COMPACT_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        COMPACT_PARTIAL_KEY: {"type": "BOOLEAN"},
+        COMPACT_MENU_KEY: {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "n": {"type": "STRING"},
+                    "t": {"type": "STRING"},
+                    "c": _enum_schema(Category),
+                    "pr": {"type": "STRING"},
+                    "s": {"type": "STRING"},
+                    "i": {"type": "ARRAY", "items": {"type": "STRING"}},
+                    "g": _enum_schema(Flag),
+                    "m": _enum_schema(Flag),
+                },
+                "required": ["n", "t", "c"],
+            },
+        },
+    },
+    "required": [COMPACT_PARTIAL_KEY, COMPACT_MENU_KEY],
+}
+
+# Схема первой фазы двухфазного режима: только то, что видно на фото, без перевода и описаний
+EXTRACT_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        COMPACT_PARTIAL_KEY: {"type": "BOOLEAN"},
+        COMPACT_MENU_KEY: {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "n": {"type": "STRING"},
+                    "c": _enum_schema(Category),
+                    "pr": {"type": "STRING"},
+                },
+                "required": ["n", "c"],
+            },
+        },
+    },
+    "required": [COMPACT_PARTIAL_KEY, COMPACT_MENU_KEY],
+}
+
+
+@dataclass(slots=True)
+class Dish:
+    original_name: str
+    translated_name: str
+    category: Category = Category.OTHER
+    price: str = UNREADABLE_PRICE
+    description: str = ""
+    ingredients: list[str] = field(default_factory=list)
+    gluten: Flag = Flag.UNKNOWN
+    milk: Flag = Flag.UNKNOWN
+
+    @classmethod
+    def from_compact(cls, obj: dict) -> "Dish":
+        """Проверяет и разбирает блюдо в компактном формате. Бросает ValueError, если объект некорректен."""
+        if not isinstance(obj, dict):
+            raise ValueError(f"Dish must be an object, got {type(obj).__name__}")
+        name = str(obj.get("n") or "").strip()
+        if not name:
+            raise ValueError("Dish without original name")
+
+        try:
+            category = Category(obj.get("c", Category.OTHER.value))
+        except ValueError:
+            category = Category.OTHER
+        ingredients = obj.get("i") or []
+        if not isinstance(ingredients, list):
+            ingredients = []
+
+        return cls(
+            original_name=name,
+            translated_name=str(obj.get("t") or name).strip(),
+            category=category,
+            price=str(obj.get("pr") or UNREADABLE_PRICE).strip(),
+            description=str(obj.get("s") or "").strip(),
+            ingredients=[str(item) for item in ingredients if item],
+            gluten=_parse_flag(obj.get("g")),
+            milk=_parse_flag(obj.get("m")),
+        )
+
+    def to_dict(self) -> dict:
+        """Словарь в формате, который используют image_fetcher и html_generator."""
+        return {
+            "originalName": self.original_name,
+            "translatedName": self.translated_name,
+            "image": None,
+            "category": CATEGORY_LABELS[self.category],
+            "price": self.price,
+            "shortDescription": self.description,
+            "ingredients": self.ingredients or ["неизвестно"],
+            "containsGluten": FLAG_VALUES[self.gluten],
+            "containsMilk": FLAG_VALUES[self.milk],
+        }
+
+
+def _parse_flag(value) -> Flag:
+    try:
+        return Flag(value)
+    except ValueError:
+        return Flag.UNKNOWN
+
+
+def compact_dish_to_dict(obj: dict) -> dict:
+    return Dish.from_compact(obj).to_dict()
+
+
+def menu_from_response(data: dict) -> tuple[list[dict], bool]:
+    """
+    Достает список блюд и флаг неполноты из разобранного ответа модели.
+    Понимает и компактный формат, и исходный формат с ключами "menu" / "isPartial".
+    """
+    if COMPACT_MENU_KEY in data:
+        dishes = []
+        for obj in data.get(COMPACT_MENU_KEY) or []:
+            try:
+                dishes.append(compact_dish_to_dict(obj))
+            except ValueError as e:
+                print(f"Skipping invalid dish {obj!r}: {e}")
+        return dishes, bool(data.get(COMPACT_PARTIAL_KEY, False))
+    return data.get("menu", []), bool(data.get("isPartial", False))
@@ -0,0 +1,25 @@
+from bot_instance import dp
+from config import BOT_MODE, METRICS_PORT
+from handlers import register_handlers
+from job_queue import job_queue
+from metrics import start_metrics_server, stop_metrics_server
+from runtime import close_runtime
+
+async def on_startup():
+    """Запускает пул воркеров очереди обработки меню и, в режиме polling, сервер метрик."""
+    await job_queue.start()
+    if BOT_MODE != 'webhook' and METRICS_PORT:
+        await start_metrics_server()
+
+async def on_shutdown():
+    """Вызывается при остановке бота для очистки ресурсов."""
+    print("Завершение работы, остановка очереди и закрытие клиентов...")
+    await job_queue.stop()
+    await stop_metrics_server()
+    await close_runtime()
+
+def setup_dispatcher():
+    """Регистрирует обработчики запуска, завершения работы и сообщений. Общая часть для polling и webhook."""
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    register_handlers(dp)
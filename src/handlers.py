@@ -2,18 +2,32 @@
 
 from aiogram import Router, types
 from aiogram.filters import Command
-from aiogram.types import Message, FSInputFile
-import os
-import re
-import json
+from aiogram.types import Message, BufferedInputFile
+import asyncio
 import datetime
-from bot_instance import bot
-from ocr import process_menu_image
-from html_generator import generate_html_menu
-from image_fetcher import fetch_images_for_menu
+from dataclasses import asdict
+from album import album_collector
+from job_queue import job_queue, QueueFull, RateLimited
+from metrics import MENUS, menu_trace, sampled_profile, span
+from pipeline import build_album_menu, build_menu, MenuError, MenuResult, PhotoRejected
+from singleflight import SingleFlight
 
 router = Router()
 
+# Одинаковые фото, присланные одновременно (друзья за одним столом, повторная отправка),
+# обрабатываются один раз, а результат получает каждый отправитель — в том числе на других репликах
+photo_flight = SingleFlight("photos", distributed=True, encode=asdict, decode=lambda data: MenuResult(**data))
+# Сообщения о ходе обработки фото: ключ фото -> функции прогресса всех, кто ждет его результата
+_watchers: dict[str, list] = {}
+
+async def _broadcast(photo_key: str, text: str):
+    """Показывает прогресс обработки фото каждому, кто ждет его результата."""
+    results = await asyncio.gather(*(progress(text) for progress in list(_watchers.get(photo_key, ()))),
+                                   return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Не удалось обновить сообщение о прогрессе: {result}")
+
 def register_handlers(dp):
     dp.include_router(router)
 
@@ -28,76 +42,85 @@ async def cmd_help(message: Message):
 
 @router.message(lambda message: message.photo)
 async def handle_photo(message: Message):
-    processing_msg = await message.answer('Принял! Начинаю обработку...')
-    
-    photo = message.photo[-1]
-    
-    temp_dir = os.path.join(os.path.dirname(__file__), '..', 'temp')
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    unique_id = f"{message.from_user.id}_{timestamp}"
-    download_path = os.path.join(temp_dir, f'menu_{unique_id}.jpg')
-    html_output_path = os.path.join(temp_dir, f'menu_{unique_id}.html')
-    
-    try:
-        await bot.download(photo, destination=download_path)
-        
-        # Шаг 1: Распознавание текста
-        await processing_msg.edit_text('Шаг 1/3: Распознаю текст с изображения...')
-        extracted_text = await process_menu_image(download_path)
-        
-        if not extracted_text:
-            await message.answer('Не удалось распознать текст. Пожалуйста, отправьте более четкое фото.')
+    if message.media_group_id:
+        # Фото альбома приходят отдельными сообщениями: весь альбом обрабатывает первое из них
+        album = await album_collector.collect(message.media_group_id, message)
+        if album is None:
             return
-        
-        # Шаг 2: Извлечение JSON
-        await processing_msg.edit_text('Шаг 2/3: Анализирую меню...')
-        try:
-            match = re.search(r'```json\s*([\s\S]+?)\s*```', extracted_text, re.DOTALL)
-            json_str = match.group(1) if match else extracted_text
-            
-            data = json.loads(json_str)
-            menu_data = data.get("menu", [])
-            is_partial = data.get("isPartial", False)
-
-        except (json.JSONDecodeError, IndexError):
-            await message.answer('Не удалось обработать данные из меню. Пожалуйста, попробуйте еще раз.')
-            print("Failed to parse JSON from:", extracted_text)
+        if len(album) > 1:
+            album_key = "album:" + ",".join(m.photo[-1].file_unique_id for m in album)
+            await _process(
+                album[0], album_key,
+                lambda progress: build_album_menu([m.photo for m in album], progress, message.bot.download)
+            )
             return
 
-        if not menu_data:
-            await message.answer('Не удалось извлечь ни одного блюда из меню.')
-            return
+    await _process(
+        message, message.photo[-1].file_unique_id,
+        lambda progress: build_menu(message.photo, progress, message.bot.download)
+    )
 
-        # Шаг 3: Подбор изображений
-        await processing_msg.edit_text('Шаг 3/3: Подбираю изображения для блюд...')
-        await fetch_images_for_menu(menu_data)
-        
-        # Генерация HTML
-        generate_html_menu(menu_data, html_output_path)
+async def _process(message: Message, photo_key: str, build):
+    processing_msg = await message.answer('Принял! Начинаю обработку...')
 
-        caption = "Ваше меню готово!"
-        if is_partial:
-            caption += "\n\n⚠️ *Обратите внимание: меню было распознано не полностью. Была обработана только часть.*"
+    async def progress(text: str):
+        await processing_msg.edit_text(text)
 
-        await processing_msg.delete()
-        await message.answer_document(
-            FSInputFile(html_output_path), 
-            caption=caption,
-            parse_mode='Markdown'
+    async def report_position(position: int):
+        await _broadcast(photo_key, f'Вы #{position} в очереди. Начну обработку, как только освободится место...')
+
+    async def run() -> MenuResult:
+        # Этапы и токены меню собираются в одну трассировку, часть меню профилируется
+        with menu_trace(photo_key), sampled_profile("menu"):
+            return await build(lambda text: _broadcast(photo_key, text))
+
+    watchers = _watchers.setdefault(photo_key, [])
+    watchers.append(progress)
+    try:
+        # Лимиты проверяются для каждого отправителя, даже если его фото уже обрабатывается для другого
+        await job_queue.admit(message.from_user.id)
+        if photo_flight.in_flight(photo_key):
+            await progress('Это меню уже обрабатывается, результат придет вместе с ним...')
+        result = await photo_flight.do(
+            photo_key,
+            lambda: job_queue.submit(message.from_user.id, run, on_position=report_position, admitted=True)
         )
-        
+        await _send_result(message, processing_msg, result)
+        MENUS.inc(outcome="partial" if result.is_partial else "ok")
+
+    except QueueFull:
+        MENUS.inc(outcome="shed")
+        await processing_msg.edit_text('Сейчас слишком много запросов. Пожалуйста, попробуйте через пару минут.')
+    except RateLimited:
+        MENUS.inc(outcome="rate_limited")
+        await processing_msg.edit_text('Вы отправляете фото слишком часто. Подождите немного и попробуйте снова.')
+    except PhotoRejected as e:
+        MENUS.inc(outcome="rejected")
+        await processing_msg.edit_text(str(e))
+    except MenuError as e:
+        MENUS.inc(outcome="unreadable")
+        await message.answer(str(e))
     except Exception as e:
+        MENUS.inc(outcome="error")
         await processing_msg.delete()
         await message.answer(f'Произошла критическая ошибка: {str(e)}')
     finally:
-        # Удаляем временные файлы (теперь только исходник и HTML)
-        for file_path in [download_path, html_output_path]:
-            if file_path and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except OSError as e:
-                    print(f"Ошибка при удалении файла {file_path}: {e}")
+        watchers.remove(progress)
+        if not watchers and _watchers.get(photo_key) is watchers:
+            del _watchers[photo_key]
+
+async def _send_result(message: Message, processing_msg: Message, result: MenuResult):
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    unique_id = f"{message.from_user.id}_{timestamp}"
 
+    caption = "Ваше меню готово!"
+    if result.is_partial:
+        caption += "\n\n⚠️ *Обратите внимание: меню было распознано не полностью. Была обработана только часть.*"
 
+    with span("send"):
+        await processing_msg.delete()
+        await message.answer_document(
+            BufferedInputFile(result.html.encode('utf-8'), filename=f'menu_{unique_id}.html'),
+            caption=caption,
+            parse_mode='Markdown'
+        )
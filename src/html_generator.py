@@ -1,23 +1,15 @@
 import json
-from pathlib import Path
+import re
 from collections import defaultdict
+from dataclasses import dataclass
+from html import escape
+from pathlib import Path
+from typing import Iterator, TextIO
 
-def generate_html_menu(menu_data: list, output_path: str = "menu.html"):
-    """
-    Генерирует красивый и адаптивный HTML-файл из данных меню.
-    """
-    if not isinstance(menu_data, list) or not menu_data:
-        print("Данные для генерации HTML отсутствуют или имеют неверный формат.")
-        return
-
-    grouped_menu = defaultdict(list)
-    for dish in menu_data:
-        category = dish.get("category", "другое").capitalize()
-        grouped_menu[category].append(dish)
-    
-    sorted_grouped_menu = dict(sorted(grouped_menu.items()))
+from config import LEAN_HTML, HTML_BYTE_BUDGET
 
-    html_template = """
+# Шаблон страницы разбирается один раз при импорте: содержимое меню вставляется между HEAD и TAIL
+PAGE_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="ru">
 <head>
@@ -60,46 +52,275 @@ def generate_html_menu(menu_data: list, output_path: str = "menu.html"):
 </body>
 </html>
     """
+# Отступ перед закрывающими кавычками сохранен: страница совпадает байт в байт с прежним рендерером
+PAGE_HEAD, PAGE_TAIL = PAGE_TEMPLATE.split('<!-- MENU_CONTENT_PLACEHOLDER -->')
+
+PLACEHOLDER_IMAGE = "https://via.placeholder.com/400x300/?text=No+Image"
+
+SECTION_CLOSE = '</section>'
+MILK_TAG = '<span class="allergen-tag">🥛 Содержит молоко</span>'
+GLUTEN_TAG = '<span class="allergen-tag">🌾 Содержит глютен</span>'
+
+# Сколько символов разметки копится перед отдачей очередного фрагмента при потоковой записи
+CHUNK_SIZE = 64 * 1024
+
+def _minify_css(css: str) -> str:
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{}:;,])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+# Облегченная страница: минифицированные стили, разметка без отступов и короткие имена классов.
+# Разметка в _render_lean_dish пишется сразу с короткими именами, стили переименовываются при импорте
+LEAN_CLASSES = {
+    "container": "c", "dish": "d", "dish-img": "i", "dish-details": "b", "dish-header": "h",
+    "dish-name": "n", "dish-price": "p", "original-name": "o", "description": "s",
+    "ingredients": "g", "allergens": "a", "allergen-tag": "t",
+}
+
+def _shorten_classes(css: str) -> str:
+    return re.sub(r"\.([\w-]+)(?![\w-])", lambda m: "." + LEAN_CLASSES.get(m.group(1), m.group(1)), css)
+
+# Заглушка для блюд без картинки — встроенный SVG, описанный один раз в CSS
+PLACEHOLDER_CSS = (
+    ".ph{aspect-ratio:4/3;background:#e9ecef url(\"data:image/svg+xml,"
+    "%3Csvg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 24 24' fill='none' stroke='%23adb5bd' stroke-width='1.5'%3E"
+    "%3Ccircle cx='12' cy='12' r='8'/%3E%3Ccircle cx='12' cy='12' r='4.5'/%3E%3C/svg%3E"
+    "\") center/40% no-repeat}"
+)
+LEAN_CSS = _shorten_classes(_minify_css(PAGE_TEMPLATE.split("<style>")[1].split("</style>")[0])) + PLACEHOLDER_CSS
+LEAN_PAGE_HEAD = (
+    '<!DOCTYPE html><html lang="ru"><head><meta charset="UTF-8">'
+    '<meta name="viewport" content="width=device-width,initial-scale=1">'
+    f'<title>Меню Ресторана</title><style>{LEAN_CSS}</style></head>'
+    '<body><div class="c"><h1>Меню</h1>'
+)
+LEAN_PAGE_TAIL = '</div></body></html>'
+LEAN_MILK_TAG = '<span class="t">🥛 Содержит молоко</span>'
+LEAN_GLUTEN_TAG = '<span class="t">🌾 Содержит глютен</span>'
+
+# Картинка в карточке занимает 120px на широком экране и всю ширину на телефоне
+IMAGE_SIZES = "(max-width:600px) 100vw,120px"
+DEFAULT_IMAGE_SIZE = (120, 120)
+
+@dataclass(frozen=True)
+class RenderOptions:
+    """Что включать в облегченную страницу. Поля отключаются по очереди, если страница не влезает в бюджет."""
+    srcset: bool = True
+    ingredients: bool = True
+    descriptions: bool = True
+    images: bool = True
+
+# Шаги деградации: сначала убираем то, что меньше всего нужно пользователю.
+# Последний шаг — жесткий запасной вариант: вместо картинок заглушки
+LEAN_STEPS = (
+    RenderOptions(),
+    RenderOptions(srcset=False),
+    RenderOptions(srcset=False, ingredients=False),
+    RenderOptions(srcset=False, ingredients=False, descriptions=False),
+    RenderOptions(srcset=False, ingredients=False, descriptions=False, images=False),
+)
+
+def _text(value) -> str:
+    """Экранирует текст для вставки в разметку. Строки без спецсимволов (большинство) возвращаются как есть."""
+    if value is None:
+        return ""
+    text = str(value)
+    if "&" in text or "<" in text or ">" in text or '"' in text or "'" in text:
+        return escape(text)
+    return text
+
+def _group_by_category(menu_data: list) -> list[tuple[str, list[dict]]]:
+    grouped_menu = defaultdict(list)
+    for dish in menu_data:
+        category = dish.get("category", "другое").capitalize()
+        grouped_menu[category].append(dish)
+    return sorted(grouped_menu.items())
+
+def _render_section_open(category: str) -> str:
+    return f'<section id="{_text(category.lower().replace(" ", "-"))}"><h2>{_text(category)}</h2>'
+
+def _render_dish(dish: dict) -> str:
+    # Используем URL напрямую или заглушку, если URL отсутствует
+    image_url = _text(dish.get("image") or PLACEHOLDER_IMAGE)
+    name = _text(dish.get("translatedName", ""))
+
+    ingredients = dish.get("ingredients", [])
+    if ingredients and "неизвестно" not in ingredients:
+        ingredients_html = f'<div class="ingredients"><strong>Состав:</strong> {_text(", ".join(map(str, ingredients)))}</div>'
+    else:
+        ingredients_html = ""
+
+    allergens = ""
+    if dish.get("containsMilk") == 'yes':
+        allergens += MILK_TAG
+    if dish.get("containsGluten") == 'yes':
+        allergens += GLUTEN_TAG
+
+    return (
+        f'<div class="dish">'
+        f'<img src="{image_url}" alt="{name}" class="dish-img">'
+        f'<div class="dish-details">'
+        f'<div class="dish-header">'
+        f'<span class="dish-name">{name}</span>'
+        f'<span class="dish-price">{_text(dish.get("price", ""))}</span>'
+        f'</div>'
+        f'<p class="original-name">({_text(dish.get("originalName", ""))})</p>'
+        f'<p class="description">{_text(dish.get("shortDescription", ""))}</p>'
+        f'{ingredients_html}'
+        f'<div class="allergens">{allergens}</div>'
+        f'</div>'
+        f'</div>'
+    )
 
-    body_content = ""
-    for category, dishes in sorted_grouped_menu.items():
-        body_content += f'<section id="{category.lower().replace(" ", "-")}"><h2>{category}</h2>'
+def _lean_srcset(dish: dict) -> str:
+    if not dish.get("imageSrcset"):
+        return ""
+    candidates = ",".join(f"{_text(url)} {int(w)}w" for url, w in dish["imageSrcset"])
+    return f' srcset="{candidates}" sizes="{IMAGE_SIZES}"'
+
+def _lean_description(dish: dict) -> str:
+    description = dish.get("shortDescription")
+    return f'<p class="s">{_text(description)}</p>' if description else ""
+
+def _lean_ingredients(dish: dict) -> str:
+    ingredients = dish.get("ingredients", [])
+    if not ingredients or "неизвестно" in ingredients:
+        return ""
+    return f'<div class="g"><b>Состав:</b> {_text(", ".join(map(str, ingredients)))}</div>'
+
+def _render_lean_image(dish: dict, name: str, options: RenderOptions) -> str:
+    image_url = dish.get("image")
+    if not image_url or not options.images:
+        return f'<div class="i ph" role="img" aria-label="{name}"></div>'
+
+    # Размеры резервируют место под картинку до ее загрузки, чтобы страница не прыгала
+    width, height = dish.get("imageSize") or DEFAULT_IMAGE_SIZE
+    srcset = _lean_srcset(dish) if options.srcset else ""
+    return (
+        f'<img src="{_text(image_url)}"{srcset} width="{int(width)}" height="{int(height)}" '
+        f'loading="lazy" decoding="async" alt="{name}" class="i">'
+    )
+
+def _render_lean_dish(dish: dict, options: RenderOptions) -> str:
+    name = _text(dish.get("translatedName", ""))
+    parts = [
+        '<div class="d">',
+        _render_lean_image(dish, name, options),
+        f'<div class="b"><div class="h"><span class="n">{name}</span>'
+        f'<span class="p">{_text(dish.get("price", ""))}</span></div>'
+        f'<p class="o">({_text(dish.get("originalName", ""))})</p>',
+    ]
+
+    if options.descriptions:
+        parts.append(_lean_description(dish))
+    if options.ingredients:
+        parts.append(_lean_ingredients(dish))
+
+    allergens = ""
+    if dish.get("containsMilk") == 'yes':
+        allergens += LEAN_MILK_TAG
+    if dish.get("containsGluten") == 'yes':
+        allergens += LEAN_GLUTEN_TAG
+    if allergens:
+        parts.append(f'<div class="a">{allergens}</div>')
+
+    parts.append('</div></div>')
+    return "".join(parts)
+
+def _iter_fragments(menu_data: list, options: RenderOptions | None = None) -> Iterator[str]:
+    """
+    Фрагменты страницы по порядку: шапка, секции и карточки блюд, подвал. Все значения из меню экранированы.
+    С `options` собирается облегченная страница.
+    """
+    yield PAGE_HEAD if options is None else LEAN_PAGE_HEAD
+    for category, dishes in _group_by_category(menu_data):
+        yield _render_section_open(category)
         for dish in dishes:
-            # Используем URL напрямую или заглушку, если URL отсутствует
-            image_url = dish.get("image") or "https://via.placeholder.com/400x300/?text=No+Image"
-
-            body_content += '<div class="dish">'
-            body_content += f'<img src="{image_url}" alt="{dish.get("translatedName", "")}" class="dish-img">'
-            
-            body_content += '<div class="dish-details">'
-            body_content += '<div class="dish-header">'
-            body_content += f'<span class="dish-name">{dish.get("translatedName", "")}</span>'
-            body_content += f'<span class="dish-price">{dish.get("price", "")}</span>'
-            body_content += '</div>'
-            body_content += f'<p class="original-name">({dish.get("originalName", "")})</p>'
-            body_content += f'<p class="description">{dish.get("shortDescription", "")}</p>'
-            
-            ingredients = dish.get("ingredients", [])
-            if ingredients and "неизвестно" not in ingredients:
-                body_content += '<div class="ingredients">'
-                body_content += f'<strong>Состав:</strong> {", ".join(ingredients)}'
-                body_content += '</div>'
-
-            body_content += '<div class="allergens">'
-            if dish.get("containsMilk") == 'yes':
-                body_content += '<span class="allergen-tag">🥛 Содержит молоко</span>'
-            if dish.get("containsGluten") == 'yes':
-                body_content += '<span class="allergen-tag">🌾 Содержит глютен</span>'
-            body_content += '</div>'
-            body_content += '</div>' # close dish-details
-            body_content += '</div>' # close dish
-        body_content += '</section>'
-
-    final_html = html_template.replace('<!-- MENU_CONTENT_PLACEHOLDER -->', body_content)
+            yield _render_dish(dish) if options is None else _render_lean_dish(dish, options)
+        yield SECTION_CLOSE
+    yield PAGE_TAIL if options is None else LEAN_PAGE_TAIL
+
+def _size(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+def _part_sizes(menu_data: list) -> tuple[int, dict[str, int]]:
+    """
+    Размер самой легкой страницы и добавка каждого отключаемого поля RenderOptions в байтах.
+    Страница собирается один раз в самом легком варианте, а добавки считаются по отдельным фрагментам,
+    поэтому размер любого шага деградации известен без повторного рендеринга.
+    """
+    base = sum(_size(fragment) for fragment in _iter_fragments(menu_data, LEAN_STEPS[-1]))
+    extra = {"srcset": 0, "ingredients": 0, "descriptions": 0, "images": 0}
+    for dish in menu_data:
+        extra["descriptions"] += _size(_lean_description(dish))
+        extra["ingredients"] += _size(_lean_ingredients(dish))
+        if dish.get("image"):
+            name = _text(dish.get("translatedName", ""))
+            extra["images"] += (_size(_render_lean_image(dish, name, LEAN_STEPS[-2]))
+                                - _size(_render_lean_image(dish, name, LEAN_STEPS[-1])))
+            extra["srcset"] += _size(_lean_srcset(dish))
+    return base, extra
+
+def choose_render_options(menu_data: list, byte_budget: int = HTML_BYTE_BUDGET) -> RenderOptions:
+    """
+    Выбирает первый шаг деградации, при котором облегченная страница укладывается в `byte_budget` байт.
+    Если не укладывается ни один шаг, возвращает последний (без картинок) с предупреждением в лог:
+    названия и цены не убираются.
+    """
+    if byte_budget <= 0:
+        return LEAN_STEPS[0]
+    base, extra = _part_sizes(menu_data)
+    for options in LEAN_STEPS:
+        size = base + sum(added for field, added in extra.items() if getattr(options, field))
+        if size <= byte_budget:
+            return options
+    print(f"HTML-меню превышает бюджет: {size} байт при лимите {byte_budget}")
+    return LEAN_STEPS[-1]
+
+def _page_options(menu_data: list, lean: bool, byte_budget: int) -> RenderOptions | None:
+    return choose_render_options(menu_data, byte_budget) if lean else None
+
+def _iter_chunks(menu_data: list, chunk_size: int = CHUNK_SIZE, lean: bool = LEAN_HTML,
+                 byte_budget: int = HTML_BYTE_BUDGET) -> Iterator[str]:
+    """
+    Отдает HTML-страницу меню частями примерно по `chunk_size` символов —
+    для записи в файл или сокет без сборки всей страницы в одну строку.
+    """
+    parts, size = [], 0
+    for fragment in _iter_fragments(menu_data, _page_options(menu_data, lean, byte_budget)):
+        parts.append(fragment)
+        size += len(fragment)
+        if size >= chunk_size:
+            yield "".join(parts)
+            parts, size = [], 0
+    if parts:
+        yield "".join(parts)
+
+def render_html_menu(menu_data: list, lean: bool = LEAN_HTML, byte_budget: int = HTML_BYTE_BUDGET) -> str:
+    """
+    Формирует красивую и адаптивную HTML-страницу из данных меню и возвращает ее строкой.
+    Страница собирается одним join по фрагментам, без повторной конкатенации строк.
+    `lean` — облегченная страница: lazy-загрузка и srcset картинок, минифицированная разметка
+    и бюджет размера `byte_budget` байт (0 — без ограничения).
+    """
+    return "".join(_iter_fragments(menu_data, _page_options(menu_data, lean, byte_budget)))
+
+def write_html_menu(menu_data: list, out: TextIO, lean: bool = LEAN_HTML, byte_budget: int = HTML_BYTE_BUDGET):
+    """Пишет HTML-страницу меню в файл или буфер по частям, не собирая ее целиком в памяти."""
+    for chunk in _iter_chunks(menu_data, lean=lean, byte_budget=byte_budget):
+        out.write(chunk)
+
+def generate_html_menu(menu_data: list, output_path: str = "menu.html"):
+    """
+    Генерирует красивый и адаптивный HTML-файл из данных меню.
+    """
+    if not isinstance(menu_data, list) or not menu_data:
+        print("Данные для генерации HTML отсутствуют или имеют неверный формат.")
+        return
 
     try:
         with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(final_html)
+            write_html_menu(menu_data, f)
         print(f"HTML-меню успешно сохранено в файл: '{output_path}'")
     except Exception as e:
         print(f"Ошибка при сохранении HTML-файла: {e}")
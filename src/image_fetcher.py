@@ -1,81 +1,325 @@
 
 import asyncio
-import httpx
-import os
+import re
+from collections import Counter
 from urllib.parse import quote_plus
-from dotenv import load_dotenv
+from config import PEXELS_BATCH_SEARCH, PEXELS_BATCH_PER_PAGE, PEXELS_BATCH_MIN_GROUP
+from metrics import PEXELS_IMAGES
+from pexels_scheduler import AdaptiveScheduler, QuotaExceeded
+from runtime import get_runtime
+from singleflight import SingleFlight
 
-# --- Конфигурация ---
-load_dotenv()
-PEXELS_API_KEY = os.getenv("PEXELS_API_KEY")
+# HTTP-клиент и кэш создаются в runtime при первом поиске, а не при импорте модуля
+scheduler = AdaptiveScheduler()
+pexels_flight = SingleFlight("pexels")
 
-if not PEXELS_API_KEY:
-    raise ValueError("PEXELS_API_KEY не найден в .env файле. Пожалуйста, получите бесплатный ключ на https://www.pexels.com/api/ и добавьте его.")
+# Варианты картинки из ответа Pexels для srcset: ключ в "src", ширина (если фиксирована) или высота.
+# tiny подходит для миниатюры 120px на экранах с высокой плотностью, large — для всей ширины телефона
+SRCSET_VARIANTS = (("tiny", 280, None), ("medium", None, 350), ("large", 940, None))
+MEDIUM_HEIGHT = 350
 
-HEADERS = {
-    "Authorization": PEXELS_API_KEY
+# Запрос пакетного поиска для группы блюд одной категории (категории в том виде, как их видит пользователь)
+CATEGORY_QUERIES = {
+    "закуска": "appetizer",
+    "суп": "soup",
+    "салат": "salad",
+    "основное блюдо": "main course",
+    "гарнир": "side dish",
+    "десерт": "dessert",
+    "напиток": "drink",
 }
-CONCURRENCY_LIMIT = 5
-semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
-
-client = httpx.AsyncClient(timeout=15.0, headers=HEADERS)
-
-async def get_pexels_image_url(dish: dict) -> str | None:
-    """
-    Находит URL изображения на Pexels, используя улучшенную логику запроса.
-    """
-    async with semaphore:
-        try:
-            # Приоритет отдаем оригинальному названию, оно часто более "интернациональное"
-            search_term = dish.get("originalName") or dish.get("translatedName", "food")
-            category = dish.get("category", "").lower()
-
-            # Добавляем ключевые слова в зависимости от категории
-            if "напиток" in category:
-                keywords = "beverage, drink, glass, cocktail"
-            else:
-                keywords = "food, plate, gourmet, restaurant, delicious"
-
-            query = f"{search_term} {keywords}"
-            # Ищем горизонтальные изображения для лучшего вида в меню
-            url = f"https://api.pexels.com/v1/search?query={quote_plus(query)}&per_page=1&orientation=landscape&size=medium"
-            
-            response = await client.get(url)
-            
-            if response.status_code != 200:
-                print(f"Ошибка при запросе к Pexels для '{search_term}'. Статус: {response.status_code}, Ответ: {response.text}")
-                return None
-
-            data = response.json()
-            photos = data.get("photos", [])
-            
-            if photos:
-                # Берем URL для среднего изображения
-                image_url = photos[0].get("src", {}).get("medium")
-                print(f"Найдено изображение для '{search_term}'")
-                return image_url
-            else:
-                print(f"Не найдено изображение для '{search_term}' на Pexels.")
-                return None
-                
-        except Exception as e:
-            print(f"Непредвиденная ошибка при поиске изображения на Pexels для '{search_term}': {e}")
+# Служебные слова названий, по которым нельзя ни группировать блюда, ни сопоставлять их с фото
+STOP_WORDS = {"and", "with", "the", "alla", "con", "del", "della", "dei", "delle", "aux", "des", "les", "mit", "und"}
+# Общее слово названий становится запросом группы, только если оно не короче этого
+GROUP_WORD_MIN_LENGTH = 4
+
+def _search_term(dish: dict) -> str:
+    # Приоритет отдаем оригинальному названию, оно часто более "интернациональное"
+    return dish.get("originalName") or dish.get("translatedName", "food")
+
+def _category_kind(dish: dict) -> str:
+    return "drink" if "напиток" in dish.get("category", "").lower() else "food"
+
+def _search_keywords(dish: dict) -> str:
+    # Добавляем ключевые слова в зависимости от категории
+    if _category_kind(dish) == "drink":
+        return "beverage, drink, glass, cocktail"
+    return "food, plate, gourmet, restaurant, delicious"
+
+def _words(text: str) -> set[str]:
+    return {word for word in re.findall(r"[^\W\d_]{3,}", text.lower()) if word not in STOP_WORDS}
+
+def image_cache_key(dish: dict) -> str:
+    """
+    Нормализованный ключ запроса: регистр, пунктуация и лишние пробелы не влияют на результат поиска.
+    """
+    term = re.sub(r"[^\w]+", " ", _search_term(dish).lower()).strip()
+    return f"{_category_kind(dish)}:{term}"
+
+def image_entry(photo: dict) -> dict | None:
+    """
+    Описание найденной картинки для кэша и HTML: основной URL (вариант "medium"),
+    варианты для srcset с шириной в пикселях и размер основного варианта.
+    """
+    src = photo.get("src") or {}
+    url = src.get("medium")
+    if not url:
+        return None
+
+    width, height = photo.get("width"), photo.get("height")
+    srcset, size = [], None
+    if width and height:
+        for key, fixed_width, fixed_height in SRCSET_VARIANTS:
+            if src.get(key):
+                srcset.append([src[key], fixed_width or round(fixed_height * width / height)])
+        size = [round(MEDIUM_HEIGHT * width / height), MEDIUM_HEIGHT]
+    return {"url": url, "srcset": srcset, "size": size}
+
+async def get_pexels_image(dish: dict, flow: str = "default") -> dict | None:
+    """
+    Находит изображение на Pexels, используя улучшенную логику запроса, и возвращает image_entry.
+    Ранее найденные изображения берутся из локального кэша без обращения к API.
+    `flow` — идентификатор меню для честного распределения запросов в планировщике.
+    """
+    cache_key = image_cache_key(dish)
+    # Ошибка кэша или общего хранилища, как и ошибка поиска, оставляет без картинки только это блюдо
+    try:
+        cached = _cached_image(await get_runtime().image_cache.aget(cache_key))
+        if cached:
+            PEXELS_IMAGES.inc(source="cache")
+            return cached
+
+        # Одинаковые запросы, уже выполняющиеся для других меню, разделяют один HTTP-вызов
+        image = await pexels_flight.do(cache_key, lambda: _search_pexels(dish, cache_key, flow))
+    except Exception as e:
+        print(f"Непредвиденная ошибка при подборе изображения для '{_search_term(dish)}': {e}")
+        return None
+    PEXELS_IMAGES.inc(source="search" if image else "miss")
+    return image
+
+def _cached_image(cached) -> dict | None:
+    if isinstance(cached, str):
+        # Записи старого формата хранят только URL
+        return {"url": cached, "srcset": [], "size": None}
+    return cached or None
+
+async def _search_pexels(dish: dict, cache_key: str, flow: str) -> dict | None:
+    search_term = _search_term(dish)
+    try:
+        query = f"{search_term} {_search_keywords(dish)}"
+        # Ищем горизонтальные изображения для лучшего вида в меню
+        url = f"https://api.pexels.com/v1/search?query={quote_plus(query)}&per_page=1&orientation=landscape&size=medium"
+
+        client = get_runtime().pexels_client
+        response = await scheduler.run(flow, lambda: client.get(url))
+
+        if response.status_code != 200:
+            print(f"Ошибка при запросе к Pexels для '{search_term}'. Статус: {response.status_code}, Ответ: {response.text}")
+            return None
+
+        data = response.json()
+        photos = data.get("photos", [])
+
+        if photos:
+            # Основной вариант — среднее изображение, остальные размеры идут в srcset
+            image = image_entry(photos[0])
+            print(f"Найдено изображение для '{search_term}'")
+            if image:
+                await get_runtime().image_cache.aset(cache_key, image)
+            return image
+        else:
+            print(f"Не найдено изображение для '{search_term}' на Pexels.")
             return None
 
+    except QuotaExceeded as e:
+        print(f"Пропускаю поиск изображения для '{search_term}': {e}")
+        return None
+    except Exception as e:
+        print(f"Непредвиденная ошибка при поиске изображения на Pexels для '{search_term}': {e}")
+        return None
+
+async def _search_group(query: str, flow: str) -> list[dict]:
+    """
+    Выдача пакетного поиска: описание фото (alt и адрес страницы) и image_entry для каждого фото.
+    Выдача кэшируется целиком, поэтому частые запросы групп ("soup food") повторно не выполняются.
+    """
+    cache_key = f"batch:{query}"
+    try:
+        cached = await get_runtime().image_cache.aget(cache_key)
+        if cached is not None:
+            return cached
+        return await pexels_flight.do(cache_key, lambda: _search_group_pexels(query, cache_key, flow))
+    except Exception as e:
+        print(f"Непредвиденная ошибка при пакетном подборе изображений '{query}': {e}")
+        return []
+
+async def _search_group_pexels(query: str, cache_key: str, flow: str) -> list[dict]:
+    url = (f"https://api.pexels.com/v1/search?query={quote_plus(query)}"
+           f"&per_page={PEXELS_BATCH_PER_PAGE}&orientation=landscape&size=medium")
+    try:
+        client = get_runtime().pexels_client
+        response = await scheduler.run(flow, lambda: client.get(url))
+
+        if response.status_code != 200:
+            print(f"Ошибка при пакетном запросе к Pexels '{query}'. Статус: {response.status_code}, Ответ: {response.text}")
+            return []
+
+        results = []
+        for photo in response.json().get("photos", []):
+            image = image_entry(photo)
+            if image:
+                # Адрес страницы фото содержит его описание: .../photo/sliced-pizza-on-a-plate-1234/
+                slug = (photo.get("url") or "").rstrip("/").rsplit("/", 1)[-1]
+                results.append({"text": f"{photo.get('alt') or ''} {slug.replace('-', ' ')}", "image": image})
+
+        print(f"Пакетный поиск '{query}': {len(results)} фото")
+        await get_runtime().image_cache.aset(cache_key, results)
+        return results
+
+    except QuotaExceeded as e:
+        print(f"Пропускаю пакетный поиск изображений '{query}': {e}")
+        return []
+    except Exception as e:
+        print(f"Непредвиденная ошибка при пакетном поиске изображений '{query}': {e}")
+        return []
+
+def _group_dishes(dishes: dict[str, dict]) -> tuple[dict[str, list[str]], list[str]]:
+    """
+    Делит блюда (ключ кэша -> блюдо) на группы для пакетного поиска: запрос группы -> ключи блюд.
+    Блюда с общим словом в названии (pizza, curry) ищутся по этому слову, остальные — по категории.
+    Блюда вне групп размером от PEXELS_BATCH_MIN_GROUP возвращаются вторым списком для поиска по одному.
+    """
+    words = {key: _words(_search_term(dish)) for key, dish in dishes.items()}
+    counts = Counter((_category_kind(dish), word) for key, dish in dishes.items()
+                     for word in words[key] if len(word) >= GROUP_WORD_MIN_LENGTH)
+
+    groups: dict[str, list[str]] = {}
+    singles = [key for key in dishes if not words[key]]
+    for key, dish in dishes.items():
+        if not words[key]:
+            continue
+        kind = _category_kind(dish)
+        shared = [word for word in words[key] if counts[(kind, word)] >= PEXELS_BATCH_MIN_GROUP]
+        if shared:
+            term = max(shared, key=lambda word: (counts[(kind, word)], word))
+        else:
+            term = CATEGORY_QUERIES.get(dish.get("category", "").lower(), "dish")
+        query = term if term.endswith(kind) else f"{term} {kind}"
+        groups.setdefault(query, []).append(key)
+
+    for query in [query for query, keys in groups.items() if len(keys) < PEXELS_BATCH_MIN_GROUP]:
+        singles.extend(groups.pop(query))
+    return groups, singles
+
+def _assign_photos(dishes: dict[str, dict], keys: list[str], results: list[dict], used: set[str]) -> dict[str, dict]:
+    """
+    Раздает фото из выдачи блюдам группы. Фото подходит блюду, только если в его описании есть
+    все слова названия: одно общее слово ("grilled", "beef") дает чужое блюдо. Первыми выбирают
+    блюда с более длинными названиями, из подходящих фото — то, что выше в выдаче.
+    Фото, уже занятые в меню, пропускаются.
+    """
+    photo_words = [_words(result["text"]) for result in results]
+    candidates = []
+    for key in keys:
+        words = _words(_search_term(dishes[key]))
+        for rank, text_words in enumerate(photo_words):
+            if words <= text_words:
+                candidates.append((-len(words), rank, key))
+
+    assigned = {}
+    for _, rank, key in sorted(candidates):
+        image = results[rank]["image"]
+        if key not in assigned and image["url"] not in used:
+            assigned[key] = image
+            used.add(image["url"])
+    return assigned
+
+async def _fetch_batched(menu_data: list, flow: str):
+    """
+    Пакетный подбор картинок для меню: кэш, затем один поиск с большой выдачей на группу блюд
+    и сопоставление по описанию фото, затем поиск по одному для блюд, которым фото не досталось.
+    Одно фото не достается разным блюдам меню, если его раздал пакетный поиск.
+    Совпадения по описанию в кэш блюд не записываются: туда попадает только результат поиска
+    по названию блюда, а повторные меню берут фото из закэшированной выдачи группы.
+    """
+    cache = get_runtime().image_cache
+    dishes = {}
+    for dish in menu_data:
+        dishes.setdefault(image_cache_key(dish), dish)
+
+    images = {}
+    # Ошибка чтения кэша для блюда считается промахом
+    for key, cached in zip(dishes, await asyncio.gather(*(cache.aget(key) for key in dishes), return_exceptions=True)):
+        if not isinstance(cached, Exception) and _cached_image(cached):
+            images[key] = _cached_image(cached)
+    PEXELS_IMAGES.inc(len(images), source="cache")
+    used = {image["url"] for image in images.values()}
+
+    pending = {key: dish for key, dish in dishes.items() if key not in images}
+    groups, singles = _group_dishes(pending)
+    results = await asyncio.gather(*(_search_group(query, flow) for query in groups))
+    matched = {}
+    for keys, group_results in zip(groups.values(), results):
+        matched.update(_assign_photos(pending, keys, group_results, used))
+    images.update(matched)
+    PEXELS_IMAGES.inc(len(matched), source="batch")
+
+    unmatched = singles + [key for keys in groups.values() for key in keys if key not in matched]
+    print(f"Картинки: {len(dishes) - len(pending)} из кэша, {len(matched)} из {len(groups)} пакетных запросов, "
+          f"{len(unmatched)} к поиску по одному")
+    found = await asyncio.gather(*(get_pexels_image(pending[key], flow) for key in unmatched))
+    images.update(zip(unmatched, found))
+
+    for dish in menu_data:
+        _apply_image(dish, images.get(image_cache_key(dish)))
+
+def _apply_image(dish: dict, image: dict | None):
+    dish["image"] = image["url"] if image else None
+    if image:
+        dish["imageSrcset"] = image["srcset"]
+        dish["imageSize"] = image["size"]
+
+class MenuImageFetcher:
+    """
+    Подбирает изображения для блюд одного меню по мере их поступления.
+    Поиск запускается сразу при добавлении блюда, одинаковые запросы выполняются один раз.
+    """
+
+    def __init__(self):
+        self.flow = f"menu-{id(self)}"
+        self._dishes = []
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def add(self, dish: dict):
+        key = image_cache_key(dish)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(get_pexels_image(dish, self.flow))
+        self._dishes.append(dish)
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+    async def finish(self):
+        """Дожидается всех поисков и проставляет в блюда URL, варианты для srcset и размер картинки."""
+        await asyncio.gather(*self._tasks.values())
+        for dish in self._dishes:
+            _apply_image(dish, self._tasks[image_cache_key(dish)].result())
+
 async def fetch_images_for_menu(menu_data: list):
     """
     Асинхронно получает URL-ы изображений для каждого блюда в меню с Pexels.
+    Одинаковые запросы внутри одного меню выполняются только один раз,
+    при PEXELS_BATCH_SEARCH похожие блюда ищутся одним запросом на группу.
     """
     print("Начинаю улучшенный подбор изображений с Pexels...")
-    
-    tasks = [get_pexels_image_url(dish) for dish in menu_data]
-    image_urls = await asyncio.gather(*tasks)
-    
-    for i, dish in enumerate(menu_data):
-        dish["image"] = image_urls[i]
-            
-    print("Подбор изображений завершен.")
 
-async def close_http_client():
-    """Закрывает HTTP-клиент."""
-    await client.aclose()
+    if PEXELS_BATCH_SEARCH:
+        await _fetch_batched(menu_data, f"menu-{id(menu_data)}")
+    else:
+        fetcher = MenuImageFetcher()
+        for dish in menu_data:
+            fetcher.add(dish)
+        await fetcher.finish()
+
+    print("Подбор изображений завершен.")
@@ -0,0 +1,121 @@
+import io
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from PIL import Image, ImageFilter, ImageOps
+
+from config import IMAGE_QUALITY_PROFILE
+
+if TYPE_CHECKING:
+    from aiogram.types import PhotoSize
+
+
+@dataclass(frozen=True)
+class QualityProfile:
+    # Минимальная длинная сторона варианта фото, при которой текст меню еще читается (0 — брать самый большой)
+    min_long_side: int
+    # Максимальная длинная сторона после уменьшения
+    max_side: int
+    jpeg_quality: int
+    # Бюджет размера изображения, отправляемого в модель
+    max_bytes: int
+
+
+# Ручка «качество против скорости»: чем меньше картинка, тем меньше входных токенов и быстрее ответ модели
+PROFILES = {
+    "fast": QualityProfile(min_long_side=800, max_side=1024, jpeg_quality=70, max_bytes=250_000),
+    "balanced": QualityProfile(min_long_side=1280, max_side=1600, jpeg_quality=80, max_bytes=600_000),
+    "quality": QualityProfile(min_long_side=0, max_side=2560, jpeg_quality=90, max_bytes=2_000_000),
+}
+
+# Поля вокруг найденной области меню и порог, ниже которого обрезка не имеет смысла
+CROP_MARGIN = 0.03
+CROP_MIN_GAIN = 0.1
+EDGE_THRESHOLD = 40
+EXIF_ORIENTATION = 0x0112
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+
+
+def get_profile(name: str = IMAGE_QUALITY_PROFILE) -> QualityProfile:
+    return PROFILES.get(name, PROFILES["balanced"])
+
+
+def choose_photo_size(photos: list["PhotoSize"], profile: QualityProfile | None = None) -> "PhotoSize":
+    """Выбирает самый маленький вариант фото из Telegram, который еще достаточно крупный для чтения."""
+    profile = profile or get_profile()
+    by_area = sorted(photos, key=lambda p: p.width * p.height)
+    if profile.min_long_side:
+        for photo in by_area:
+            if max(photo.width, photo.height) >= profile.min_long_side:
+                return photo
+    return by_area[-1]
+
+
+def crop_to_content(image: Image.Image) -> Image.Image:
+    """
+    Обрезает однотонный фон вокруг меню: ищет рамку, в которой сосредоточены контуры (текст, рамки),
+    и оставляет ее с небольшими полями.
+    """
+    small = image.convert("L")
+    small.thumbnail((400, 400))
+    edges = small.filter(ImageFilter.FIND_EDGES).point(lambda v: 255 if v > EDGE_THRESHOLD else 0)
+    # Убираем рамку по краю, которую FIND_EDGES дает на границе изображения
+    edges = ImageOps.crop(edges, 2)
+    bbox = edges.getbbox()
+    if not bbox:
+        return image
+
+    scale = image.width / small.width
+    left, top, right, bottom = ((bbox[0] + 2) * scale, (bbox[1] + 2) * scale,
+                                (bbox[2] + 2) * scale, (bbox[3] + 2) * scale)
+    margin_x, margin_y = image.width * CROP_MARGIN, image.height * CROP_MARGIN
+    box = (max(0, int(left - margin_x)), max(0, int(top - margin_y)),
+           min(image.width, int(right + margin_x)), min(image.height, int(bottom + margin_y)))
+
+    cropped_area = (box[2] - box[0]) * (box[3] - box[1])
+    if cropped_area > image.width * image.height * (1 - CROP_MIN_GAIN):
+        return image
+    return image.crop(box)
+
+
+def preprocess_image(image_bytes: bytes, profile: QualityProfile | None = None) -> PreparedImage:
+    """
+    Готовит фото к отправке в модель: поворачивает по EXIF, обрезает фон, уменьшает
+    до max_side и пережимает в JPEG так, чтобы уложиться в бюджет байтов.
+    Если исходник уже подходит, он отправляется без изменений с настоящим MIME-типом.
+    """
+    profile = profile or get_profile()
+    with Image.open(io.BytesIO(image_bytes)) as original:
+        source_format = original.format
+        rotated = original.getexif().get(EXIF_ORIENTATION, 1) != 1
+        image = ImageOps.exif_transpose(original)
+        image.load()
+
+    cropped = crop_to_content(image)
+    needs_resize = max(cropped.size) > profile.max_side
+
+    if not rotated and cropped is image and not needs_resize and len(image_bytes) <= profile.max_bytes:
+        mime_type = Image.MIME.get(source_format, "image/jpeg")
+        return PreparedImage(image_bytes, mime_type, image.width, image.height)
+
+    if needs_resize:
+        cropped.thumbnail((profile.max_side, profile.max_side), Image.Resampling.LANCZOS)
+    rgb = cropped.convert("RGB")
+
+    quality = profile.jpeg_quality
+    while True:
+        buffer = io.BytesIO()
+        rgb.save(buffer, "JPEG", quality=quality, optimize=True)
+        data = buffer.getvalue()
+        if len(data) <= profile.max_bytes or quality <= 40:
+            break
+        quality -= 10
+
+    return PreparedImage(data, "image/jpeg", rgb.width, rgb.height)
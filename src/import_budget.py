@@ -0,0 +1,73 @@
+"""
+Проверка времени импорта модулей.
+Каждый модуль импортируется в отдельном процессе с `python -X importtime`;
+скрипт завершается с ошибкой, если импорт дольше бюджета или подтягивает тяжелые SDK,
+которые должны загружаться лениво (при первом обращении через runtime).
+
+Запуск из каталога src: python import_budget.py
+"""
+import os
+import subprocess
+import sys
+
+# Бюджет кумулятивного времени импорта, миллисекунды
+BUDGETS_MS = {
+    "config": 100,
+    "runtime": 100,
+    "model_client": 100,
+    "image_fetcher": 150,
+    "ocr": 150,
+    "tiling": 250,
+    "pipeline": 300,
+}
+
+# Эти пакеты не должны загружаться при импорте модулей конвейера
+# (aiogram нужен только handlers/main, которые все равно создают бота)
+LAZY_PACKAGES = ("google.generativeai", "httpx", "aiogram")
+
+CHECK_CODE = """
+import sys
+import {module}
+print(",".join(name for name in {lazy!r} if name in sys.modules))
+"""
+
+
+def measure(module: str) -> tuple[float, list[str]]:
+    """Возвращает кумулятивное время импорта модуля (мс) и список загруженных тяжелых пакетов."""
+    env = dict(os.environ)
+    # Ключи не нужны: при импорте ничего не создается, но config не должен падать без .env
+    env.setdefault("TELEGRAM_BOT_TOKEN", "0:import-budget")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHECK_CODE.format(module=module, lazy=LAZY_PACKAGES)],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+
+    cumulative_us = 0
+    for line in result.stderr.splitlines():
+        # Формат строки: "import time:   self [us] |  cumulative | imported package"
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative_us = int(parts[1].strip())
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    return cumulative_us / 1000, loaded
+
+
+def main() -> int:
+    failed = False
+    for module, budget in BUDGETS_MS.items():
+        elapsed, loaded = measure(module)
+        status = "OK"
+        if elapsed > budget:
+            status = "SLOW"
+            failed = True
+        if loaded:
+            status = f"EAGER ({', '.join(loaded)})"
+            failed = True
+        print(f"{module:<16} {elapsed:8.1f} ms / {budget} ms  {status}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from config import JOB_WORKERS, JOB_QUEUE_MAX_SIZE, USER_MAX_CONCURRENT_JOBS, USER_MAX_JOBS_PER_MINUTE
+from runtime import get_runtime
+
+
+class QueueFull(Exception):
+    """Очередь переполнена — запрос отклоняется сразу, чтобы не раздувать задержку остальным."""
+
+
+class RateLimited(Exception):
+    """Пользователь отправляет задачи чаще, чем разрешено."""
+
+
+@dataclass
+class _Job:
+    user_id: int
+    run: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    on_position: Callable[[int], Awaitable[Any]] | None = None
+    position: int = field(default=0)
+
+
+class JobQueue:
+    """
+    Ограниченная очередь задач обработки меню с пулом воркеров.
+
+    * Задачи разных пользователей выбираются по кругу, а не в порядке поступления.
+    * У пользователя не больше `per_user_concurrency` задач в работе и не больше
+      `per_user_rate` новых задач в минуту.
+    * При заполненной очереди новые задачи сразу отклоняются (QueueFull).
+    * Ожидающим задачам сообщается их позиция в очереди через `on_position`.
+
+    Очередь и воркеры у каждого процесса свои. При общем хранилище состояния (STATE_BACKEND=redis)
+    лимит задач пользователя в минуту считается общим для всех воркеров и реплик,
+    а ограничение параллельности действует в пределах процесса.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_size: int = JOB_QUEUE_MAX_SIZE,
+                 per_user_concurrency: int = USER_MAX_CONCURRENT_JOBS,
+                 per_user_rate: int = USER_MAX_JOBS_PER_MINUTE):
+        self.workers = workers
+        self.max_size = max_size
+        self.per_user_concurrency = per_user_concurrency
+        self.per_user_rate = per_user_rate
+
+        self._pending: dict[int, deque[_Job]] = {}
+        self._rotation: deque[int] = deque()
+        self._running: dict[int, int] = {}
+        self._submits: dict[int, deque[float]] = {}
+        self._condition: asyncio.Condition | None = None
+        self._tasks: list[asyncio.Task] = []
+
+        self.completed = 0
+        self.shed = 0
+        self.rate_limited = 0
+
+    @property
+    def size(self) -> int:
+        return sum(len(queue) for queue in self._pending.values())
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._condition = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for queue in self._pending.values():
+            for job in queue:
+                job.future.cancel()
+        self._pending.clear()
+        self._rotation.clear()
+
+    async def admit(self, user_id: int):
+        """
+        Проверяет, можно ли принять задачу пользователя, и учитывает ее в его лимите за минуту.
+        Бросает QueueFull или RateLimited. Вызывается для каждого пользователя отдельно, даже если
+        его задача затем присоединится к уже выполняющейся задаче другого пользователя.
+        """
+        if self.size >= self.max_size:
+            self.shed += 1
+            raise QueueFull(f"Очередь заполнена ({self.max_size} задач)")
+        if not await self._admit(user_id):
+            self.rate_limited += 1
+            raise RateLimited(f"Пользователь {user_id} превысил лимит {self.per_user_rate} задач в минуту")
+
+    async def submit(self, user_id: int, run: Callable[[], Awaitable[Any]],
+                     on_position: Callable[[int], Awaitable[Any]] | None = None, admitted: bool = False) -> Any:
+        """Ставит задачу в очередь и ждет ее результата. `admitted` — admit() для задачи уже вызван."""
+        if not self._tasks:
+            await self.start()
+
+        if not admitted:
+            await self.admit(user_id)
+
+        job = _Job(user_id, run, asyncio.get_running_loop().create_future(), on_position)
+        async with self._condition:
+            if user_id not in self._pending:
+                self._pending[user_id] = deque()
+                self._rotation.append(user_id)
+            self._pending[user_id].append(job)
+            self._condition.notify()
+        # Если задачу сразу заберет свободный воркер, сообщать позицию незачем
+        workers_busy = sum(self._running.values()) >= self.workers
+        if workers_busy or self._running.get(user_id, 0) >= self.per_user_concurrency:
+            self._report_positions()
+        return await job.future
+
+    async def _admit(self, user_id: int) -> bool:
+        """Учитывает новую задачу пользователя в лимите за минуту. Возвращает False, если лимит исчерпан."""
+        state = get_runtime().shared_state
+        if state is not None:
+            # Общий счетчик по минутным окнам: пользователь может попадать на разные реплики
+            window = int(time.time() // 60)
+            return await state.incr(f"jobs:rate:{user_id}:{window}", ttl=120) <= self.per_user_rate
+
+        now = time.monotonic()
+        submits = self._submits.setdefault(user_id, deque())
+        while submits and now - submits[0] >= 60:
+            submits.popleft()
+        if len(submits) >= self.per_user_rate:
+            return False
+        submits.append(now)
+        return True
+
+    def _pick(self) -> _Job | None:
+        for _ in range(len(self._rotation)):
+            user_id = self._rotation[0]
+            self._rotation.rotate(-1)
+            if self._running.get(user_id, 0) >= self.per_user_concurrency:
+                continue
+            queue = self._pending[user_id]
+            job = queue.popleft()
+            if not queue:
+                del self._pending[user_id]
+                self._rotation.remove(user_id)
+            self._running[user_id] = self._running.get(user_id, 0) + 1
+            return job
+        return None
+
+    def _report_positions(self):
+        """Пересчитывает позиции ожидающих задач в порядке кругового обхода и сообщает об изменениях."""
+        order = list(self._rotation)
+        for rank, user_id in enumerate(order):
+            for index, job in enumerate(self._pending[user_id]):
+                ahead = index
+                for other_rank, other_id in enumerate(order):
+                    if other_id != user_id:
+                        ahead += min(len(self._pending[other_id]), index + (1 if other_rank < rank else 0))
+                position = ahead + 1
+                # Позиция сообщается только при продвижении, чтобы не пугать пользователя скачками назад
+                if (job.position == 0 or position < job.position) and job.on_position:
+                    job.position = position
+                    asyncio.create_task(self._notify(job, position))
+
+    @staticmethod
+    async def _notify(job: _Job, position: int):
+        try:
+            await job.on_position(position)
+        except Exception as e:
+            print(f"Не удалось сообщить позицию в очереди: {e}")
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                job = self._pick()
+                while job is None:
+                    await self._condition.wait()
+                    job = self._pick()
+            self._report_positions()
+
+            try:
+                if not job.future.cancelled():
+                    job.future.set_result(await job.run())
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self.completed += 1
+                async with self._condition:
+                    self._running[job.user_id] -= 1
+                    self._condition.notify_all()
+
+    def metrics(self) -> dict:
+        return {
+            "queued": self.size,
+            "running": sum(self._running.values()),
+            "workers": len(self._tasks),
+            "completed": self.completed,
+            "shed": self.shed,
+            "rate_limited": self.rate_limited,
+        }
+
+
+job_queue = JobQueue()
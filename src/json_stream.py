@@ -0,0 +1,110 @@
+import json
+import re
+from typing import Callable
+
+
+def extract_json_text(text: str) -> str:
+    """Вырезает JSON из блока ```json ... ```, если модель его туда обернула."""
+    match = re.search(r'```json\s*([\s\S]+?)\s*```', text, re.DOTALL)
+    return match.group(1) if match else text
+
+
+def parse_menu_json(text: str) -> dict:
+    """Разбирает полный ответ модели. Бросает json.JSONDecodeError, если это не JSON-объект."""
+    data = json.loads(extract_json_text(text))
+    if not isinstance(data, dict):
+        raise json.JSONDecodeError("Not a JSON object.", text, 0)
+    return data
+
+
+class MenuStreamParser:
+    """
+    Инкрементальный разборщик ответа модели вида {"isPartial": ..., "menu": [{...}, ...]}.
+    Метод feed принимает очередной фрагмент текста и возвращает блюда,
+    объекты которых полностью завершились в этом фрагменте.
+    `convert` преобразует каждый объект перед выдачей; если он бросает ValueError, объект пропускается.
+    """
+
+    def __init__(self, array_key: str = "menu", partial_key: str = "isPartial",
+                 convert: Callable[[dict], dict] | None = None):
+        self.array_key = array_key
+        self.partial_key = partial_key
+        self.convert = convert
+        self.text = ""
+        self.dishes: list[dict] = []
+        # Становится True, если весь ответ оказался корректным JSON (см. result)
+        self.complete = False
+
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_key = None
+        self._array_depth = None
+        self._item_start = None
+
+    def feed(self, chunk: str) -> list[dict]:
+        self.text += chunk
+        completed = []
+        text = self.text
+
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = text[self._string_start + 1:i]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in '{[':
+                self._depth += 1
+                if ch == '[' and self._depth == 2 and self._last_key == self.array_key:
+                    self._array_depth = self._depth
+                elif ch == '{' and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._item_start = i
+            elif ch in '}]':
+                if ch == '}' and self._item_start is not None and self._depth == self._array_depth + 1:
+                    try:
+                        dish = json.loads(text[self._item_start:i + 1])
+                    except json.JSONDecodeError:
+                        dish = None
+                    if isinstance(dish, dict) and self.convert:
+                        try:
+                            dish = self.convert(dish)
+                        except ValueError as e:
+                            print(f"Skipping invalid streamed dish: {e}")
+                            dish = None
+                    if isinstance(dish, dict):
+                        self.dishes.append(dish)
+                        completed.append(dish)
+                    self._item_start = None
+                elif ch == ']' and self._depth == self._array_depth:
+                    self._array_depth = None
+                self._depth -= 1
+
+        self._pos = len(text)
+        return completed
+
+    def result(self) -> dict:
+        """
+        Итоговый объект меню в виде {"menu": [...], "isPartial": ...}.
+        Массив блюд — те же объекты, что были отданы из feed.
+        Если ответ оборван (например, закончились токены), возвращаются уже разобранные блюда
+        с флагом isPartial.
+        """
+        try:
+            is_partial = bool(parse_menu_json(self.text).get(self.partial_key, False))
+            self.complete = True
+        except json.JSONDecodeError:
+            is_partial = True
+            self.complete = False
+        return {"menu": self.dishes, "isPartial": is_partial}
@@ -1,19 +1,10 @@
 import asyncio
 from bot_instance import dp, bot
-from handlers import register_handlers
-from image_fetcher import close_http_client
-
-async def on_shutdown():
-    """Вызывается при остановке бота для очистки ресурсов."""
-    print("Завершение работы, закрытие HTTP-клиента...")
-    await close_http_client()
+from config import BOT_MODE
+from dispatcher import setup_dispatcher
 
 async def main():
-    # Регистрируем обработчик завершения работы
-    dp.shutdown.register(on_shutdown)
-    
-    # Регистрируем хендлеры сообщений
-    register_handlers(dp)
+    setup_dispatcher()
     
     # Запускаем бота
     print("Бот запущен...")
@@ -21,6 +12,10 @@ async def main():
 
 if __name__ == '__main__':
     try:
-        asyncio.run(main())
+        if BOT_MODE == 'webhook':
+            from webhook import run_webhook
+            run_webhook()
+        else:
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
-        print("Бот остановлен.")
\ No newline at end of file
+        print("Бот остановлен.")
@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import io
+from dataclasses import dataclass
+
+from PIL import Image
+
+from cache import PersistentCache
+from config import (
+    MENU_CACHE_TTL, MENU_CACHE_MAX_ENTRIES, MENU_CACHE_HASH_DISTANCE, MENU_CACHE_FINGERPRINT_DISTANCE,
+)
+
+HASH_SIZE = 8
+# Хэш для проверки похожего кандидата: 256 бит различают текстовые меню на белом фоне,
+# которые 64-битный хэш путает (разные меню с расстоянием 4 из 64)
+FINGERPRINT_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+# Сколько хэшей хранится под одним значением части хэша: поиск похожих ограничен, а не перебирает весь кэш
+BAND_MAX_HASHES = 32
+
+
+def _dhash(image: Image.Image, size: int) -> int:
+    small = image.resize((size + 1, size), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def image_hashes(image_bytes: bytes) -> tuple[str, str]:
+    """
+    Считает разностные перцептивные хэши (dHash) уменьшенного изображения: 64-битный ключ кэша
+    и 256-битный отпечаток для проверки похожих снимков. Изображение декодируется один раз.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.draft("L", (FINGERPRINT_SIZE * 8, FINGERPRINT_SIZE * 8))
+        gray = image.convert("L")
+    return f"{_dhash(gray, HASH_SIZE):016x}", f"{_dhash(gray, FINGERPRINT_SIZE):064x}"
+
+
+@dataclass(frozen=True)
+class ImageKey:
+    """Ключи фото в кэше меню: SHA-256 содержимого и, если включен поиск похожих снимков, перцептивные хэши."""
+    digest: str
+    phash: str | None = None
+    fingerprint: str | None = None
+
+
+def hamming_distance(a: str, b: str) -> int:
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+def _bands(phash: str, count: int) -> list[str]:
+    """
+    Делит хэш на `count` частей. Если расстояние между хэшами меньше `count`, хотя бы одна
+    часть у них совпадает, поэтому кандидатов достаточно искать по точным значениям частей.
+    """
+    value = int(phash, 16)
+    bounds = [HASH_BITS * i // count for i in range(count + 1)]
+    return [f"{i}:{(value >> bounds[i]) & ((1 << (bounds[i + 1] - bounds[i])) - 1):x}" for i in range(count)]
+
+
+class MenuCache:
+    """
+    Кэш результатов process_menu_image.
+    Результат хранится под SHA-256 содержимого фото, а file_unique_id из Telegram указывает на него:
+    повторная отправка того же файла или тех же байтов находится сразу. Перцептивные хэши путают
+    разные текстовые меню одной верстки (у разных меню бывает одинаковый 64-битный хэш), поэтому
+    поиск пережатых копий снимка включается явно: MENU_CACHE_HASH_DISTANCE > 0. Кандидат ищется
+    по индексу частей хэша и принимается, только если близок и его 256-битный отпечаток.
+    С общим хранилищем `shared` точные совпадения находятся и на других узлах.
+    """
+
+    def __init__(self, ttl: int = MENU_CACHE_TTL, max_entries: int = MENU_CACHE_MAX_ENTRIES,
+                 max_distance: int = MENU_CACHE_HASH_DISTANCE,
+                 max_fingerprint_distance: int = MENU_CACHE_FINGERPRINT_DISTANCE, shared=None):
+        self.results = PersistentCache("menu_results", ttl, max_entries, shared=shared)
+        self.file_ids = PersistentCache("menu_file_ids", ttl, max_entries, shared=shared)
+        # Хэши и индекс нужны только для поиска похожих снимков и остаются локальными
+        self.hashes = PersistentCache("menu_image_hashes", ttl, max_entries)
+        self.bands = PersistentCache("menu_hash_bands", ttl, max_entries * (max_distance + 1))
+        self.max_distance = max_distance
+        self.max_fingerprint_distance = max_fingerprint_distance
+        self.hits = 0
+        self.near_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def image_key(self, image_bytes: bytes) -> ImageKey:
+        """Считает ключи фото. Перцептивные хэши считаются, только если поиск похожих снимков включен."""
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        if not self.max_distance:
+            return ImageKey(digest)
+        return ImageKey(digest, *image_hashes(image_bytes))
+
+    def _lookup(self, file_unique_id: str, key: ImageKey) -> str | None:
+        known_digest = self.file_ids.get(file_unique_id)
+        if known_digest:
+            result = self.results.get(known_digest)
+            if result is not None:
+                self.hits += 1
+                return result
+
+        result = self.results.get(key.digest)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        if not self.max_distance or key.phash is None:
+            return None
+        candidates = set()
+        for band in _bands(key.phash, self.max_distance + 1):
+            candidates.update(self.bands.get(band) or [])
+        matches = []
+        for digest in candidates:
+            hashes = self.hashes.get(digest)
+            if not hashes:
+                continue
+            phash, fingerprint = hashes
+            distance = hamming_distance(phash, key.phash)
+            fingerprint_distance = hamming_distance(fingerprint, key.fingerprint)
+            if distance <= self.max_distance and fingerprint_distance <= self.max_fingerprint_distance:
+                matches.append((distance, fingerprint_distance, digest))
+        for _, _, digest in sorted(matches):
+            result = self.results.get(digest)
+            if result is not None:
+                self.near_hits += 1
+                return result
+        return None
+
+    async def _shared_lookup(self, file_unique_id: str, key: ImageKey) -> str | None:
+        known = await self.file_ids.shared_get_many([file_unique_id])
+        digests = [d for d in (known.get(file_unique_id), key.digest) if d]
+        found = await self.results.shared_get_many(digests)
+        for digest in digests:
+            if digest in found:
+                self.shared_hits += 1
+                return found[digest]
+        return None
+
+    def _store(self, file_unique_id: str, key: ImageKey, result: str):
+        self.results.set(key.digest, result)
+        self.file_ids.set(file_unique_id, key.digest)
+        if self.max_distance and key.phash is not None:
+            self.hashes.set(key.digest, [key.phash, key.fingerprint])
+            for band in _bands(key.phash, self.max_distance + 1):
+                digests = [d for d in self.bands.get(band) or [] if d != key.digest]
+                self.bands.set(band, [key.digest] + digests[:BAND_MAX_HASHES - 1])
+
+    async def get(self, file_unique_id: str, key: ImageKey) -> str | None:
+        result = await asyncio.to_thread(self._lookup, file_unique_id, key)
+        if result is None:
+            result = await self._shared_lookup(file_unique_id, key)
+        if result is None:
+            self.misses += 1
+        return result
+
+    async def set(self, file_unique_id: str, key: ImageKey, result: str):
+        await asyncio.to_thread(self._store, file_unique_id, key, result)
+        await self.results.shared_set(key.digest, result)
+        await self.file_ids.shared_set(file_unique_id, key.digest)
+
+    def close(self):
+        for cache in (self.results, self.file_ids, self.hashes, self.bands):
+            cache.close()
+
+    def stats(self) -> dict:
+        found = self.hits + self.near_hits + self.shared_hits
+        total = found + self.misses
+        return {
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": found / total if total else 0.0,
+            "evictions": self.results.evictions,
+        }
+
@@ -1,22 +1,8 @@
-import os
-import google.generativeai as genai
 import json
-from dotenv import load_dotenv
+from model_client import ModelRequest
+from runtime import get_runtime
 
-# Загружаем переменные окружения
-load_dotenv()
-
-# Настройка Gemini API
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY not found. Please set the environment variable.")
-
-genai.configure(api_key=api_key)
-model = genai.GenerativeModel('gemini-1.5-flash-latest')
-
-generation_config = genai.types.GenerationConfig(
-    max_output_tokens=8192,
-)
+MAX_OUTPUT_TOKENS = 8192
 
 async def process_menu_section(text_section: str, user_lang: str = "русский") -> list | None:
     """
@@ -55,7 +41,7 @@ async def process_menu_section(text_section: str, user_lang: str = "русски
         }}
         """
         
-        response = await model.generate_content_async(prompt, generation_config=generation_config)
+        response = await get_runtime().model_client.generate(ModelRequest([prompt], MAX_OUTPUT_TOKENS))
         
         response_text = response.text.strip()
         
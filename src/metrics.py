@@ -0,0 +1,342 @@
+import contextvars
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable
+
+from config import METRICS_HOST, METRICS_PORT, PROFILE_SAMPLE_RATE, PROFILE_DIR
+
+# Границы гистограмм: длительность этапа (секунды) и токены модели на одно меню
+STAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+TOKEN_BUCKETS = (500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _header(name: str, help: str, kind: str) -> list[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+
+
+def _samples(name: str, help: str, kind: str, labels: tuple[str, ...], samples: list[tuple[tuple, float]]) -> list[str]:
+    """Метрика из готовых значений (статистика компонентов, снятая в момент запроса /metrics)."""
+    lines = _header(name, help, kind)
+    for values, value in samples:
+        if value is not None:
+            lines.append(f"{name}{_labels(labels, values)} {float(value)}")
+    return lines
+
+
+class Counter:
+    """Счетчик с метками в текстовом формате Prometheus."""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            return _samples(self.name, self.help, "counter", self.labels, list(self.values.items()))
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами: по ней Prometheus считает перцентили (histogram_quantile)."""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple = STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # Для каждого набора меток: накопленные счетчики по границам, сумма и количество наблюдений
+        self.values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            entry = self.values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list[str]:
+        lines = _header(self.name, self.help, "histogram")
+        bucket_labels = self.labels + ("le",)
+        with self._lock:
+            for key, (counts, total, count) in self.values.items():
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(bucket_labels, key + (bound,))} {bucket}")
+                lines.append(f"{self.name}_bucket{_labels(bucket_labels, key + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("dishlingo_stage_seconds", "Duration of menu processing stages", ("stage",))
+MENU_TOKENS = Histogram("dishlingo_menu_tokens", "Model tokens (input + output) spent on one menu",
+                        buckets=TOKEN_BUCKETS)
+MENUS = Counter("dishlingo_menus_total", "Processed menu photos by outcome", ("outcome",))
+MODEL_REQUESTS = Counter("dishlingo_model_requests_total", "Model requests by provider and outcome",
+                         ("provider", "outcome"))
+MODEL_TOKENS = Counter("dishlingo_model_tokens_total", "Model tokens reported by providers",
+                       ("provider", "direction"))
+PEXELS_RESPONSES = Counter("dishlingo_pexels_responses_total", "Pexels API responses by HTTP status",
+                           ("status",))
+PEXELS_IMAGES = Counter("dishlingo_pexels_images_total", "Dish images by source (cache, batch, search, miss)",
+                        ("source",))
+PHOTO_CHECKS = Counter("dishlingo_photo_checks_total", "Local photo pre-check results: ok or rejection reason",
+                       ("result",))
+PROFILES = Counter("dishlingo_profiles_total", "Sampled cProfile dumps written")
+
+REGISTRY = (STAGE_SECONDS, MENU_TOKENS, MENUS, MODEL_REQUESTS, MODEL_TOKENS, PEXELS_RESPONSES, PEXELS_IMAGES,
+            PHOTO_CHECKS, PROFILES)
+
+
+@dataclass
+class MenuTrace:
+    """Этапы и токены обработки одного меню: сколько длился каждый этап и сколько стоила модель."""
+    label: str
+    stages: dict[str, float] = field(default_factory=dict)
+    model_calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+    def summary(self) -> dict:
+        return {
+            "menu": self.label,
+            "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+            "model_calls": self.model_calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+        }
+
+
+# Трассировка текущего меню. Задачи и потоки (asyncio.to_thread), запущенные при его обработке,
+# наследуют контекст, поэтому их этапы и токены попадают в ту же трассировку
+_trace: contextvars.ContextVar[MenuTrace | None] = contextvars.ContextVar("menu_trace", default=None)
+_span_listeners: list[Callable[[str, float], None]] = []
+
+
+def add_span_listener(listener: Callable[[str, float], None]):
+    """Подписывает на каждый завершенный этап (имя, секунды) — например, бенчмарк для точных перцентилей."""
+    _span_listeners.append(listener)
+
+
+@contextmanager
+def span(stage: str):
+    """Замеряет этап обработки меню: гистограмма dishlingo_stage_seconds и трассировка текущего меню."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.stages[stage] = trace.stages.get(stage, 0.0) + elapsed
+        for listener in _span_listeners:
+            listener(stage, elapsed)
+
+
+@contextmanager
+def menu_trace(label: str):
+    """
+    Собирает этапы и токены одного меню и в конце печатает их одной JSON-строкой,
+    по которой видно, какой этап занял время и сколько токенов стоило меню.
+    """
+    trace = MenuTrace(label)
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+        if trace.model_calls:
+            MENU_TOKENS.observe(trace.input_tokens + trace.output_tokens)
+        print("menu trace:", json.dumps(trace.summary(), ensure_ascii=False))
+
+
+def record_model_call(provider: str, outcome: str):
+    MODEL_REQUESTS.inc(provider=provider, outcome=outcome)
+    trace = _trace.get()
+    if trace is not None and outcome == "ok":
+        trace.model_calls += 1
+
+
+def record_tokens(provider: str, input_tokens: int, output_tokens: int):
+    """Учитывает токены запроса к модели (usage_metadata у Gemini, usage у остальных провайдеров)."""
+    if input_tokens:
+        MODEL_TOKENS.inc(input_tokens, provider=provider, direction="input")
+    if output_tokens:
+        MODEL_TOKENS.inc(output_tokens, provider=provider, direction="output")
+    trace = _trace.get()
+    if trace is not None:
+        trace.input_tokens += input_tokens
+        trace.output_tokens += output_tokens
+
+
+def record_pexels_status(status: int | str):
+    PEXELS_RESPONSES.inc(status=str(status))
+
+
+# cProfile работает на весь поток, поэтому одновременно профилируется не больше одного меню
+_profile_lock = threading.Lock()
+
+
+@contextmanager
+def sampled_profile(name: str, rate: float = PROFILE_SAMPLE_RATE, directory: str = PROFILE_DIR):
+    """
+    Профилирует долю `rate` вызовов через cProfile и сохраняет .prof в `directory`
+    (смотреть через python -m pstats или snakeviz). Профиль охватывает весь цикл событий,
+    включая другие меню, которые обрабатывались в это время; код в asyncio.to_thread в него не попадает.
+    """
+    if rate <= 0 or random.random() >= rate or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _profile_lock.release()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        PROFILES.inc()
+        print(f"Профиль сохранен: {path}")
+
+
+def _component_metrics() -> list[str]:
+    """Статистика очереди, кэшей, планировщика Pexels, объединения запросов и провайдеров моделей."""
+    # Импорт здесь: компоненты сами пишут метрики через этот модуль
+    from handlers import photo_flight
+    from image_fetcher import scheduler, pexels_flight
+    from job_queue import job_queue
+    from runtime import get_runtime
+
+    lines = []
+    jobs = job_queue.metrics()
+    lines += _samples("dishlingo_jobs", "Menu jobs in the queue by state", "gauge", ("state",),
+                      [(("queued",), jobs["queued"]), (("running",), jobs["running"])])
+    lines += _samples("dishlingo_jobs_total", "Finished and rejected menu jobs", "counter", ("outcome",),
+                      [(("completed",), jobs["completed"]), (("shed",), jobs["shed"]),
+                       (("rate_limited",), jobs["rate_limited"])])
+
+    runtime = get_runtime()
+    cache_requests, cache_evictions = [], []
+    menu_cache = runtime.created("menu_cache")
+    if menu_cache is not None:
+        stats = menu_cache.stats()
+        for outcome in ("hits", "near_hits", "shared_hits", "misses"):
+            cache_requests.append((("menu", outcome), stats[outcome]))
+        cache_evictions.append((("menu",), stats["evictions"]))
+    for name in ("image_cache", "image_prompt_cache", "translation_memory"):
+        cache = runtime.created(name)
+        if cache is not None:
+            stats = cache.stats()
+            for outcome in ("hits", "shared_hits", "misses"):
+                cache_requests.append(((name, outcome), stats[outcome]))
+            cache_evictions.append(((name,), stats["evictions"]))
+    lines += _samples("dishlingo_cache_requests_total", "Cache lookups by outcome", "counter",
+                      ("cache", "outcome"), cache_requests)
+    lines += _samples("dishlingo_cache_evictions_total", "Evicted cache entries", "counter", ("cache",),
+                      cache_evictions)
+
+    pexels = scheduler.metrics()
+    for key in ("in_flight", "concurrency_limit", "queue_depth", "hourly_used", "quota_remaining"):
+        lines += _samples(f"dishlingo_pexels_{key}", f"Pexels scheduler {key.replace('_', ' ')}", "gauge",
+                          (), [((), pexels[key])])
+    lines += _samples("dishlingo_pexels_throttled", "1 while Pexels requests wait out a 429 response", "gauge",
+                      (), [((), pexels["throttled"])])
+    for key in ("retries", "quota_rejections", "throttled_responses"):
+        lines += _samples(f"dishlingo_pexels_{key}_total", f"Pexels scheduler {key.replace('_', ' ')}",
+                          "counter", (), [((), pexels[key])])
+
+    flights = []
+    for flight in (photo_flight, pexels_flight):
+        stats = flight.metrics()
+        for result in ("executed", "shared", "remote"):
+            flights.append(((flight.name, result), stats[result]))
+    lines += _samples("dishlingo_singleflight_total", "Deduplicated calls by result", "counter",
+                      ("flight", "result"), flights)
+
+    latency, healthy, hedges, explorations = [], [], [], []
+    for name in ("model_client", "prompt_client"):
+        client = runtime.created(name)
+        if client is None:
+            continue
+        stats = client.metrics()
+        hedges.append(((name,), stats["hedges"]))
+        explorations.append(((name,), stats["explorations"]))
+        for provider, provider_stats in stats["providers"].items():
+            latency.append(((name, provider, "0.5"), provider_stats["p50"]))
+            latency.append(((name, provider, "0.95"), provider_stats["p95"]))
+            healthy.append(((name, provider), int(provider_stats["healthy"])))
+    lines += _samples("dishlingo_model_latency_seconds", "Model provider latency over the recent window",
+                      "gauge", ("client", "provider", "quantile"), latency)
+    lines += _samples("dishlingo_model_healthy", "Whether the provider receives traffic", "gauge",
+                      ("client", "provider"), healthy)
+    lines += _samples("dishlingo_model_hedges_total", "Hedged duplicate model requests", "counter",
+                      ("client",), hedges)
+    lines += _samples("dishlingo_model_explorations_total", "Requests routed to a provider with stale latency stats",
+                      "counter", ("client",), explorations)
+    return lines
+
+
+def render_metrics() -> str:
+    """Все метрики процесса в текстовом формате Prometheus."""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    lines += _component_metrics()
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_handler(request):
+    from aiohttp import web
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+_server = None
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """Отдельный HTTP-сервер для /metrics в режиме polling (в режиме webhook маршрут есть в основном приложении)."""
+    global _server
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    _server = web.AppRunner(app)
+    await _server.setup()
+    await web.TCPSite(_server, host, port).start()
+    print(f"Метрики доступны на http://{host}:{port}/metrics")
+
+
+async def stop_metrics_server():
+    global _server
+    if _server is not None:
+        await _server.cleanup()
+        _server = None
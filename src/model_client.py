@@ -0,0 +1,455 @@
+import asyncio
+import base64
+import json
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+from config import (
+    GEMINI_API_KEY, OPENAI_API_KEY, ANTHROPIC_API_KEY,
+    GEMINI_MODEL, OPENAI_MODEL, ANTHROPIC_MODEL, MODEL_PROVIDERS,
+    MODEL_HEDGING, MODEL_HEDGE_SAME_PROVIDER, MODEL_HEDGE_DEFAULT_DELAY, MODEL_LATENCY_WINDOW, MODEL_FAILURE_COOLDOWN,
+    MODEL_EXPLORATION_RATE, MODEL_STATS_MAX_AGE,
+)
+from metrics import record_model_call, record_tokens
+
+# Сколько замеров нужно, чтобы доверять перцентилям провайдера
+MIN_LATENCY_SAMPLES = 5
+# После стольких ошибок подряд провайдер временно исключается из маршрутизации
+MAX_CONSECUTIVE_FAILURES = 3
+
+
+@dataclass
+class ModelRequest:
+    """
+    Запрос к модели. `parts` — строки и изображения в виде {"mime_type": ..., "data": bytes}.
+    `json_schema` — схема structured output (в формате Gemini); провайдеры без поддержки схем
+    получают обычный JSON-режим.
+    """
+    parts: list
+    max_output_tokens: int = 8192
+    json_schema: dict | None = None
+
+
+@dataclass
+class ModelResponse:
+    text: str
+    provider: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+class Provider:
+    """Базовый класс провайдера модели."""
+
+    name = "provider"
+
+    async def generate(self, request: ModelRequest) -> ModelResponse:
+        raise NotImplementedError
+
+    async def stream(self, request: ModelRequest) -> AsyncIterator[str]:
+        # По умолчанию провайдер без потокового режима отдает ответ одним фрагментом
+        response = await self.generate(request)
+        yield response.text
+
+    async def close(self):
+        pass
+
+
+class GeminiProvider(Provider):
+    def __init__(self, model_name: str = GEMINI_MODEL, api_key: str | None = GEMINI_API_KEY):
+        # SDK Gemini импортируется долго, поэтому загружаем его только при создании провайдера
+        import google.generativeai as genai
+        self.name = f"gemini:{model_name}"
+        self.genai = genai
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def _config(self, request: ModelRequest):
+        genai = self.genai
+        if request.json_schema:
+            return genai.types.GenerationConfig(
+                max_output_tokens=request.max_output_tokens,
+                response_mime_type="application/json",
+                response_schema=request.json_schema,
+            )
+        return genai.types.GenerationConfig(max_output_tokens=request.max_output_tokens)
+
+    async def generate(self, request: ModelRequest) -> ModelResponse:
+        response = await self.model.generate_content_async(request.parts, generation_config=self._config(request))
+        usage = getattr(response, "usage_metadata", None)
+        return ModelResponse(
+            text=response.text,
+            provider=self.name,
+            input_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+        )
+
+    async def stream(self, request: ModelRequest) -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(
+            request.parts, generation_config=self._config(request), stream=True
+        )
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Фрагмент без текста (например, только метаданные о завершении)
+                continue
+            if text:
+                yield text
+        # После последнего фрагмента ответ содержит итоговый usage_metadata
+        usage = getattr(response, "usage_metadata", None)
+        record_tokens(self.name, getattr(usage, "prompt_token_count", 0) or 0,
+                      getattr(usage, "candidates_token_count", 0) or 0)
+
+
+def _data_url(part: dict) -> str:
+    return f"data:{part['mime_type']};base64,{base64.b64encode(part['data']).decode()}"
+
+
+class OpenAIProvider(Provider):
+    URL = "https://api.openai.com/v1/chat/completions"
+
+    def __init__(self, model_name: str = OPENAI_MODEL, api_key: str | None = OPENAI_API_KEY):
+        import httpx
+        self.name = f"openai:{model_name}"
+        self.model_name = model_name
+        self.client = httpx.AsyncClient(timeout=120.0, headers={"Authorization": f"Bearer {api_key}"})
+
+    def _payload(self, request: ModelRequest, stream: bool) -> dict:
+        content = []
+        for part in request.parts:
+            if isinstance(part, str):
+                content.append({"type": "text", "text": part})
+            else:
+                content.append({"type": "image_url", "image_url": {"url": _data_url(part)}})
+        payload = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": content}],
+            "max_tokens": request.max_output_tokens,
+            "stream": stream,
+        }
+        if request.json_schema:
+            payload["response_format"] = {"type": "json_object"}
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    async def generate(self, request: ModelRequest) -> ModelResponse:
+        response = await self.client.post(self.URL, json=self._payload(request, stream=False))
+        response.raise_for_status()
+        data = response.json()
+        usage = data.get("usage", {})
+        return ModelResponse(
+            text=data["choices"][0]["message"]["content"] or "",
+            provider=self.name,
+            input_tokens=usage.get("prompt_tokens", 0),
+            output_tokens=usage.get("completion_tokens", 0),
+        )
+
+    async def stream(self, request: ModelRequest) -> AsyncIterator[str]:
+        async with self.client.stream("POST", self.URL, json=self._payload(request, stream=True)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: ") or line == "data: [DONE]":
+                    continue
+                data = json.loads(line[6:])
+                if data.get("usage"):
+                    # Последний фрагмент (stream_options.include_usage) несет расход токенов
+                    record_tokens(self.name, data["usage"].get("prompt_tokens", 0),
+                                  data["usage"].get("completion_tokens", 0))
+                choices = data.get("choices") or []
+                text = choices[0].get("delta", {}).get("content") if choices else None
+                if text:
+                    yield text
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class AnthropicProvider(Provider):
+    URL = "https://api.anthropic.com/v1/messages"
+
+    def __init__(self, model_name: str = ANTHROPIC_MODEL, api_key: str | None = ANTHROPIC_API_KEY):
+        import httpx
+        self.name = f"anthropic:{model_name}"
+        self.model_name = model_name
+        self.client = httpx.AsyncClient(timeout=120.0, headers={
+            "x-api-key": api_key or "",
+            "anthropic-version": "2023-06-01",
+        })
+
+    def _payload(self, request: ModelRequest, stream: bool) -> dict:
+        content = []
+        for part in request.parts:
+            if isinstance(part, str):
+                content.append({"type": "text", "text": part})
+            else:
+                content.append({"type": "image", "source": {
+                    "type": "base64",
+                    "media_type": part["mime_type"],
+                    "data": base64.b64encode(part["data"]).decode(),
+                }})
+        return {
+            "model": self.model_name,
+            "max_tokens": request.max_output_tokens,
+            "messages": [{"role": "user", "content": content}],
+            "stream": stream,
+        }
+
+    async def generate(self, request: ModelRequest) -> ModelResponse:
+        response = await self.client.post(self.URL, json=self._payload(request, stream=False))
+        response.raise_for_status()
+        data = response.json()
+        usage = data.get("usage", {})
+        return ModelResponse(
+            text="".join(block.get("text", "") for block in data.get("content", [])),
+            provider=self.name,
+            input_tokens=usage.get("input_tokens", 0),
+            output_tokens=usage.get("output_tokens", 0),
+        )
+
+    async def stream(self, request: ModelRequest) -> AsyncIterator[str]:
+        async with self.client.stream("POST", self.URL, json=self._payload(request, stream=True)) as response:
+            response.raise_for_status()
+            input_tokens = output_tokens = 0
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if event.get("type") == "content_block_delta":
+                    text = event.get("delta", {}).get("text")
+                    if text:
+                        yield text
+                elif event.get("type") == "message_start":
+                    input_tokens = event.get("message", {}).get("usage", {}).get("input_tokens", 0)
+                elif event.get("type") == "message_delta":
+                    output_tokens = event.get("usage", {}).get("output_tokens", 0)
+            record_tokens(self.name, input_tokens, output_tokens)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+@dataclass
+class ProviderStats:
+    """Скользящее окно задержек и состояние здоровья провайдера."""
+    latencies: deque = field(default_factory=lambda: deque(maxlen=MODEL_LATENCY_WINDOW))
+    consecutive_failures: int = 0
+    unhealthy_until: float = 0.0
+    requests: int = 0
+    failures: int = 0
+    hedges_won: int = 0
+    last_sample_at: float = 0.0
+
+    def percentile(self, p: float) -> float | None:
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.unhealthy_until
+
+    def stale(self, now: float, max_age: float) -> bool:
+        """Замеров мало или последний слишком старый: медиана не отражает текущую задержку."""
+        return len(self.latencies) < MIN_LATENCY_SAMPLES or now - self.last_sample_at > max_age
+
+    def record_success(self, latency: float):
+        self.requests += 1
+        self.latencies.append(latency)
+        self.last_sample_at = time.monotonic()
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+            self.unhealthy_until = time.monotonic() + MODEL_FAILURE_COOLDOWN
+            self.consecutive_failures = 0
+
+
+class ModelClient:
+    """
+    Асинхронный клиент к нескольким провайдерам моделей.
+
+    * Запрос уходит самому быстрому здоровому провайдеру (по медиане задержки). Доля запросов
+      `exploration_rate` уходит здоровому провайдеру без свежей статистики, иначе после первых
+      замеров остальные провайдеры получали бы запросы только при ошибках и хеджировании.
+    * При включенном хеджировании, если ответ задерживается дольше p95 этого провайдера, отправляется
+      дублирующий (hedged) запрос следующему провайдеру; побеждает первый успешный ответ,
+      проигравший отменяется. Тому же провайдеру дубль уходит, только если это явно разрешено.
+    * При ошибке запрос переходит к следующему провайдеру, провайдер с несколькими ошибками
+      подряд временно исключается.
+    """
+
+    def __init__(self, providers: list[Provider], hedging: bool = MODEL_HEDGING,
+                 default_hedge_delay: float = MODEL_HEDGE_DEFAULT_DELAY,
+                 hedge_same_provider: bool = MODEL_HEDGE_SAME_PROVIDER,
+                 exploration_rate: float = MODEL_EXPLORATION_RATE, stats_max_age: float = MODEL_STATS_MAX_AGE):
+        if not providers:
+            raise ValueError("ModelClient requires at least one provider")
+        self.providers = providers
+        self.hedging = hedging
+        self.default_hedge_delay = default_hedge_delay
+        self.hedge_same_provider = hedge_same_provider
+        self.exploration_rate = exploration_rate
+        self.stats_max_age = stats_max_age
+        self.stats = {provider.name: ProviderStats() for provider in providers}
+        self.hedges = 0
+        self.explorations = 0
+
+    def ranked(self) -> list[Provider]:
+        """
+        Провайдеры по возрастанию медианной задержки; нездоровые — в конце. Иногда первым ставится
+        здоровый провайдер без свежей статистики, чтобы его задержка снова была измерена.
+        """
+        now = time.monotonic()
+
+        def key(item):
+            index, provider = item
+            stats = self.stats[provider.name]
+            p50 = stats.percentile(50)
+            # Провайдеры без статистики идут после измеренных в порядке из конфигурации
+            return (not stats.healthy(now), p50 if p50 is not None else float("inf"), index)
+
+        ordered = [provider for _, provider in sorted(enumerate(self.providers), key=key)]
+        if len(ordered) > 1 and random.random() < self.exploration_rate:
+            stale = [provider for provider in ordered[1:]
+                     if self.stats[provider.name].healthy(now)
+                     and self.stats[provider.name].stale(now, self.stats_max_age)]
+            if stale:
+                explored = random.choice(stale)
+                ordered.remove(explored)
+                ordered.insert(0, explored)
+                self.explorations += 1
+        return ordered
+
+    async def _call(self, provider: Provider, request: ModelRequest) -> ModelResponse:
+        stats = self.stats[provider.name]
+        started = time.monotonic()
+        try:
+            response = await provider.generate(request)
+        except asyncio.CancelledError:
+            # Проигравший дубль хеджирования тоже тарифицируется, но его расход провайдер уже не сообщит
+            record_model_call(provider.name, "cancelled")
+            raise
+        except Exception:
+            stats.record_failure()
+            record_model_call(provider.name, "error")
+            raise
+        stats.record_success(time.monotonic() - started)
+        record_model_call(provider.name, "ok")
+        record_tokens(provider.name, response.input_tokens, response.output_tokens)
+        return response
+
+    async def generate(self, request: ModelRequest) -> ModelResponse:
+        candidates = self.ranked()
+        primary = candidates[0]
+        # После ошибки запрос переходит к следующему провайдеру, а если он один — повторяется ему же
+        backups = candidates[1:] or [primary]
+        # Дубль тому же провайдеру удваивает расход именно тогда, когда он перегружен
+        can_hedge = self.hedging and (len(candidates) > 1 or self.hedge_same_provider)
+
+        hedge_delay = self.stats[primary.name].percentile(95) or self.default_hedge_delay
+        pending = {asyncio.create_task(self._call(primary, request))}
+        last_error = None
+        hedged = False
+
+        try:
+            while pending or backups:
+                if not pending:
+                    pending.add(asyncio.create_task(self._call(backups.pop(0), request)))
+
+                timeout = hedge_delay if can_hedge and not hedged and backups else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # Основной запрос не уложился в свой p95 — отправляем дубль
+                    hedged = True
+                    self.hedges += 1
+                    provider = backups.pop(0)
+                    pending.add(asyncio.create_task(self._call(provider, request)))
+                    continue
+
+                for task in done:
+                    if task.exception() is None:
+                        response = task.result()
+                        if hedged and response.provider != primary.name:
+                            self.stats[response.provider].hedges_won += 1
+                        return response
+                    last_error = task.exception()
+                    print(f"Model request failed: {last_error}")
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise last_error
+
+    async def stream(self, request: ModelRequest) -> AsyncIterator[str]:
+        """
+        Потоковый ответ от самого быстрого здорового провайдера. Хеджирование здесь не используется,
+        но если провайдер упал до первого фрагмента, запрос переходит к следующему.
+        """
+        last_error = None
+        for provider in self.ranked():
+            stats = self.stats[provider.name]
+            started = time.monotonic()
+            received = False
+            try:
+                async for text in provider.stream(request):
+                    received = True
+                    yield text
+                stats.record_success(time.monotonic() - started)
+                record_model_call(provider.name, "ok")
+                return
+            except Exception as e:
+                stats.record_failure()
+                record_model_call(provider.name, "error")
+                if received:
+                    raise
+                last_error = e
+                print(f"Model stream failed on {provider.name}: {e}")
+        raise last_error
+
+    def metrics(self) -> dict:
+        return {
+            "hedges": self.hedges,
+            "explorations": self.explorations,
+            "providers": {
+                name: {
+                    "p50": stats.percentile(50),
+                    "p95": stats.percentile(95),
+                    "requests": stats.requests,
+                    "failures": stats.failures,
+                    "hedges_won": stats.hedges_won,
+                    "healthy": stats.healthy(time.monotonic()),
+                }
+                for name, stats in self.stats.items()
+            },
+        }
+
+    async def close(self):
+        for provider in self.providers:
+            await provider.close()
+
+
+def create_model_client(gemini_model: str = GEMINI_MODEL, names: list[str] = MODEL_PROVIDERS) -> ModelClient:
+    """Собирает клиент из провайдеров, перечисленных в MODEL_PROVIDERS. У каждого должен быть задан ключ API."""
+    factories = {
+        "gemini": (GEMINI_API_KEY, "GEMINI_API_KEY", lambda: GeminiProvider(gemini_model)),
+        "openai": (OPENAI_API_KEY, "OPENAI_API_KEY", OpenAIProvider),
+        "anthropic": (ANTHROPIC_API_KEY, "ANTHROPIC_API_KEY", AnthropicProvider),
+    }
+    providers = []
+    for name in names:
+        if name not in factories:
+            raise ValueError(f"Неизвестный провайдер модели в MODEL_PROVIDERS: {name}. Допустимы: {', '.join(factories)}.")
+        key, variable, factory = factories[name]
+        if not key:
+            raise ValueError(f"Провайдер {name} указан в MODEL_PROVIDERS, но {variable} не задан.")
+        providers.append(factory())
+    return ModelClient(providers)
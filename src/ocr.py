@@ -1,77 +1,158 @@
+from typing import AsyncIterator
+from config import COMPACT_SCHEMA
+from dish import CATEGORY_CHOICES, COMPACT_RESPONSE_SCHEMA, EXTRACT_RESPONSE_SCHEMA
+from model_client import ModelRequest
+from runtime import get_runtime
 
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+# Увеличиваем максимальное количество токенов для ответа
+MAX_OUTPUT_TOKENS = 8192
+# Ответу первой фазы двухфазного режима (только названия и цены) хватает меньшего лимита
+EXTRACT_MAX_OUTPUT_TOKENS = 4096
 
-# Загружаем переменные окружения
-load_dotenv()
+# Требование к описанию блюда, общее для распознавания фото и перевода названий (two_phase)
+SHORT_DESCRIPTION_RULE = "Создай ОЧЕНЬ краткое, аппетитное описание (не более 10 слов). Это поле обязательно для всех, кроме напитков."
 
-# Настройка Gemini API
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY not found in ocr.py. Please set the environment variable.")
+MENU_PROMPT = """
+Проанализируй изображение меню. Извлеки все блюда и верни их в виде единого JSON-объекта.
 
-genai.configure(api_key=api_key)
-model = genai.GenerativeModel('gemini-1.5-flash-latest')
+Инструкции:
+1.  Создай JSON-объект с двумя ключами: "menu" и "isPartial".
+2.  Ключ "menu" должен содержать массив всех извлеченных блюд.
+3.  Ключ "isPartial" должен быть `true`, если ты не смог прочитать или обработать всё меню целиком, и `false` в противном случае.
+4.  Для каждого блюда в массиве "menu":
+    a. Переведи названия на русский язык.
+    b. Укажи категорию (закуска, основное блюдо, десерт, напиток, и т.д.).
+    c. Извлеки цену как есть. Если цена не видна или неразборчива, используй строку 'нечитаемое'.
+    d. {description_rule}
+    e. Перечисли **не более 4-х ключевых** видимых ингредиентов. Если они не указаны, сделай разумные выводы из названия блюда. Если и это невозможно, используй ["неизвестно"].
+5.  Не добавляй никакого другого текста до или после JSON-объекта.
 
-# Увеличиваем максимальное количество токенов для ответа
-generation_config = genai.types.GenerationConfig(
-    max_output_tokens=8192,
-)
+Формат итогового JSON-объекта:
+{{
+  "isPartial": false,
+  "menu": [{{
+    "originalName": "точное название из меню",
+    "translatedName": "перевод на русский",
+    "image": "placeholder",
+    "category": "категория",
+    "price": "цена или 'нечитаемое'",
+    "shortDescription": "сгенерированное ОЧЕНЬ краткое описание (макс. 10 слов)",
+    "ingredients": ["ключевой ингредиент 1", "ингредиент 2"],
+    "containsGluten": "yes|no|unknown",
+    "containsMilk": "yes|no|unknown"
+  }}]
+}}
+""".format(description_rule=SHORT_DESCRIPTION_RULE)
+
+COMPACT_MENU_PROMPT = """
+Проанализируй изображение меню и извлеки все блюда по заданной JSON-схеме.
+p: true, если часть меню не удалось прочитать.
+d: блюда. Для каждого:
+n — точное название из меню; t — перевод на русский;
+c — категория, строго одно из значений: {categories};
+pr — цена как есть или 'нечитаемое';
+s — аппетитное описание на русском, не более 10 слов (для напитков можно пусто);
+i — до 4 ключевых ингредиентов на русском (можно предположить по названию);
+g — содержит глютен, m — содержит молоко: y, n или u (неизвестно).
+""".format(categories=CATEGORY_CHOICES)
+
+EXTRACT_PROMPT = """
+Прочитай изображение меню и выпиши позиции по заданной JSON-схеме, ничего не переводя и не описывая.
+p: true, если часть меню не удалось прочитать.
+d: позиции меню. Для каждой:
+n — точное название из меню;
+c — категория по разделу меню или по названию, строго одно из значений: {categories};
+pr — цена как есть или 'нечитаемое'.
+""".format(categories=CATEGORY_CHOICES)
+
+PAGES_PROMPT_NOTE = """
+Ниже {count} изображений — это страницы одного меню. Считай их одним меню: верни все блюда со всех страниц
+в одном ответе, а блюдо, которое видно на нескольких страницах, укажи один раз.
+"""
 
-async def process_menu_image(image_path: str) -> str:
+def _request(image_bytes: bytes, mime_type: str) -> ModelRequest:
+    """Собирает запрос к модели для выбранного формата ответа."""
+    image_part = _image_part(image_bytes, mime_type)
+    if COMPACT_SCHEMA:
+        # Модель сама следит за форматом по схеме, разбор не требует вырезания ```json
+        return ModelRequest([COMPACT_MENU_PROMPT, image_part], MAX_OUTPUT_TOKENS, COMPACT_RESPONSE_SCHEMA)
+    return ModelRequest([MENU_PROMPT, image_part], MAX_OUTPUT_TOKENS)
+
+def _pages_request(pages: list[tuple[bytes, str]]) -> ModelRequest:
+    """Один запрос на несколько страниц меню: инструкция та же, изображения идут подряд."""
+    request = _request(*pages[0])
+    note = PAGES_PROMPT_NOTE.format(count=len(pages))
+    images = [_image_part(image_bytes, mime_type) for image_bytes, mime_type in pages]
+    return ModelRequest([note + request.parts[0], *images], request.max_output_tokens, request.json_schema)
+
+def _image_part(image_bytes: bytes, mime_type: str) -> dict:
+    return {
+        "mime_type": mime_type,
+        "data": image_bytes
+    }
+
+async def process_menu_image(image_bytes: bytes, mime_type: str = "image/jpeg") -> str:
     """
     Извлекает весь видимый текст из изображения, анализирует его и возвращает в виде JSON.
     """
     try:
-        print(f"Extracting and processing data from: {image_path}")
-        
-        image_part = {
-            "mime_type": "image/jpeg",
-            "data": open(image_path, "rb").read()
-        }
-        
-        prompt = """
-        Проанализируй изображение меню. Извлеки все блюда и верни их в виде единого JSON-объекта.
-
-        Инструкции:
-        1.  Создай JSON-объект с двумя ключами: "menu" и "isPartial".
-        2.  Ключ "menu" должен содержать массив всех извлеченных блюд.
-        3.  Ключ "isPartial" должен быть `true`, если ты не смог прочитать или обработать всё меню целиком, и `false` в противном случае.
-        4.  Для каждого блюда в массиве "menu":
-            a. Переведи названия на русский язык.
-            b. Укажи категорию (закуска, основное блюдо, десерт, напиток, и т.д.).
-            c. Извлеки цену как есть. Если цена не видна или неразборчива, используй строку 'нечитаемое'.
-            d. Создай ОЧЕНЬ краткое, аппетитное описание (не более 10 слов). Это поле обязательно для всех, кроме напитков.
-            e. Перечисли **не более 4-х ключевых** видимых ингредиентов. Если они не указаны, сделай разумные выводы из названия блюда. Если и это невозможно, используй ["неизвестно"].
-        5.  Не добавляй никакого другого текста до или после JSON-объекта.
-
-        Формат итогового JSON-объекта:
-        {
-          "isPartial": false,
-          "menu": [{
-            "originalName": "точное название из меню",
-            "translatedName": "перевод на русский",
-            "image": "placeholder",
-            "category": "категория",
-            "price": "цена или 'нечитаемое'",
-            "shortDescription": "сгенерированное ОЧЕНЬ краткое описание (макс. 10 слов)",
-            "ingredients": ["ключевой ингредиент 1", "ингредиент 2"],
-            "containsGluten": "yes|no|unknown",
-            "containsMilk": "yes|no|unknown"
-          }]
-        }
-        """
-        
-        response = await model.generate_content_async(
-            [prompt, image_part],
-            generation_config=generation_config
-        )
-        
+        print(f"Extracting and processing data from image: {len(image_bytes)} bytes")
+
+        response = await get_runtime().model_client.generate(_request(image_bytes, mime_type))
+
         response_text = response.text
-        print(f"Response received from model. Length: {len(response_text)} chars.")
+        print(f"Response received from {response.provider}. Length: {len(response_text)} chars.")
         return response_text.strip()
 
     except Exception as e:
-        print(f"Error processing image with Gemini: {str(e)}")
+        print(f"Error processing image with model: {str(e)}")
+        return ""
+
+async def process_menu_pages(pages: list[tuple[bytes, str]]) -> str:
+    """
+    Распознает несколько страниц меню одним запросом (изображение и MIME-тип для каждой).
+    Инструкция отправляется один раз, но ответ на все страницы генерируется последовательно.
+    """
+    try:
+        print(f"Extracting and processing data from {len(pages)} pages: {sum(len(data) for data, _ in pages)} bytes")
+
+        response = await get_runtime().model_client.generate(_pages_request(pages))
+
+        print(f"Response received from {response.provider}. Length: {len(response.text)} chars.")
+        return response.text.strip()
+
+    except Exception as e:
+        print(f"Error processing pages with model: {str(e)}")
+        return ""
+
+async def stream_menu_image(image_bytes: bytes, mime_type: str = "image/jpeg") -> AsyncIterator[str]:
+    """
+    Потоковый вариант process_menu_image: отдает фрагменты ответа модели по мере генерации,
+    чтобы блюда можно было разбирать и обрабатывать, не дожидаясь конца ответа.
+    """
+    print(f"Streaming menu data from image: {len(image_bytes)} bytes")
+
+    async for text in get_runtime().model_client.stream(_request(image_bytes, mime_type)):
+        yield text
+
+async def extract_menu_items(image_bytes: bytes, mime_type: str = "image/jpeg") -> str:
+    """
+    Первая фаза двухфазного режима: извлекает с фото только названия, категории и цены.
+    Возвращает JSON в компактном формате или пустую строку при ошибке.
+    """
+    try:
+        print(f"Extracting dish names from image: {len(image_bytes)} bytes")
+
+        request = ModelRequest(
+            [EXTRACT_PROMPT, _image_part(image_bytes, mime_type)],
+            EXTRACT_MAX_OUTPUT_TOKENS,
+            EXTRACT_RESPONSE_SCHEMA,
+        )
+        response = await get_runtime().model_client.generate(request)
+
+        print(f"Names received from {response.provider}. Length: {len(response.text)} chars.")
+        return response.text.strip()
+
+    except Exception as e:
+        print(f"Error extracting dish names with model: {str(e)}")
         return ""
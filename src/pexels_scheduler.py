@@ -0,0 +1,248 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from config import (
+    PEXELS_INITIAL_CONCURRENCY, PEXELS_MIN_CONCURRENCY, PEXELS_MAX_CONCURRENCY,
+    PEXELS_TARGET_LATENCY, PEXELS_HOURLY_BUDGET, PEXELS_MONTHLY_BUDGET,
+    PEXELS_MAX_RETRIES, PEXELS_MAX_WAIT,
+)
+from metrics import record_pexels_status
+
+if TYPE_CHECKING:
+    import httpx
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class QuotaExceeded(Exception):
+    """Бюджет запросов к Pexels исчерпан, и ждать его восстановления слишком долго."""
+
+
+class AdaptiveScheduler:
+    """
+    Планировщик запросов к Pexels.
+
+    * Лимит параллельности подстраивается по схеме AIMD: растет на успешных быстрых ответах
+      и уменьшается вдвое при 429, ошибках сервера или резком росте задержки.
+    * Учитывает заголовки X-Ratelimit-* и локальный часовой/месячный бюджет.
+    * Повторяет неудачные запросы с экспоненциальной задержкой и джиттером.
+    * Раздает свободные слоты по кругу между меню (потоками), а не в порядке очереди,
+      чтобы одно большое меню не блокировало остальных пользователей.
+    """
+
+    def __init__(self, initial_limit: int = PEXELS_INITIAL_CONCURRENCY,
+                 min_limit: int = PEXELS_MIN_CONCURRENCY, max_limit: int = PEXELS_MAX_CONCURRENCY,
+                 target_latency: float = PEXELS_TARGET_LATENCY,
+                 hourly_budget: int = PEXELS_HOURLY_BUDGET, monthly_budget: int = PEXELS_MONTHLY_BUDGET,
+                 max_retries: int = PEXELS_MAX_RETRIES, max_wait: float = PEXELS_MAX_WAIT,
+                 base_backoff: float = 0.5):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.hourly_budget = hourly_budget
+        self.monthly_budget = monthly_budget
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.base_backoff = base_backoff
+
+        self.in_flight = 0
+        self._waiters: dict[str, deque[asyncio.Future]] = {}
+        self._flow_order: deque[str] = deque()
+        self._hour_window: deque[float] = deque()
+
+        # Состояние, полученное из заголовков X-Ratelimit-*
+        self.quota_limit: int | None = None
+        self.quota_remaining: int | None = None
+        self.quota_reset_at: float | None = None
+        self.throttled_until = 0.0
+
+        self.requests = 0
+        self.retries = 0
+        self.throttled_responses = 0
+        self.quota_rejections = 0
+
+    # --- Слоты параллельности ---
+
+    async def _acquire(self, flow: str):
+        if not self._flow_order and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        if flow not in self._waiters:
+            self._waiters[flow] = deque()
+            self._flow_order.append(flow)
+        self._waiters[flow].append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже был выдан, но ожидающий отменен — возвращаем его
+                self._release()
+            raise
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._flow_order and self.in_flight < int(self.limit):
+            flow = self._flow_order.popleft()
+            queue = self._waiters[flow]
+            future = queue.popleft()
+            if queue:
+                self._flow_order.append(flow)
+            else:
+                del self._waiters[flow]
+            if future.cancelled():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    # --- AIMD ---
+
+    def _on_success(self, latency: float):
+        if latency > 2 * self.target_latency:
+            self._decrease()
+        elif latency <= self.target_latency:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._dispatch()
+
+    def _decrease(self):
+        self.limit = max(self.min_limit, self.limit / 2)
+
+    # --- Квоты ---
+
+    def _update_quota(self, response: "httpx.Response"):
+        headers = response.headers
+        try:
+            if "X-Ratelimit-Limit" in headers:
+                self.quota_limit = int(headers["X-Ratelimit-Limit"])
+            if "X-Ratelimit-Remaining" in headers:
+                self.quota_remaining = int(headers["X-Ratelimit-Remaining"])
+            if "X-Ratelimit-Reset" in headers:
+                self.quota_reset_at = float(headers["X-Ratelimit-Reset"])
+        except ValueError:
+            return
+
+        # Когда квота почти исчерпана, заранее снижаем параллельность
+        if self.quota_limit and self.quota_remaining is not None:
+            if self.quota_remaining < self.quota_limit * 0.05:
+                self._decrease()
+
+    def _quota_wait(self, now: float) -> float:
+        """Возвращает, сколько секунд нужно подождать до появления бюджета (0 — можно идти сразу)."""
+        while self._hour_window and now - self._hour_window[0] >= 3600:
+            self._hour_window.popleft()
+
+        wait = max(0.0, self.throttled_until - now)
+        if len(self._hour_window) >= self.hourly_budget:
+            wait = max(wait, self._hour_window[0] + 3600 - now)
+
+        monthly_exhausted = self.quota_remaining is not None and self.quota_remaining <= 0
+        if self.quota_limit is not None and self.quota_remaining is not None:
+            monthly_exhausted |= self.quota_limit - self.quota_remaining >= self.monthly_budget
+        if monthly_exhausted:
+            reset_wait = (self.quota_reset_at or now + 3600 * 24) - now
+            if reset_wait > 0:
+                wait = max(wait, reset_wait)
+        return wait
+
+    async def _reserve_budget(self):
+        """
+        Ждет свободного места в бюджете и занимает его. После ожидания бюджет проверяется снова:
+        пока запрос спал, освободившееся место могли занять другие запросы. Общее ожидание
+        ограничено `max_wait`.
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            now = time.time()
+            wait = self._quota_wait(now)
+            if wait <= 0:
+                # Между проверкой и записью нет await, поэтому место не займет никто другой
+                self._hour_window.append(now)
+                return
+            if wait > deadline - time.monotonic():
+                self.quota_rejections += 1
+                raise QuotaExceeded(f"Бюджет Pexels исчерпан, восстановление через {wait:.0f} с")
+            await asyncio.sleep(wait)
+
+    def _backoff(self, attempt: int, response: "httpx.Response | None") -> float:
+        if response is not None and "Retry-After" in response.headers:
+            try:
+                return float(response.headers["Retry-After"])
+            except ValueError:
+                pass
+        return random.uniform(0, self.base_backoff * 2 ** attempt)
+
+    # --- Публичный интерфейс ---
+
+    async def run(self, flow: str, send: Callable[[], Awaitable["httpx.Response"]]) -> "httpx.Response":
+        """
+        Выполняет запрос `send` с учетом лимитов и повторов.
+        `flow` — идентификатор меню, между потоками слоты делятся по кругу.
+        """
+        from httpx import TransportError
+        attempt = 0
+        while True:
+            await self._reserve_budget()
+            await self._acquire(flow)
+            response, error = None, None
+            started = time.monotonic()
+            try:
+                self.requests += 1
+                response = await send()
+            except TransportError as e:
+                error = e
+            finally:
+                latency = time.monotonic() - started
+                if response is not None:
+                    record_pexels_status(response.status_code)
+                    self._update_quota(response)
+                elif error is not None:
+                    record_pexels_status("error")
+                if response is not None and response.status_code not in RETRYABLE_STATUSES:
+                    self._on_success(latency)
+                elif response is not None or error is not None:
+                    # Снижаем параллельность только на отказ Pexels или сети, а не на отмену вызывающего
+                    self._decrease()
+                self._release()
+
+            if error is None and response.status_code not in RETRYABLE_STATUSES:
+                return response
+            throttled = response is not None and response.status_code == 429
+            if throttled:
+                self.throttled_responses += 1
+            if attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+                return response
+
+            attempt += 1
+            self.retries += 1
+            delay = self._backoff(attempt, response)
+            if throttled:
+                # 429 тормозит все запросы, а не только текущий: ожидание пройдет в _reserve_budget
+                self.throttled_until = max(self.throttled_until, time.time() + delay)
+            else:
+                await asyncio.sleep(delay)
+
+    def metrics(self) -> dict:
+        now = time.time()
+        return {
+            "queue_depth": sum(len(queue) for queue in self._waiters.values()),
+            "waiting_flows": len(self._waiters),
+            "in_flight": self.in_flight,
+            "concurrency_limit": int(self.limit),
+            "throttled": now < self.throttled_until,
+            "hourly_used": len(self._hour_window),
+            "quota_remaining": self.quota_remaining,
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled_responses": self.throttled_responses,
+            "quota_rejections": self.quota_rejections,
+        }
@@ -0,0 +1,80 @@
+import io
+from dataclasses import dataclass
+
+from PIL import Image, ImageFilter, ImageOps, ImageStat
+
+from config import (
+    PHOTO_CHECK_MIN_SIDE, PHOTO_CHECK_MIN_CONTRAST, PHOTO_CHECK_MIN_SHARPNESS, PHOTO_CHECK_MIN_TEXT_DENSITY,
+)
+
+# Проверка идет по уменьшенной копии: JPEG декодируется сразу в уменьшенном виде, поэтому занимает миллисекунды
+CHECK_SIDE = 512
+# Текст ищется по ячейкам сетки: ячейка похожа на строку текста, если доля контурных пикселей в ней
+# не слишком мала (фон, кожа, небо) и не слишком велика (листва, шум, узор)
+TEXT_CELL = 16
+TEXT_CELL_MIN_EDGES = 0.08
+TEXT_CELL_MAX_EDGES = 0.6
+EDGE_THRESHOLD = 40
+LAPLACIAN = ImageFilter.Kernel((3, 3), (0, 1, 0, 1, -4, 1, 0, 1, 0), scale=1, offset=128)
+
+# Что ответить пользователю, если фото отклонено: причина -> просьба переснять
+REJECTION_MESSAGES = {
+    "size": 'Фото слишком маленькое, текст меню на нем не прочитать. Пожалуйста, отправьте фото крупнее.',
+    "contrast": 'Фото слишком темное или блеклое. Пожалуйста, переснимите меню при хорошем освещении.',
+    "blur": 'Фото получилось размытым. Пожалуйста, переснимите меню, держа телефон неподвижно.',
+    "text": 'На фото не видно текста меню. Пожалуйста, отправьте фото страницы меню целиком.',
+}
+
+
+@dataclass
+class PhotoCheck:
+    width: int
+    height: int
+    # Стандартное отклонение яркости (0-255)
+    contrast: float
+    # Дисперсия лапласиана: у резкого текста большая, у размытого снимка близка к нулю
+    sharpness: float
+    # Доля ячеек сетки, похожих на строки текста
+    text_density: float
+    # Причина отказа из REJECTION_MESSAGES или None, если фото можно отправлять в модель
+    rejection: str | None
+
+
+def check_photo(image_bytes: bytes, original_size: tuple[int, int] | None = None) -> PhotoCheck:
+    """
+    Быстрая локальная проверка фото перед платным запросом к модели: размер, контраст,
+    резкость и доля областей, похожих на текст. Не отличает меню от другого текста
+    (скриншоты переписки проходят проверку) — она отсекает снимки, на которых текста не прочитать.
+    `original_size` — размер самого большого варианта фото в Telegram: проверяемая копия может быть
+    уменьшена, а размер снимка оценивается по оригиналу.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as original:
+        width, height = original_size or original.size
+        original.draft("L", (CHECK_SIDE, CHECK_SIDE))
+        gray = ImageOps.exif_transpose(original).convert("L")
+    gray.thumbnail((CHECK_SIDE, CHECK_SIDE))
+
+    contrast = ImageStat.Stat(gray).stddev[0]
+    # Фильтры дают ложные перепады на границе изображения, поэтому край отрезается
+    sharpness = ImageStat.Stat(ImageOps.crop(gray.filter(LAPLACIAN), 2)).var[0]
+
+    edges = gray.filter(ImageFilter.FIND_EDGES).point(lambda v: 255 if v > EDGE_THRESHOLD else 0)
+    edges = ImageOps.crop(edges, 2)
+    # Уменьшение с усреднением дает долю контурных пикселей в каждой ячейке
+    cells = edges.resize((max(1, edges.width // TEXT_CELL), max(1, edges.height // TEXT_CELL)), Image.Resampling.BOX)
+    histogram = cells.histogram()
+    text_cells = sum(histogram[int(TEXT_CELL_MIN_EDGES * 255):int(TEXT_CELL_MAX_EDGES * 255) + 1])
+    text_density = text_cells / (cells.width * cells.height)
+
+    # Размер оценивается по длинной стороне: широкое, но читаемое меню (1280x380) не отклоняется
+    if max(width, height) < PHOTO_CHECK_MIN_SIDE:
+        rejection = "size"
+    elif contrast < PHOTO_CHECK_MIN_CONTRAST:
+        rejection = "contrast"
+    elif sharpness < PHOTO_CHECK_MIN_SHARPNESS:
+        rejection = "blur"
+    elif text_density < PHOTO_CHECK_MIN_TEXT_DENSITY:
+        rejection = "text"
+    else:
+        rejection = None
+    return PhotoCheck(width, height, contrast, sharpness, text_density, rejection)
@@ -0,0 +1,295 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from config import STREAMING_MODE, TILING_MODE, COMPACT_SCHEMA, TWO_PHASE_MODE, ALBUM_SINGLE_REQUEST, PHOTO_CHECK
+from dish import COMPACT_MENU_KEY, COMPACT_PARTIAL_KEY, compact_dish_to_dict, menu_from_response
+from ocr import process_menu_image, process_menu_pages, stream_menu_image
+from html_generator import render_html_menu
+from image_fetcher import fetch_images_for_menu, MenuImageFetcher
+from json_stream import MenuStreamParser, parse_menu_json
+from tiling import should_tile, process_menu_tiled, merge_menus
+from two_phase import process_menu_two_phase
+from menu_cache import ImageKey
+from metrics import PHOTO_CHECKS, span
+from photo_check import REJECTION_MESSAGES, check_photo
+from runtime import get_runtime
+
+if TYPE_CHECKING:
+    # Типы aiogram нужны только для подсказок, а их импорт занимает секунды
+    from aiogram.types import PhotoSize
+from image_preprocessor import PreparedImage, choose_photo_size, preprocess_image
+
+# Telegram ограничивает частоту редактирования сообщений, поэтому прогресс обновляем не чаще раза в секунду
+PROGRESS_EDIT_INTERVAL = 1.0
+
+Progress = Callable[[str], Awaitable[None]]
+# Скачивание файла из Telegram в буфер (обычно bot.download)
+Download = Callable[["PhotoSize"], Awaitable[Any]]
+
+
+class MenuError(Exception):
+    """Ошибка обработки меню, текст которой можно показать пользователю."""
+
+
+class PhotoRejected(MenuError):
+    """Фото отклонено локальной проверкой, запрос к модели не выполнялся."""
+
+
+@dataclass
+class MenuResult:
+    html: str
+    is_partial: bool
+    dish_count: int
+
+
+async def _stream_menu(image: PreparedImage, progress: Progress) -> tuple[MenuStreamParser, MenuImageFetcher]:
+    """
+    Читает потоковый ответ модели, сразу отправляет готовые блюда на поиск картинок
+    и сообщает о прогрессе количеством найденных блюд.
+    """
+    if COMPACT_SCHEMA:
+        parser = MenuStreamParser(COMPACT_MENU_KEY, COMPACT_PARTIAL_KEY, convert=compact_dish_to_dict)
+    else:
+        parser = MenuStreamParser()
+    fetcher = MenuImageFetcher()
+    await progress('Шаг 1/2: Распознаю меню и подбираю изображения...')
+
+    shown_count = 0
+    last_edit = time.monotonic()
+    try:
+        async for chunk in stream_menu_image(image.data, image.mime_type):
+            for dish in parser.feed(chunk):
+                fetcher.add(dish)
+
+            count = len(parser.dishes)
+            if count != shown_count and time.monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL:
+                await progress(f'Шаг 1/2: Распознаю меню и подбираю изображения... Найдено блюд: {count}')
+                shown_count = count
+                last_edit = time.monotonic()
+    except BaseException:
+        fetcher.cancel()
+        raise
+    return parser, fetcher
+
+
+@dataclass
+class _Page:
+    """Скачанное фото одной страницы меню и результат поиска в кэше."""
+    photo: "PhotoSize"
+    image_bytes: bytes
+    image_key: ImageKey
+    tiled: bool
+    cached_text: str | None
+    # Причина отказа локальной проверки (photo_check.REJECTION_MESSAGES) или None
+    rejection: str | None = None
+
+
+async def _load_page(photos: list["PhotoSize"], download: Download) -> _Page:
+    # Большие фото распознаем по частям в полном разрешении, остальные — в самом легком читаемом варианте
+    largest = photos[-1]
+    tiled = TILING_MODE and should_tile(largest.width, largest.height)
+    photo = largest if tiled else choose_photo_size(photos)
+
+    # Весь конвейер работает в памяти: фото скачивается в буфер, HTML отдается строкой
+    with span("download"):
+        image_buffer = await download(photo)
+    image_bytes = image_buffer.getvalue()
+
+    # Проверяем кэш: то же фото (или, если включено, почти такой же снимок) уже обрабатывалось
+    with span("cache"):
+        menu_cache = get_runtime().menu_cache
+        image_key = await asyncio.to_thread(menu_cache.image_key, image_bytes)
+        cached_text = await menu_cache.get(photo.file_unique_id, image_key)
+
+    # Снимки без читаемого текста отклоняются за миллисекунды, не занимая модель
+    rejection = None
+    if cached_text is None and PHOTO_CHECK:
+        with span("check"):
+            check = await asyncio.to_thread(check_photo, image_bytes, (largest.width, largest.height))
+        PHOTO_CHECKS.inc(result=check.rejection or "ok")
+        rejection = check.rejection
+        if rejection:
+            print(f"Фото отклонено проверкой ({rejection}): {check}")
+    return _Page(photo, image_bytes, image_key, tiled, cached_text, rejection)
+
+
+async def _recognize(page: _Page, progress: Progress) -> str:
+    """Распознает страницу, которой нет в кэше. Возвращает ответ модели или пустую строку."""
+    if page.tiled:
+        await progress('Шаг 1/3: Меню большое, распознаю его по частям...')
+        with span("model"):
+            return json.dumps(await process_menu_tiled(page.image_bytes), ensure_ascii=False)
+
+    if TWO_PHASE_MODE:
+        await progress('Шаг 1/3: Распознаю названия и цены...')
+    else:
+        await progress('Шаг 1/3: Распознаю текст с изображения...')
+    # Поворот, обрезка фона и пережатие под бюджет уменьшают объем загрузки и входные токены
+    with span("preprocess"):
+        prepared = await asyncio.to_thread(preprocess_image, page.image_bytes)
+
+    if TWO_PHASE_MODE:
+        # С фото читаются только названия и цены, переводы известных блюд берутся из памяти
+        with span("model"):
+            two_phase = await process_menu_two_phase(prepared.data, prepared.mime_type)
+        return json.dumps(two_phase, ensure_ascii=False) if two_phase else ""
+
+    with span("model"):
+        return await process_menu_image(prepared.data, prepared.mime_type)
+
+
+def _parse(extracted_text: str) -> tuple[list[dict], bool]:
+    try:
+        with span("parse"):
+            menu_data, is_partial = menu_from_response(parse_menu_json(extracted_text))
+    except json.JSONDecodeError:
+        print("Failed to parse JSON from:", extracted_text)
+        raise MenuError('Не удалось обработать данные из меню. Пожалуйста, попробуйте еще раз.')
+
+    if not menu_data:
+        raise MenuError('Не удалось извлечь ни одного блюда из меню.')
+    return menu_data, is_partial
+
+
+async def _finish(menu_data: list[dict], is_partial: bool) -> MenuResult:
+    with span("render"):
+        html = await asyncio.to_thread(render_html_menu, menu_data)
+    return MenuResult(html=html, is_partial=is_partial, dish_count=len(menu_data))
+
+
+async def build_menu(photos: list["PhotoSize"], progress: Progress, download: Download) -> MenuResult:
+    """
+    Полный конвейер обработки одного фото меню: скачивание, распознавание, подбор картинок и HTML.
+    Не зависит от конкретного сообщения, поэтому результат можно отдать нескольким пользователям.
+    """
+    page = await _load_page(photos, download)
+    if page.rejection:
+        raise PhotoRejected(REJECTION_MESSAGES[page.rejection])
+    menu_cache = get_runtime().menu_cache
+
+    if STREAMING_MODE and not TWO_PHASE_MODE and page.cached_text is None and not page.tiled:
+        with span("preprocess"):
+            prepared = await asyncio.to_thread(preprocess_image, page.image_bytes)
+        # Блюда приходят по одному, картинки для них ищутся параллельно с генерацией
+        with span("model"):
+            parser, fetcher = await _stream_menu(prepared, progress)
+        data = parser.result()
+        menu_data = data["menu"]
+        is_partial = data["isPartial"]
+
+        if not menu_data:
+            print("No dishes parsed from stream:", parser.text)
+            fetcher.cancel()
+            raise MenuError('Не удалось извлечь ни одного блюда из меню.')
+
+        if parser.complete:
+            await menu_cache.set(page.photo.file_unique_id, page.image_key, parser.text)
+
+        await progress(f'Шаг 2/2: Заканчиваю подбор изображений ({len(menu_data)} блюд)...')
+        # Большая часть поиска уже прошла во время генерации, здесь — только хвост
+        with span("images"):
+            await fetcher.finish()
+        return await _finish(menu_data, is_partial)
+
+    # Шаг 1: Распознавание текста
+    extracted_text = page.cached_text
+    if extracted_text is None:
+        extracted_text = await _recognize(page, progress)
+    if not extracted_text:
+        raise MenuError('Не удалось распознать текст. Пожалуйста, отправьте более четкое фото.')
+
+    # Шаг 2: Извлечение JSON
+    await progress('Шаг 2/3: Анализирую меню...')
+    menu_data, is_partial = _parse(extracted_text)
+    if page.cached_text is None:
+        await menu_cache.set(page.photo.file_unique_id, page.image_key, extracted_text)
+
+    # Шаг 3: Подбор изображений
+    await progress('Шаг 3/3: Подбираю изображения для блюд...')
+    with span("images"):
+        await fetch_images_for_menu(menu_data)
+
+    # Генерация HTML
+    return await _finish(menu_data, is_partial)
+
+
+async def _no_progress(text: str):
+    pass
+
+
+async def build_album_menu(pages: list[list["PhotoSize"]], progress: Progress, download: Download) -> MenuResult:
+    """
+    Конвейер для альбома из нескольких страниц меню: страницы скачиваются и распознаются
+    параллельно (или одним запросом с несколькими изображениями при ALBUM_SINGLE_REQUEST),
+    блюда со всех страниц объединяются без дублей, картинки подбираются и HTML строится один раз.
+    Страница, которую не удалось распознать или которую отклонила проверка фото,
+    пропускается, а меню помечается как неполное.
+    """
+    await progress(f'Шаг 1/3: Распознаю страницы меню ({len(pages)})...')
+    loaded = await asyncio.gather(*(_load_page(photos, download) for photos in pages))
+    rejected = [page for page in loaded if page.rejection]
+    loaded = [page for page in loaded if not page.rejection]
+    if not loaded:
+        raise PhotoRejected(REJECTION_MESSAGES[rejected[0].rejection])
+    menu_cache = get_runtime().menu_cache
+
+    # Тексты для разбора по номеру страницы в альбоме, со страницей, под которой их сохранить в кэш
+    # (None — сохранять не нужно). Блюда объединяются в порядке страниц, а не по готовности
+    results = {index: (None, page.cached_text) for index, page in enumerate(loaded) if page.cached_text is not None}
+    pending = [(index, page) for index, page in enumerate(loaded) if page.cached_text is None]
+    # Ответ на несколько страниц сразу не делится по страницам, поэтому в кэш страниц не попадает
+    single_request = ALBUM_SINGLE_REQUEST and len(pending) > 1 and not TWO_PHASE_MODE \
+        and not any(page.tiled for _, page in pending)
+    if single_request:
+        # Инструкция отправляется один раз вместо копии на каждую страницу
+        with span("preprocess"):
+            prepared = await asyncio.gather(*(asyncio.to_thread(preprocess_image, page.image_bytes)
+                                              for _, page in pending))
+        with span("model"):
+            text = await process_menu_pages([(image.data, image.mime_type) for image in prepared])
+        # Общий ответ встает на место первой из распознанных им страниц
+        results[pending[0][0]] = (None, text)
+        pending = []
+
+    done = 0
+    last_edit = time.monotonic()
+
+    async def recognize(page: _Page) -> str:
+        nonlocal done, last_edit
+        text = await _recognize(page, _no_progress)
+        done += 1
+        if time.monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL:
+            last_edit = time.monotonic()
+            await progress(f'Шаг 1/3: Распознаю страницы меню... Готово {done} из {len(pending)}')
+        return text
+
+    texts = await asyncio.gather(*(recognize(page) for _, page in pending))
+    for (index, page), text in zip(pending, texts):
+        results[index] = (page, text)
+
+    menus, is_partial = [], bool(rejected)
+    for _, (page, text) in sorted(results.items()):
+        try:
+            menu_data, partial = _parse(text) if text else ([], True)
+        except MenuError:
+            menu_data, partial = [], True
+        if not menu_data:
+            is_partial = True
+            continue
+        is_partial |= partial
+        menus.append(menu_data)
+        if page is not None:
+            await menu_cache.set(page.photo.file_unique_id, page.image_key, text)
+
+    if not menus:
+        raise MenuError('Не удалось распознать ни одной страницы. Пожалуйста, отправьте более четкие фото.')
+
+    # Блюда, попавшие на несколько страниц (разворот, повторный снимок), остаются в одном экземпляре
+    menu_data = merge_menus(menus)
+    await progress(f'Шаг 3/3: Подбираю изображения для блюд ({len(menu_data)})...')
+    with span("images"):
+        await fetch_images_for_menu(menu_data)
+    return await _finish(menu_data, is_partial)
@@ -1,55 +1,145 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import asyncio
+from config import IMAGE_PROMPT_BATCH_SIZE
+from json_stream import parse_menu_json
+from model_client import ModelRequest
+from runtime import get_runtime
+from translation_memory import normalize_name
 
-# Загружаем переменные окружения из .env файла
-load_dotenv()
+SYSTEM_INSTRUCTION = (
+    "Ты — эксперт по созданию промптов для моделей генерации изображений (таких как Midjourney или Stable Diffusion). "
+    "Твоя задача — на основе краткого описания блюда создать детализированный, креативный и эффективный промпт на английском языке. "
+    "Промпт должен включать ключевые слова, описывающие внешний вид, стиль, освещение и композицию, чтобы получить фотореалистичное и очень аппетитное изображение ресторанного качества."
+)
 
-# Убедитесь, что GEMINI_API_KEY установлен
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY not found. Please set the environment variable.")
+# Ответ пакетного запроса: номер описания из списка и промпт для него
+BATCH_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "prompts": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "i": {"type": "INTEGER"},
+                    "p": {"type": "STRING"},
+                },
+                "required": ["i", "p"],
+            },
+        },
+    },
+    "required": ["prompts"],
+}
 
-genai.configure(api_key=api_key)
+# Около 100 токенов на промпт с запасом на разметку ответа
+BATCH_MAX_OUTPUT_TOKENS = 160 * IMAGE_PROMPT_BATCH_SIZE
 
-# Используем модель, которая точно доступна и хорошо работает с текстом
-MODEL = "gemini-1.5-pro"
 
-def generate_image_prompt(description: str) -> str | None:
+def dish_description(dish: dict) -> str:
+    """Описание блюда для промпта: название (перевод, если есть) и краткое описание."""
+    name = dish.get("translatedName") or dish.get("originalName") or ""
+    description = dish.get("shortDescription") or ""
+    return f"{name}. {description}".strip(" .") if description else name
+
+
+def prompt_cache_key(description: str) -> str:
+    return normalize_name(description)
+
+
+async def _generate_batch(descriptions: list[str]) -> dict[str, str]:
+    """Один запрос на пачку описаний. Описания, для которых модель не вернула промпт, пропускаются."""
+    numbered = "\n".join(f"{i}. {description}" for i, description in enumerate(descriptions))
+    request = ModelRequest(
+        [
+            f"{SYSTEM_INSTRUCTION}\n\n"
+            "Создай отдельный промпт для каждого описания из списка. "
+            'Верни JSON-объект {"prompts": [{"i": номер описания, "p": "промпт"}, ...]}.\n\n'
+            f"Описания блюд:\n{numbered}"
+        ],
+        BATCH_MAX_OUTPUT_TOKENS,
+        BATCH_RESPONSE_SCHEMA,
+    )
+    try:
+        response = await get_runtime().prompt_client.generate(request)
+        data = parse_menu_json(response.text)
+    except Exception as e:
+        print(f"Произошла ошибка при пакетной генерации промптов: {e}")
+        return {}
+
+    prompts = {}
+    for item in data.get("prompts") or []:
+        if not isinstance(item, dict):
+            continue
+        index, prompt = item.get("i"), str(item.get("p") or "").strip().replace('"', '')
+        if isinstance(index, int) and 0 <= index < len(descriptions) and prompt:
+            prompts[descriptions[index]] = prompt
+    return prompts
+
+
+async def generate_image_prompts(descriptions: list[str]) -> dict[str, str]:
+    """
+    Генерирует промпты для списка описаний блюд: описание -> промпт.
+    Известные промпты берутся из кэша по нормализованному описанию, остальные
+    генерируются пачками по IMAGE_PROMPT_BATCH_SIZE параллельно и сохраняются в кэш.
+    """
+    cache = get_runtime().image_prompt_cache
+    by_key = {}
+    for description in descriptions:
+        if description.strip():
+            by_key.setdefault(prompt_cache_key(description), description)
+
+    def lookup() -> dict[str, str]:
+        found = {}
+        for key in by_key:
+            prompt = cache.get(key)
+            if prompt is not None:
+                found[key] = prompt
+        return found
+
+    known = await asyncio.to_thread(lookup)
+    known.update(await cache.shared_get_many([key for key in by_key if key not in known]))
+    missing = [description for key, description in by_key.items() if key not in known]
+    print(f"Промпты картинок: {len(known)} из кэша, {len(missing)} к генерации")
+
+    batches = [missing[i:i + IMAGE_PROMPT_BATCH_SIZE] for i in range(0, len(missing), IMAGE_PROMPT_BATCH_SIZE)]
+    generated = {}
+    for prompts in await asyncio.gather(*(_generate_batch(batch) for batch in batches)):
+        generated.update({prompt_cache_key(description): prompt for description, prompt in prompts.items()})
+
+    def store():
+        for key, prompt in generated.items():
+            cache.set(key, prompt)
+
+    if generated:
+        known.update(generated)
+        await asyncio.to_thread(store)
+        await asyncio.gather(*(cache.shared_set(key, prompt) for key, prompt in generated.items()))
+
+    return {description: known[prompt_cache_key(description)]
+            for description in descriptions if prompt_cache_key(description) in known}
+
+
+async def generate_menu_image_prompts(menu_data: list[dict]) -> dict[str, str]:
+    """
+    Промпты для картинок всех блюд меню одним пакетом: оригинальное название блюда -> промпт.
+    Блюда, для которых промпт получить не удалось, в ответ не попадают.
+    """
+    descriptions = {dish["originalName"]: dish_description(dish) for dish in menu_data if dish.get("originalName")}
+    prompts = await generate_image_prompts(list(descriptions.values()))
+    return {name: prompts[description] for name, description in descriptions.items() if description in prompts}
+
+
+async def generate_image_prompt(description: str) -> str | None:
     """
     Генерирует детализированный промпт для модели генерации изображений.
     """
     print(f"Создание промпта для: '{description}'...")
-    
-    try:
-        model = genai.GenerativeModel(MODEL)
-        
-        system_instruction = (
-            "Ты — эксперт по созданию промптов для моделей генерации изображений (таких как Midjourney или Stable Diffusion). "
-            "Твоя задача — на основе краткого описания блюда создать детализированный, креативный и эффективный промпт на английском языке. "
-            "Промпт должен включать ключевые слова, описывающие внешний вид, стиль, освещение и композицию, чтобы получить фотореалистичное и очень аппетитное изображение ресторанного качества. "
-            "Не добавляй ничего, кроме самого промпта."
-        )
-        
-        prompt_request = f"Краткое описание блюда: '{description}'"
-
-        response = model.generate_content(
-            f"{system_instruction}\n\n{prompt_request}"
-        )
-        
-        if response.text:
-            # Убираем лишние кавычки и форматирование
-            clean_prompt = response.text.strip().replace('"', '')
-            print(f"Сгенерирован промпт: {clean_prompt}")
-            return clean_prompt
-        else:
-            print("Не удалось сгенерировать промпт. Ответ модели пуст.")
-            return None
-
-    except Exception as e:
-        print(f"Произошла ошибка при генерации промпта: {e}")
-        return None
+    prompt = (await generate_image_prompts([description])).get(description)
+    if prompt:
+        print(f"Сгенерирован промпт: {prompt}")
+    else:
+        print("Не удалось сгенерировать промпт.")
+    return prompt
 
 if __name__ == '__main__':
     test_description = "Паста Карбонара с хрустящим беконом и сливочным соусом"
-    generate_image_prompt(test_description)
+    asyncio.run(generate_image_prompt(test_description))
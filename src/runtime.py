@@ -0,0 +1,106 @@
+from functools import cached_property
+
+from config import (
+    PEXELS_API_KEY, PROMPT_GEMINI_MODEL,
+    IMAGE_CACHE_TTL, IMAGE_CACHE_MAX_ENTRIES, IMAGE_PROMPT_CACHE_TTL, IMAGE_PROMPT_CACHE_MAX_ENTRIES,
+)
+
+
+class Runtime:
+    """
+    Общие ресурсы процесса: клиенты моделей, HTTP-пул Pexels, кэши и хранилище общего состояния.
+    Каждый ресурс создается при первом обращении, поэтому импорт модулей не требует
+    ключей API и не тянет за собой тяжелые SDK. Освобождаются ресурсы в close().
+    """
+
+    @cached_property
+    def state(self):
+        from state import create_state_backend
+        return create_state_backend()
+
+    @property
+    def shared_state(self):
+        """Общее хранилище, если его видят другие процессы и реплики, иначе None."""
+        return self.state if self.state.shared else None
+
+    @cached_property
+    def model_client(self):
+        from model_client import create_model_client
+        return create_model_client()
+
+    @cached_property
+    def prompt_client(self):
+        from model_client import create_model_client
+        return create_model_client(PROMPT_GEMINI_MODEL)
+
+    @cached_property
+    def pexels_client(self):
+        import httpx
+        if not PEXELS_API_KEY:
+            raise ValueError("PEXELS_API_KEY не найден в .env файле. Пожалуйста, получите бесплатный ключ на https://www.pexels.com/api/ и добавьте его.")
+        return httpx.AsyncClient(timeout=15.0, headers={"Authorization": PEXELS_API_KEY})
+
+    @cached_property
+    def image_cache(self):
+        from cache import PersistentCache
+        return PersistentCache("pexels_images", IMAGE_CACHE_TTL, IMAGE_CACHE_MAX_ENTRIES, shared=self.shared_state)
+
+    @cached_property
+    def image_prompt_cache(self):
+        from cache import PersistentCache
+        return PersistentCache("image_prompts", IMAGE_PROMPT_CACHE_TTL, IMAGE_PROMPT_CACHE_MAX_ENTRIES,
+                               shared=self.shared_state)
+
+    @cached_property
+    def menu_cache(self):
+        from menu_cache import MenuCache
+        return MenuCache(shared=self.shared_state)
+
+    @cached_property
+    def translation_memory(self):
+        from translation_memory import TranslationMemory
+        return TranslationMemory(shared=self.shared_state)
+
+    def provide(self, name: str, value):
+        """Подставляет готовый ресурс вместо создаваемого по умолчанию (заглушки сервисов в бенчмарках)."""
+        self.__dict__[name] = value
+
+    def created(self, name: str):
+        """Возвращает ресурс, только если он уже был создан."""
+        return self.__dict__.get(name)
+
+    async def close(self):
+        for name in ("model_client", "prompt_client"):
+            client = self.created(name)
+            if client is not None:
+                await client.close()
+
+        pexels_client = self.created("pexels_client")
+        if pexels_client is not None:
+            await pexels_client.aclose()
+
+        for name in ("image_cache", "image_prompt_cache", "menu_cache", "translation_memory"):
+            cache = self.created(name)
+            if cache is not None:
+                cache.close()
+
+        state = self.created("state")
+        if state is not None:
+            await state.close()
+
+
+_runtime: Runtime | None = None
+
+
+def get_runtime() -> Runtime:
+    global _runtime
+    if _runtime is None:
+        _runtime = Runtime()
+    return _runtime
+
+
+async def close_runtime():
+    global _runtime
+    if _runtime is not None:
+        await _runtime.close()
+        _runtime = None
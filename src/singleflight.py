@@ -0,0 +1,87 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from config import SHARED_FLIGHT_LEASE, SHARED_FLIGHT_RESULT_TTL
+from runtime import get_runtime
+
+# Как часто ожидающая реплика проверяет, готов ли результат у реплики-владельца
+SHARED_POLL_INTERVAL = 0.5
+
+
+class SingleFlight:
+    """
+    Схлопывает одновременные одинаковые вычисления: пока задача с ключом `key` выполняется,
+    остальные вызовы с тем же ключом ждут ее результата вместо повторного запуска.
+    Вычисление идет в отдельной задаче, поэтому отмена одного из ожидающих не отменяет его для остальных.
+
+    С `distributed=True` и общим хранилищем состояния (STATE_BACKEND=redis) вычисление схлопывается
+    и между процессами: одна реплика берет ключ в аренду и публикует результат, остальные ждут его.
+    `encode`/`decode` переводят результат в JSON-совместимое значение и обратно.
+    """
+
+    def __init__(self, name: str, distributed: bool = False,
+                 encode: Callable[[Any], Any] | None = None, decode: Callable[[Any], Any] | None = None,
+                 lease: float = SHARED_FLIGHT_LEASE, result_ttl: float = SHARED_FLIGHT_RESULT_TTL):
+        self.name = name
+        self.distributed = distributed
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+        self.lease = lease
+        self.result_ttl = result_ttl
+        self._calls: dict[str, asyncio.Task] = {}
+        self.executed = 0
+        self.shared = 0
+        self.remote = 0
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(self._run(key, fn))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        state = get_runtime().shared_state if self.distributed else None
+        if state is None:
+            return await fn()
+
+        lock_key = f"flight:{self.name}:{key}:lock"
+        result_key = f"flight:{self.name}:{key}:result"
+        while True:
+            published = await state.get(result_key)
+            if published is not None:
+                self.remote += 1
+                return self.decode(published["value"])
+            if await state.set_if_absent(lock_key, 1, self.lease):
+                break
+            # Ключ обрабатывает другая реплика; если она упадет, аренда истечет и ключ заберет следующая
+            await asyncio.sleep(SHARED_POLL_INTERVAL)
+
+        try:
+            value = await fn()
+            await state.set(result_key, {"value": self.encode(value)}, self.result_ttl)
+            return value
+        finally:
+            await state.delete(lock_key)
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Помечаем исключение как полученное, даже если все ожидающие уже отменены
+        if not task.cancelled():
+            task.exception()
+
+    def metrics(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "shared": self.shared,
+            "remote": self.remote,
+        }
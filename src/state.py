@@ -0,0 +1,146 @@
+import json
+import math
+import time
+from typing import Any
+
+from config import STATE_BACKEND, REDIS_URL
+
+
+class StateBackend:
+    """
+    Хранилище общего состояния между воркерами и репликами бота: значения с TTL,
+    атомарная установка (аренда ключа) и счетчики.
+    `shared` — видят ли состояние другие процессы. Компоненты используют хранилище
+    только при shared=True, иначе обходятся своими структурами в памяти процесса.
+    Значения должны сериализоваться в JSON.
+    """
+    shared = False
+
+    async def get(self, key: str) -> Any | None:
+        raise NotImplementedError
+
+    async def get_many(self, keys: list[str]) -> list[Any | None]:
+        return [await self.get(key) for key in keys]
+
+    async def set(self, key: str, value: Any, ttl: float | None = None):
+        raise NotImplementedError
+
+    async def set_if_absent(self, key: str, value: Any, ttl: float) -> bool:
+        """Устанавливает значение, только если ключа нет. Возвращает True, если установка удалась."""
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def incr(self, key: str, ttl: float) -> int:
+        """Увеличивает счетчик на 1 и возвращает новое значение. TTL задается при создании счетчика."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """Состояние в памяти процесса — вариант по умолчанию для одного процесса."""
+
+    def __init__(self):
+        self._data: dict[str, tuple[Any, float | None]] = {}
+
+    def _alive(self, key: str) -> bool:
+        item = self._data.get(key)
+        if item is None:
+            return False
+        if item[1] is not None and item[1] <= time.monotonic():
+            del self._data[key]
+            return False
+        return True
+
+    @staticmethod
+    def _expires(ttl: float | None) -> float | None:
+        return time.monotonic() + ttl if ttl is not None else None
+
+    async def get(self, key: str) -> Any | None:
+        return self._data[key][0] if self._alive(key) else None
+
+    async def set(self, key: str, value: Any, ttl: float | None = None):
+        self._data[key] = (value, self._expires(ttl))
+
+    async def set_if_absent(self, key: str, value: Any, ttl: float) -> bool:
+        if self._alive(key):
+            return False
+        self._data[key] = (value, self._expires(ttl))
+        return True
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+    async def incr(self, key: str, ttl: float) -> int:
+        if not self._alive(key):
+            self._data[key] = (0, self._expires(ttl))
+        value, expires = self._data[key]
+        self._data[key] = (value + 1, expires)
+        return value + 1
+
+
+class RedisBackend(StateBackend):
+    """
+    Общее состояние в Redis: его видят все воркеры и реплики, подключенные к одному серверу.
+    Пакет redis — необязательная зависимость (pip install "dishlingo[redis]").
+    """
+    shared = True
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = "dishlingo:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError('Для STATE_BACKEND=redis установите пакет redis: pip install "dishlingo[redis]"') from e
+        self.prefix = prefix
+        self.client = redis.from_url(url)
+
+    @staticmethod
+    def _ms(ttl: float | None) -> int | None:
+        return max(1, math.ceil(ttl * 1000)) if ttl is not None else None
+
+    @staticmethod
+    def _decode(raw) -> Any | None:
+        return json.loads(raw) if raw is not None else None
+
+    async def get(self, key: str) -> Any | None:
+        return self._decode(await self.client.get(self.prefix + key))
+
+    async def get_many(self, keys: list[str]) -> list[Any | None]:
+        if not keys:
+            return []
+        return [self._decode(raw) for raw in await self.client.mget([self.prefix + key for key in keys])]
+
+    async def set(self, key: str, value: Any, ttl: float | None = None):
+        await self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), px=self._ms(ttl))
+
+    async def set_if_absent(self, key: str, value: Any, ttl: float) -> bool:
+        return bool(await self.client.set(self.prefix + key, json.dumps(value), px=self._ms(ttl), nx=True))
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+    async def incr(self, key: str, ttl: float) -> int:
+        value = await self.client.incr(self.prefix + key)
+        if value == 1:
+            await self.client.pexpire(self.prefix + key, self._ms(ttl))
+        return value
+
+    async def close(self):
+        await self.client.aclose()
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "redis": RedisBackend,
+}
+
+
+def create_state_backend(kind: str = STATE_BACKEND) -> StateBackend:
+    try:
+        backend = BACKENDS[kind]
+    except KeyError:
+        raise ValueError(f"Неизвестный STATE_BACKEND '{kind}', доступны: {', '.join(BACKENDS)}")
+    return backend()
@@ -0,0 +1,177 @@
+import asyncio
+import io
+import json
+import re
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps
+
+from config import TILING_MIN_SIDE, TILING_MAX_TILE_SIDE, TILING_OVERLAP
+from dish import menu_from_response
+from json_stream import parse_menu_json
+from ocr import process_menu_image
+
+# Параметры поиска колонок по вертикальной проекции «чернил»
+PROFILE_WIDTH = 300
+INK_THRESHOLD = 110
+GAP_INK_RATIO = 0.01
+MIN_GAP_RATIO = 0.03
+MIN_COLUMN_RATIO = 0.2
+
+
+@dataclass
+class Region:
+    """Прямоугольная область исходного изображения (left, top, right, bottom)."""
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+    @property
+    def height(self) -> int:
+        return self.bottom - self.top
+
+
+def should_tile(width: int, height: int, min_side: int = TILING_MIN_SIDE) -> bool:
+    """Решает, достаточно ли велико фото, чтобы обрабатывать его по частям."""
+    return max(width, height) >= min_side
+
+
+def detect_columns(image: Image.Image) -> list[tuple[int, int]]:
+    """
+    Находит колонки текста по вертикальной проекции темных пикселей:
+    широкие почти пустые вертикальные полосы считаются промежутками между колонками.
+    Возвращает границы колонок по оси X в координатах исходного изображения.
+    """
+    scale = image.width / PROFILE_WIDTH
+    small = ImageOps.autocontrast(image.convert("L").resize((PROFILE_WIDTH, max(1, int(image.height / scale)))))
+    width, height = small.size
+    pixels = small.load()
+
+    ink = [sum(1 for y in range(height) if pixels[x, y] < INK_THRESHOLD) / height for x in range(width)]
+    empty = [ratio <= GAP_INK_RATIO for ratio in ink]
+
+    gaps = []
+    x = 0
+    while x < width:
+        if empty[x]:
+            start = x
+            while x < width and empty[x]:
+                x += 1
+            # Поля по краям страницы промежутками между колонками не считаются
+            if start > 0 and x < width and x - start >= width * MIN_GAP_RATIO:
+                gaps.append((start + x) // 2)
+        else:
+            x += 1
+
+    bounds = [0] + gaps + [width]
+    columns = [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+    if any(right - left < width * MIN_COLUMN_RATIO for left, right in columns):
+        return [(0, image.width)]
+    return [(int(left * scale), min(image.width, int(right * scale))) for left, right in columns]
+
+
+def _split_span(start: int, end: int, max_size: int, overlap: float) -> list[tuple[int, int]]:
+    """Делит отрезок на равные части не длиннее max_size с перекрытием на стыках."""
+    length = end - start
+    count = max(1, -(-length // max_size))
+    if count == 1:
+        return [(start, end)]
+    step = length / count
+    pad = int(step * overlap / 2)
+    return [(max(start, int(start + i * step) - pad), min(end, int(start + (i + 1) * step) + pad)) for i in range(count)]
+
+
+def split_into_regions(image: Image.Image, max_side: int = TILING_MAX_TILE_SIDE,
+                       overlap: float = TILING_OVERLAP) -> list[Region]:
+    """
+    Делит изображение на области: сначала по найденным колонкам,
+    затем каждую колонку — на перекрывающиеся горизонтальные полосы высотой не больше max_side.
+    По горизонтали колонка не режется, чтобы название блюда и цена остались в одной области.
+    """
+    regions = []
+    for left, right in detect_columns(image):
+        for top, bottom in _split_span(0, image.height, max_side, overlap):
+            regions.append(Region(left, top, right, bottom))
+    return regions
+
+
+def halve_region(region: Region, overlap: float = TILING_OVERLAP) -> list[Region]:
+    """Делит область на две полосы по высоте — для повторного запроса нечитаемых мест."""
+    return [Region(region.left, top, region.right, bottom)
+            for top, bottom in _split_span(region.top, region.bottom, -(-region.height // 2), overlap)]
+
+
+def _open_image(image_bytes: bytes) -> Image.Image:
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    # Загружаем пиксели сразу: дальше изображение режется из нескольких потоков
+    image.load()
+    return image
+
+
+def _crop_bytes(image: Image.Image, region: Region) -> bytes:
+    buffer = io.BytesIO()
+    image.crop((region.left, region.top, region.right, region.bottom)).convert("RGB").save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def dish_key(dish: dict) -> str:
+    """Ключ для дедупликации блюд, попавших сразу в несколько перекрывающихся тайлов."""
+    name = re.sub(r"[^\w]+", " ", str(dish.get("originalName", "")).lower()).strip()
+    price = re.sub(r"\s+", "", str(dish.get("price", "")).lower())
+    return f"{name}|{price}"
+
+
+def merge_menus(menus: list[list[dict]]) -> list[dict]:
+    """
+    Объединяет списки блюд, сохраняя порядок первого появления.
+    Из дублей оставляет вариант с большим количеством заполненных полей.
+    """
+    merged: dict[str, dict] = {}
+    for menu in menus:
+        for dish in menu:
+            key = dish_key(dish)
+            known = merged.get(key)
+            if known is None:
+                merged[key] = dish
+            elif sum(1 for v in dish.values() if v) > sum(1 for v in known.values() if v):
+                merged[key] = dish
+    return list(merged.values())
+
+
+async def _process_region(image: Image.Image, region: Region) -> tuple[list[dict], bool]:
+    """Распознает одну область. Возвращает блюда и флаг, нужно ли перезапросить область."""
+    data = await asyncio.to_thread(_crop_bytes, image, region)
+    text = await process_menu_image(data)
+    if not text:
+        return [], True
+    try:
+        parsed = parse_menu_json(text)
+    except json.JSONDecodeError:
+        return [], True
+    return menu_from_response(parsed)
+
+
+async def process_menu_tiled(image_bytes: bytes) -> dict:
+    """
+    Обрабатывает большое фото меню по частям: области распознаются параллельно,
+    результаты объединяются с удалением дублей на стыках. Области, которые модель
+    отметила как нечитаемые (или где ответ не разобрался), перезапрашиваются один раз
+    половинками — с большим разрешением и меньшим объемом ответа на запрос.
+    """
+    image = await asyncio.to_thread(_open_image, image_bytes)
+    regions = await asyncio.to_thread(split_into_regions, image)
+    print(f"Tiled processing: {len(regions)} regions for image {image.width}x{image.height}")
+
+    results = await asyncio.gather(*(_process_region(image, region) for region in regions))
+    menus = [dishes for dishes, _ in results]
+    retry_regions = [sub for region, (_, partial) in zip(regions, results) if partial for sub in halve_region(region)]
+
+    is_partial = False
+    if retry_regions:
+        print(f"Re-requesting {len(retry_regions)} sub-regions of unreadable tiles")
+        retries = await asyncio.gather(*(_process_region(image, region) for region in retry_regions))
+        menus.extend(dishes for dishes, _ in retries)
+        is_partial = any(partial for _, partial in retries)
+
+    return {"isPartial": is_partial, "menu": merge_menus(menus)}
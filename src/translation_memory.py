@@ -0,0 +1,59 @@
+import asyncio
+import re
+
+from cache import PersistentCache
+from config import TRANSLATION_MEMORY_TTL, TRANSLATION_MEMORY_MAX_ENTRIES
+
+
+def normalize_name(name: str) -> str:
+    """Регистр, пунктуация и лишние пробелы в названии блюда не влияют на поиск в памяти переводов."""
+    return re.sub(r"[^\w]+", " ", name.lower()).strip()
+
+
+class TranslationMemory:
+    """
+    Память переводов: оригинальное название блюда + язык перевода ->
+    перевод, описание, ингредиенты и флаги аллергенов в компактном формате
+    (ключи t, s, i, g, m, как в dish.COMPACT_RESPONSE_SCHEMA).
+    Распространенные блюда повторяются от ресторана к ресторану, поэтому
+    генерировать их заново не нужно.
+    """
+
+    def __init__(self, ttl: int = TRANSLATION_MEMORY_TTL, max_entries: int = TRANSLATION_MEMORY_MAX_ENTRIES,
+                 shared=None):
+        self.entries = PersistentCache("translation_memory", ttl, max_entries, shared=shared)
+
+    @staticmethod
+    def key(name: str, language: str) -> str:
+        return f"{language}:{normalize_name(name)}"
+
+    def _lookup_many(self, names: list[str], language: str) -> dict[str, dict]:
+        found = {}
+        for name in names:
+            entry = self.entries.get(self.key(name, language))
+            if entry is not None:
+                found[name] = entry
+        return found
+
+    def _store_many(self, entries: dict[str, dict], language: str):
+        for name, entry in entries.items():
+            self.entries.set(self.key(name, language), entry)
+
+    async def get_many(self, names: list[str], language: str) -> dict[str, dict]:
+        """Возвращает известные записи по оригинальным названиям; отсутствующих названий в ответе нет."""
+        found = await asyncio.to_thread(self._lookup_many, names, language)
+        missing = {self.key(name, language): name for name in names if name not in found}
+        for key, entry in (await self.entries.shared_get_many(list(missing))).items():
+            found[missing[key]] = entry
+        return found
+
+    async def set_many(self, entries: dict[str, dict], language: str):
+        await asyncio.to_thread(self._store_many, entries, language)
+        await asyncio.gather(*(self.entries.shared_set(self.key(name, language), entry)
+                               for name, entry in entries.items()))
+
+    def close(self):
+        self.entries.close()
+
+    def stats(self) -> dict:
+        return self.entries.stats()
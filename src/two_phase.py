@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+from config import TRANSLATION_LANGUAGE, TRANSLATION_BATCH_SIZE
+from dish import COMPACT_MENU_KEY, COMPACT_PARTIAL_KEY, FLAG_VALUES, FLAGS_BY_VALUE, Dish, Flag
+from json_stream import extract_json_text, parse_menu_json
+from model_client import ModelRequest
+from ocr import MAX_OUTPUT_TOKENS, SHORT_DESCRIPTION_RULE, extract_menu_items
+from runtime import get_runtime
+from translation_memory import normalize_name
+
+# Категория и цена уже извлечены с фото, текстовый запрос генерирует только перевод и описание
+TRANSLATE_PROMPT = """
+Ниже названия блюд из меню, по одному в строке. Верни JSON-массив с объектом для каждого названия.
+
+Названия:
+---
+{names}
+---
+
+Инструкции:
+1. Переведи названия на {language}.
+2. {description_rule}
+3. Перечисли не более 4-х ключевых ингредиентов. Если их нельзя предположить по названию, используй ["неизвестно"].
+4. Для containsGluten и containsMilk используй строго одно из значений: {flags}.
+5. Верни ТОЛЬКО JSON-массив, обернутый в ```json ... ```.
+
+Формат объекта в массиве:
+{{
+    "originalName": "точное название из списка",
+    "translatedName": "перевод на {language}",
+    "shortDescription": "сгенерированное ОЧЕНЬ краткое описание (макс. 10 слов)",
+    "ingredients": ["ключевой ингредиент 1", "ингредиент 2"],
+    "containsGluten": "{flags}",
+    "containsMilk": "{flags}"
+}}
+"""
+
+
+def _memory_entry(dish: dict) -> dict:
+    """Переводит блюдо из ответа на TRANSLATE_PROMPT в запись памяти переводов."""
+    ingredients = dish.get("ingredients") or []
+    if not isinstance(ingredients, list):
+        ingredients = []
+    return {
+        "t": str(dish.get("translatedName") or "").strip(),
+        "s": str(dish.get("shortDescription") or "").strip(),
+        "i": [str(item) for item in ingredients if item and item != "неизвестно"],
+        "g": FLAGS_BY_VALUE.get(dish.get("containsGluten"), Flag.UNKNOWN).value,
+        "m": FLAGS_BY_VALUE.get(dish.get("containsMilk"), Flag.UNKNOWN).value,
+    }
+
+
+async def _translate_batch(names: list[str], language: str) -> dict[str, dict]:
+    """Один текстовый запрос на пачку новых названий. Блюда, которые модель не вернула, пропускаются."""
+    prompt = TRANSLATE_PROMPT.format(names="\n".join(names), language=language,
+                                     description_rule=SHORT_DESCRIPTION_RULE, flags="|".join(FLAG_VALUES.values()))
+    try:
+        response = await get_runtime().model_client.generate(ModelRequest([prompt], MAX_OUTPUT_TOKENS))
+        dishes = json.loads(extract_json_text(response.text))
+    except Exception as e:
+        print(f"Failed to translate {len(names)} names: {e}")
+        return {}
+    if not isinstance(dishes, list):
+        return {}
+
+    by_name = {normalize_name(name): name for name in names}
+    entries = {}
+    for dish in dishes:
+        if not isinstance(dish, dict):
+            continue
+        name = by_name.get(normalize_name(str(dish.get("originalName") or "")))
+        if name and dish.get("translatedName"):
+            entries[name] = _memory_entry(dish)
+    return entries
+
+
+async def translate_dishes(names: list[str], language: str = TRANSLATION_LANGUAGE) -> dict[str, dict]:
+    """
+    Находит переводы и описания для оригинальных названий: известные берутся из памяти переводов,
+    остальные генерируются пачками параллельно и сохраняются в память.
+    """
+    memory = get_runtime().translation_memory
+    known = await memory.get_many(names, language)
+    missing = [name for name in names if name not in known]
+    print(f"Translation memory: {len(known)} known, {len(missing)} to generate")
+
+    batches = [missing[i:i + TRANSLATION_BATCH_SIZE] for i in range(0, len(missing), TRANSLATION_BATCH_SIZE)]
+    generated = {}
+    for entries in await asyncio.gather(*(_translate_batch(batch, language) for batch in batches)):
+        generated.update(entries)
+    if generated:
+        await memory.set_many(generated, language)
+    return {**known, **generated}
+
+
+async def process_menu_two_phase(image_bytes: bytes, mime_type: str = "image/jpeg") -> dict | None:
+    """
+    Двухфазная обработка фото меню: с изображения извлекаются только названия, категории и цены,
+    а перевод, описание, ингредиенты и аллергены берутся из памяти переводов или генерируются
+    текстовым запросом только для новых блюд. Возвращает None, если текст распознать не удалось.
+    """
+    text = await extract_menu_items(image_bytes, mime_type)
+    if not text:
+        return None
+    try:
+        data = parse_menu_json(text)
+    except json.JSONDecodeError:
+        print("Failed to parse extracted names from:", text)
+        return None
+
+    items = [item for item in data.get(COMPACT_MENU_KEY) or []
+             if isinstance(item, dict) and str(item.get("n") or "").strip()]
+    names = list(dict.fromkeys(str(item["n"]).strip() for item in items))
+    translations = await translate_dishes(names)
+
+    menu = []
+    for item in items:
+        name = str(item["n"]).strip()
+        entry = translations.get(name, {})
+        # Блюдо без перевода все равно попадает в меню с оригинальным названием
+        dish = Dish.from_compact({**entry, "n": name, "c": item.get("c"), "pr": item.get("pr")})
+        menu.append(dish.to_dict())
+    return {"isPartial": bool(data.get(COMPACT_PARTIAL_KEY, False)), "menu": menu}
@@ -0,0 +1,76 @@
+import asyncio
+import multiprocessing
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from bot_instance import bot, dp
+from config import (
+    WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_WORKERS, WEBHOOK_MAX_CONNECTIONS,
+)
+from dispatcher import setup_dispatcher
+from job_queue import job_queue
+from metrics import metrics_handler
+
+
+async def health(request: web.Request) -> web.Response:
+    """Проверка живости для балансировщика: воркер отвечает и показывает загрузку своей очереди."""
+    return web.json_response({"status": "ok", "jobs": job_queue.metrics()})
+
+
+def create_app() -> web.Application:
+    """
+    aiohttp-приложение, принимающее обновления Telegram для существующего диспетчера.
+    Обновления обрабатываются в фоне, поэтому Telegram сразу получает ответ и не повторяет запрос.
+    """
+    setup_dispatcher()
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/healthz", health)
+    # Метрики своего процесса: при нескольких воркерах Prometheus видит тот, что принял соединение
+    app.router.add_get("/metrics", metrics_handler)
+    # Запуск и остановка приложения вызывают dp.startup / dp.shutdown (очередь задач, закрытие клиентов)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def set_webhook():
+    """Регистрирует адрес вебхука в Telegram. Вызывается один раз до запуска воркеров."""
+    if not WEBHOOK_BASE_URL:
+        raise ValueError("WEBHOOK_BASE_URL не задан. Укажите публичный HTTPS-адрес бота для режима webhook.")
+    url = WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH
+    try:
+        await bot.set_webhook(url, secret_token=WEBHOOK_SECRET, max_connections=WEBHOOK_MAX_CONNECTIONS)
+        print(f"Вебхук установлен: {url}")
+    finally:
+        await bot.session.close()
+
+
+def serve(reuse_port: bool = False):
+    web.run_app(create_app(), host=WEBHOOK_HOST, port=WEBHOOK_PORT, reuse_port=reuse_port)
+
+
+def run_webhook(workers: int = WEBHOOK_WORKERS):
+    """
+    Запускает режим webhook: `workers` процессов слушают один порт через SO_REUSEPORT,
+    и ядро распределяет между ними входящие соединения. Реплики на других узлах
+    запускаются так же и ставятся за общий балансировщик.
+    """
+    asyncio.run(set_webhook())
+    print(f"Бот запущен в режиме webhook на {WEBHOOK_HOST}:{WEBHOOK_PORT}, воркеров: {workers}")
+    if workers <= 1:
+        serve()
+        return
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=serve, args=(True,), name=f"webhook-{i}") for i in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Воркеры получают SIGINT вместе с родителем и завершаются сами, дожидаемся их
+        for process in processes:
+            process.join()